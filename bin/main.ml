@@ -44,30 +44,170 @@ let print_sexp =
           | _             -> failwith "invalid debug!"
     )
 
+(** sets how loops are compiled, from the --loops flag *)
+let set_loops (loops : string option) : unit =
+  Bc.symbolic_loops := (match loops with
+    | None | Some "unroll"  -> false
+    | Some "symbolic"       -> true
+    | Some m                -> raise (Bc.BCError ("Unknown loop mode "^m)))
+
+let loops_doc = "mode loop compilation.\n unroll (default) : compile every iteration from scratch\n symbolic : build the body's formulae once and rename them per iteration.\n Only this front-end work is shared: every iteration is still translated to BDDs.\n"
+
 let run =
   Command.basic
     ~summary:"dappl's meu solver."
     ~readme:(fun () ->
       "
-       \tdappl run [--cache true|false] [--debug 0 | 1 | 2] $FILE \n\n
+       \tdappl run [--cache true|false] [--debug 0 | 1 | 2] [--result-cache DIR] [--order STRATEGY] [--ub-cache-limit MB] [--profile OUT] [--loops unroll|symbolic] [--jobs N] [--time-budget SECONDS] [--ast-cache] $FILE \n\n
       ")
      (let%map_open.Command
         with_cache = flag "--cache" (optional bool)
          ~doc:"bool toggles caching in ub calculation.\n true (default) : enables caching\n false : disables caching.\n"
         and debug_level = flag "--debug" (optional int)
          ~doc:"int run in debug mode.\n 0 (default) : no debug\n1 : emits AST\n2 : emits AST and weight maps\n"
+        and result_cache = flag "--result-cache" (optional string)
+         ~doc:"dir reuse the MEU and size of earlier runs stored in dir, keyed by the canonical PropExpr\n and every option that affects them. Nothing compiled is cached.\n"
+        and order = flag "--order" (optional string)
+         ~doc:"strategy BDD variable order.\n encounter (default) | min-fill | interaction | file:PATH\n optionally followed by ,decisions-first or ,decisions-last\n"
+        and ub_cache_limit = flag "--ub-cache-limit" (optional int)
+         ~doc:"MB run MEU without the ub cache if the process takes more than MB once compiled.\n This is not a memory budget: nothing is evicted, and nothing bounds\n RSDD's node table, so compilation itself can still take any amount of memory.\n"
+        and profile = flag "--profile" (optional string)
+         ~doc:"file write a JSON profile of the run (phase times and counters) to file.\n"
+        and jobs = flag "--jobs" (optional int)
+         ~doc:"n split MEU over the first decisions into sub-problems solved by n worker processes.\n"
+        and time_budget = flag "--time-budget" (optional float)
+         ~doc:"seconds anytime mode: stream MEU bounds as JSON lines and stop after seconds.\n The upper bound is, per sub-problem not solved yet, the sum of the positive rewards its\n decisions do not rule out. Not allowed with --jobs, --profile or --result-cache.\n"
+        and loops = flag "--loops" (optional string) ~doc:loops_doc
+        and ast_cache = flag "--ast-cache" no_arg
+         ~doc:" reuse the parsed program and its Boolean formulae cached in $FILE.bc, if up to date.\n"
         and filename = anon ("filename" %: string) in
+        fun () ->
+          if Option.is_some time_budget then (
+            if Option.is_some result_cache then
+              raise (Bc.BCError "--result-cache cannot be combined with --time-budget, which streams bounds");
+            if Option.is_some jobs then
+              raise (Bc.BCError "--jobs cannot be combined with --time-budget, which solves sub-problems in turn");
+            if Option.is_some profile then
+              raise (Bc.BCError "--profile cannot be combined with --time-budget, which may be cut off"));
+          Profile.enabled := Option.is_some profile;
+          set_loops loops;
+          let t0 = Core_unix.gettimeofday() in
+          let (internal, prop) = if ast_cache then Ast_cache.front_end filename
+                                 else Ast_cache.front_end_of_source (read_whole_file filename) in
+          let ub_cache_limit = Option.map ub_cache_limit ~f:(fun mb -> mb * 1024) in
+          let order = Option.map order ~f:(fun s -> Order.compute (Order.of_string s)) in
+          let t = Core_unix.gettimeofday() in
+          let debug = (match debug_level with | Some i -> i | None -> 0) in
+          let cache = Option.value with_cache ~default:true in
+          let meu_options = Option.value_map jobs ~default:[] ~f:(fun n -> [sprintf "jobs=%i" n]) in
+          let infer = fun meu -> Bc.infer ?result_cache ?order ?ub_cache_limit ?meu ~meu_options ~prop internal cache debug in
+          match time_budget with
+          | Some budget ->
+            Anytime.run t0 budget (fun () -> ignore (infer (Some (Anytime.perform_meu t0))))
+          | None        ->
+          let ((_, meu),size) = infer (Option.map jobs ~f:Parallel.perform_meu) in
+          let t' = Core_unix.gettimeofday() in
+          Format.printf  "MEU is %F\nTime elapsed: %F\n" meu (t' -. t0);
+          Format.printf  "size is %n\n" size;
+          Format.printf  "peak memory is %n kB\n" (Mem.peak_kb ());
+          Format.printf  "Front-end time: %F\n" (t -. t0);
+          Format.printf  "Back-end time: %F\n" (t' -. t);
+          Option.iter profile ~f:(fun out ->
+            Profile.set "file" (Profile.String filename);
+            Profile.set "meu" (Profile.Float meu);
+            Profile.set "time" (Profile.Float (t' -. t0));
+            Profile.set "peak_kb" (Profile.Int (Mem.peak_kb ()));
+            Profile.write out)
+     )
+
+(** reads a sweep file: one sweep point per line, each a list of name=value pairs *)
+let read_sweep_points (filename : string) : (string * float) list list =
+  In_channel.read_lines filename
+  |> List.map ~f:(fun line ->
+      String.split_on_chars line ~on:[' '; '\t']
+      |> List.filter ~f:(fun tok -> not (String.is_empty tok))
+      |> List.map ~f:(fun tok ->
+          let (x, v) = String.lsplit2_exn tok ~on:'=' in
+          (x, Float.of_string v)))
+  |> List.filter ~f:(fun l -> not (List.is_empty l))
+
+let sweep =
+  Command.basic
+    ~summary:"dappl's meu solver over many weight assignments."
+    ~readme:(fun () ->
+      "
+       \tdappl sweep [--cache true|false] $FILE $POINTS \n\n\
+        Compiles $FILE once, then reruns MEU for every line of $POINTS.\n\
+        Each line is a list of name=value pairs, e.g. flip_0=0.3 rew_2=10.\n\
+        Names are those of the weight map; see dappl run --debug 2 $FILE.\n
+      ")
+     (let%map_open.Command
+        with_cache = flag "--cache" (optional bool)
+         ~doc:"bool toggles caching in ub calculation.\n true (default) : enables caching\n false : disables caching.\n"
+        and filename = anon ("filename" %: string)
+        and points = anon ("points" %: string) in
         fun () ->
           let parsed = parse_from_file filename in
           let internal = (Core_grammar.from_external_program parsed).body in
+          let cache = Option.value with_cache ~default:true in
           let t = Core_unix.gettimeofday() in
-          let debug = (match debug_level with | Some i -> i | None -> 0) in
-          let ((_, meu),size) = (match with_cache with
-          | Some b  -> Bc.infer internal b debug
-          | None    -> Bc.infer internal true debug) in
+          let compiled = Bc.compile (Bc.bc internal) in
+          let t' = Core_unix.gettimeofday() in
+          Format.printf "Compile time: %F\n" (t' -. t);
+          List.iter (read_sweep_points points) ~f:(fun params ->
+            let t = Core_unix.gettimeofday() in
+            let ((_, meu), _) = Bc.perform_meu (Bc.reweight compiled params) cache in
+            let t' = Core_unix.gettimeofday() in
+            Format.printf "MEU is %F\nTime elapsed: %F\n%!" meu (t' -. t))
+     )
+
+(** reads a batch file: one variant per line, each a list of name=true|false observations *)
+let read_variants (filename : string) : (string * bool) list list =
+  In_channel.read_lines filename
+  |> List.map ~f:(fun line ->
+      String.split_on_chars line ~on:[' '; '\t']
+      |> List.filter ~f:(fun tok -> not (String.is_empty tok))
+      |> List.map ~f:(fun tok ->
+          let (x, v) = String.lsplit2_exn tok ~on:'=' in
+          (x, Bool.of_string v)))
+  |> List.filter ~f:(fun l -> not (List.is_empty l))
+
+let batch =
+  Command.basic
+    ~summary:"dappl's meu solver over many observations."
+    ~readme:(fun () ->
+      "
+       \tdappl batch [--cache true|false] [--loops unroll|symbolic] $FILE $VARIANTS \n\n\
+        Compiles $FILE once, then reruns MEU with the observations on every line of $VARIANTS\n\
+        conjoined to its evidence. Each line is a list of name=true|false pairs naming variables\n\
+        bound in $FILE, e.g. rain=true alarm=false.\n\
+        Prints one JSON line with the compile time, then one JSON line per variant.\n
+      ")
+     (let%map_open.Command
+        with_cache = flag "--cache" (optional bool)
+         ~doc:"bool toggles caching in ub calculation.\n true (default) : enables caching\n false : disables caching.\n"
+        and loops = flag "--loops" (optional string) ~doc:loops_doc
+        and filename = anon ("filename" %: string)
+        and variants = anon ("variants" %: string) in
+        fun () ->
+          set_loops loops;
+          let parsed = parse_from_file filename in
+          let internal = (Core_grammar.from_external_program parsed).body in
+          let cache = Option.value with_cache ~default:true in
+          let variants = read_variants variants in
+          let t = Core_unix.gettimeofday() in
+          let prop = Bc.bc internal in
+          let compiled = Bc.compile ~order:(Bc.observed_order prop variants) prop in
           let t' = Core_unix.gettimeofday() in
-          Format.printf  "MEU is %F\nTime elapsed: %F\n" meu (t' -. t);
-          Format.printf  "size is %n\n" size
+          let num = fun x -> if Float.is_finite x then sprintf "%.17g" x else "null" in
+          printf "{\"compile_time\": %s}\n%!" (num (t' -. t));
+          List.iteri variants ~f:(fun i obs ->
+            let t = Core_unix.gettimeofday() in
+            let ((_, meu), _) = Bc.perform_meu (Bc.observe compiled prop obs) cache in
+            let t' = Core_unix.gettimeofday() in
+            let observed = String.concat ~sep:" " (List.map obs ~f:(fun (x, b) -> sprintf "%s=%b" x b)) in
+            printf "{\"variant\": %i, \"observe\": %S, \"meu\": %s, \"time\": %s}\n%!"
+              i observed (num meu) (num (t' -. t)))
      )
 
 let gen_tests =
@@ -99,6 +239,6 @@ let gen_tests =
 let command =
   Command.group
     ~summary:"Only the best for the people!"
-    [ "run", run; "ast", print_sexp ; "test" , gen_tests]
+    [ "run", run; "sweep", sweep; "batch", batch; "ast", print_sexp ; "test" , gen_tests]
 
 let () = Command_unix.run ~version:"0.1" command
\ No newline at end of file
@@ -0,0 +1,3 @@
+from dappl_mc.syntax import DapplError
+from dappl_mc.parser import parse, parse_file
+from dappl_mc.sampler import Estimate, estimate, decisions, policy_of
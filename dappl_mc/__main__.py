@@ -0,0 +1,34 @@
+import argparse
+import time
+from dappl_mc import *
+
+#######################
+# python3 -m dappl_mc FILE [--policy a,b] [--samples N] [--processes P] [--seed S]
+# estimates the EU of a fixed policy where exact `dappl run` does not fit.
+#######################
+
+def main () :
+  parser = argparse.ArgumentParser(prog="dappl_mc")
+  parser.add_argument("file")
+  parser.add_argument("--policy", default="", \
+                      help="comma-separated decision alternatives to take (default: the first of each decision)")
+  parser.add_argument("--samples", type=int, default=1 << 20)
+  parser.add_argument("--processes", type=int, default=None, \
+                      help="worker processes for more than one chunk of samples (default: one per CPU)")
+  parser.add_argument("--chunk", type=int, default=1 << 20, help="samples per process task")
+  parser.add_argument("--seed", type=int, default=None)
+  args = parser.parse_args()
+
+  t = time.time()
+  program = parse_file(args.file)
+  policy = policy_of(program, [x for x in args.policy.split(",") if x])
+  est = estimate(program, policy, args.samples, args.processes, args.seed, args.chunk)
+  print(f"EU is {est.eu}")
+  print(f"Time elapsed: {time.time() - t}")
+  print(f"95% CI: [{est.low}, {est.high}]")
+  print(f"Standard error: {est.stderr}")
+  print(f"Samples: {est.samples} (effective {est.ess})")
+  print(f"Policy: {','.join(x for x in policy if policy[x])}")
+
+if __name__ == "__main__" :
+  main()
@@ -0,0 +1,196 @@
+import re
+from dappl_mc.syntax import *
+
+#######################
+# A recursive descent parser for the dappl surface syntax, following
+# lib/lexer.mll and lib/parser.mly. Operators bind as declared there
+# (|| loosest, then &&, then !, then ^), and the trailing expression
+# of if, reward, observe, bind, return and choose extends as far as it can.
+#######################
+
+KEYWORDS = {"if", "else", "discrete", "then", "tt", "ff", "in", "loop", "return", \
+            "observe", "flip", "reward", "choose", "with"}
+
+# Longest match first, as ocamllex does.
+TOKEN = re.compile(r"""
+    (?P<white>[ \t\r\n]+)
+  | (?P<comment>//[^\n]*)
+  | (?P<op>&&|\|\||<-|->|[+*/^!|()\[\]{};:,])
+  | (?P<num>-?[0-9]*\.[0-9]*(?:[eE][-+]?[0-9]+)?|-?[0-9]+(?:[eE][-+]?[0-9]+)?)
+  | (?P<minus>-)
+  | (?P<id>[a-zA-Z_][a-zA-Z0-9_]*)
+""", re.VERBOSE)
+
+def tokenize (source : str) :
+  tokens = []
+  pos = 0
+  while pos < len(source) :
+    m = TOKEN.match(source, pos)
+    if m is None :
+      raise DapplError(f"Unexpected character {source[pos]!r} at offset {pos}")
+    kind = m.lastgroup
+    text = m.group()
+    if kind == "id" and text in KEYWORDS :
+      tokens.append((text, text))
+    elif kind in ("op", "minus") :
+      tokens.append((text, text))
+    elif kind in ("num", "id") :
+      tokens.append((kind, text))
+    pos = m.end()
+  tokens.append(("eof", ""))
+  return tokens
+
+class Parser :
+  def __init__ (self, source : str) :
+    self.tokens = tokenize(source)
+    self.pos = 0
+
+  def peek (self, offset : int = 0) :
+    return self.tokens[min(self.pos + offset, len(self.tokens) - 1)][0]
+
+  def next (self) :
+    token = self.tokens[self.pos]
+    self.pos += 1
+    return token
+
+  def expect (self, kind : str) :
+    (k, text) = self.next()
+    if k != kind :
+      raise DapplError(f"Expected {kind} but found {text or k} at token {self.pos}")
+    return text
+
+  def program (self) :
+    body = self.expr()
+    self.expect("eof")
+    return body
+
+  def num (self) :
+    n = float(self.expect("num"))
+    if self.peek() == "/" :
+      self.next()
+      n = n / float(self.expect("num"))
+    return n
+
+  def expr (self) :
+    left = self.and_expr()
+    while self.peek() == "||" :
+      self.next()
+      left = Or(left, self.and_expr())
+    return left
+
+  def and_expr (self) :
+    left = self.not_expr()
+    while self.peek() == "&&" :
+      self.next()
+      left = And(left, self.not_expr())
+    return left
+
+  def not_expr (self) :
+    if self.peek() == "!" :
+      self.next()
+      return Not(self.not_expr())
+    return self.xor_expr()
+
+  def xor_expr (self) :
+    left = self.atom()
+    while self.peek() == "^" :
+      self.next()
+      left = Xor(left, self.atom())
+    return left
+
+  def atom (self) :
+    kind = self.peek()
+    if kind == "(" :
+      self.next()
+      e = self.expr()
+      self.expect(")")
+      return e
+    if kind == "[" :
+      self.next()
+      names = [self.expect("id")]
+      while self.peek() == "," :
+        self.next()
+        names.append(self.expect("id"))
+      self.expect("]")
+      return Decision(names)
+    if kind == "choose" :
+      self.next()
+      e = self.expr()
+      self.expect("with")
+      self.expect("|")
+      branches = [self.pattern()]
+      while self.peek() == "|" :
+        self.next()
+        branches.append(self.pattern())
+      return ChooseWith(e, branches)
+    if kind == "tt" :
+      self.next()
+      return TrueE()
+    if kind == "ff" :
+      self.next()
+      return FalseE()
+    if kind == "id" and self.peek(1) == "<-" :
+      name = self.expect("id")
+      self.next()
+      bound = self.expr()
+      self.expect(";")
+      return Bind(name, bound, self.expr())
+    if kind == "id" :
+      return Ident(self.expect("id"))
+    if kind == "flip" :
+      self.next()
+      return Flip(self.num())
+    if kind == "reward" :
+      self.next()
+      k = self.num()
+      self.expect(";")
+      return Reward(k, self.expr())
+    if kind == "observe" :
+      self.next()
+      e = self.expr()
+      self.expect(";")
+      return Observe(e, self.expr())
+    if kind == "if" :
+      self.next()
+      g = self.expr()
+      self.expect("then")
+      thn = self.expr()
+      self.expect("else")
+      return Ite(g, thn, self.expr())
+    if kind == "return" :
+      self.next()
+      return Return(self.expr())
+    if kind == "discrete" :
+      self.next()
+      self.expect("[")
+      alternatives = [self.alternative()]
+      while self.peek() == "," :
+        self.next()
+        alternatives.append(self.alternative())
+      self.expect("]")
+      return Discrete(alternatives)
+    if kind == "loop" :
+      self.next()
+      n = int(self.num())
+      self.expect("{")
+      body = self.expr()
+      self.expect("}")
+      return Loop(n, body)
+    raise DapplError(f"Unexpected {self.tokens[self.pos][1] or kind} at token {self.pos}")
+
+  def pattern (self) :
+    name = self.expect("id")
+    self.expect("->")
+    return (name, self.expr())
+
+  def alternative (self) :
+    name = self.expect("id")
+    self.expect(":")
+    return (name, self.num())
+
+def parse (source : str) :
+  return Parser(source).program()
+
+def parse_file (filename : str) :
+  with open(filename) as f :
+    return parse(f.read())
@@ -0,0 +1,218 @@
+import multiprocessing
+from collections import namedtuple
+import numpy as np
+from dappl_mc.syntax import *
+
+#######################
+# Vectorized Monte Carlo evaluation of a dappl program under a fixed policy.
+#
+# An expression evaluates to a Value over n samples at once: its Boolean
+# value, whether the evidence met on the way was accepted, and the reward
+# collected on the path taken. These are the unn, acc and reward variables
+# of lib/bc.ml, sampled rather than compiled, so the estimate
+#   EU = E[w * reward * [value and acc]] / E[w * [acc]]
+# targets the number `dappl run` computes for the same policy.
+#
+# Names of decisions and discretes are global, as in bc: a decision takes
+# the alternative the policy picks, and a discrete samples one alternative,
+# with the odds dappl gives it once destructed by choose (an exactly-one
+# constraint over independent flips p_i). Evidence is likelihood-weighted:
+# a variable bound to a flip and observed on every path is fixed to true,
+# and the sample weighed by the flip's probability. Other observations
+# weigh samples by 0 or 1.
+#######################
+
+Value = namedtuple("Value", "val, acc, reward")
+
+Estimate = namedtuple("Estimate", "eu, stderr, low, high, samples, ess")
+
+# Samples per chunk, the unit of work of a process.
+CHUNK = 1 << 20
+# Two-sided 95% normal quantile for the confidence interval.
+Z = 1.959963984540054
+
+# Whether e observes x on every path, before x is bound again.
+def observed_on_every_path (e, x : str) :
+  match e :
+    case Observe(Ident(s), body) :
+      return s == x or observed_on_every_path(body, x)
+    case Bind(y, bound, body) :
+      return observed_on_every_path(bound, x) or (y != x and observed_on_every_path(body, x))
+    case Reward(_, body) | Return(body) | Not(body) | Loop(_, body) :
+      return observed_on_every_path(body, x)
+    case And(l, r) | Or(l, r) | Xor(l, r) :
+      return observed_on_every_path(l, x) or observed_on_every_path(r, x)
+    case _ :
+      return False
+
+class Sampler :
+  # policy maps each decision name to True or False.
+  def __init__ (self, n : int, rng : np.random.Generator, policy : dict) :
+    self.n = n
+    self.rng = rng
+    self.policy = policy
+    self.names = {}
+    self.weight = np.ones(n)
+
+  def const (self, b : bool) :
+    return np.full(self.n, b)
+
+  def lookup (self, env : dict, x : str) :
+    if x in env :
+      return env[x]
+    if x in self.names :
+      return self.names[x]
+    raise DapplError(f"Unbound variable {x}")
+
+  def decision (self, names : list) :
+    for x in names :
+      if x not in self.names :
+        self.names[x] = self.const(bool(self.policy.get(x, False)))
+    return self.const(True)
+
+  def discrete (self, alternatives : list) :
+    names = [x for (x, _) in alternatives]
+    if not all(x in self.names for x in names) :
+      p = np.array([p for (_, p) in alternatives], dtype=float)
+      odds = np.array([p[i] * np.prod(np.delete(1 - p, i)) for i in range(len(p))])
+      picks = self.rng.choice(len(names), size=self.n, p=odds / odds.sum())
+      for (i, x) in enumerate(names) :
+        self.names[x] = picks == i
+    return self.const(True)
+
+  # spine is whether e is evaluated on every path, outside of any branch.
+  def eval (self, e, env : dict, spine : bool = True) :
+    match e :
+      case TrueE() :
+        return Value(self.const(True), self.const(True), np.zeros(self.n))
+      case FalseE() :
+        return Value(self.const(False), self.const(True), np.zeros(self.n))
+      case Ident(x) :
+        return Value(self.lookup(env, x), self.const(True), np.zeros(self.n))
+      case Flip(p) :
+        return Value(self.rng.random(self.n) < p, self.const(True), np.zeros(self.n))
+      case Discrete(alternatives) :
+        return Value(self.discrete(alternatives), self.const(True), np.zeros(self.n))
+      case Decision(names) :
+        return Value(self.decision(names), self.const(True), np.zeros(self.n))
+      case Return(body) :
+        return self.eval(body, env, spine)
+      case Reward(k, body) :
+        v = self.eval(body, env, spine)
+        return Value(v.val, v.acc, v.reward + k)
+      case Observe(Ident(x), body) :
+        v = self.eval(body, env, spine)
+        return Value(v.val, v.acc & self.lookup(env, x), v.reward)
+      case Observe(_, _) :
+        raise DapplError("Expected ident on observe")
+      case Ite(Ident(x), thn, els) :
+        g = self.lookup(env, x)
+        t = self.eval(thn, env, False)
+        f = self.eval(els, env, False)
+        return Value(np.where(g, t.val, f.val), np.where(g, t.acc, f.acc), np.where(g, t.reward, f.reward))
+      case Ite(_, _, _) :
+        raise DapplError("Expected ident on ITE")
+      case ChooseWith(Ident(x), branches) :
+        d = self.lookup(env, x)
+        val = self.const(False)
+        acc = self.const(False)
+        reward = np.zeros(self.n)
+        for (name, body) in branches :
+          v = self.eval(body, env, False)
+          chosen = self.lookup({}, name)
+          val = val | (chosen & v.val)
+          acc = acc | (chosen & v.acc)
+          reward = reward + np.where(chosen & v.val, v.reward, 0.0)
+        return Value(d & val, d & acc, reward)
+      case ChooseWith(_, _) :
+        raise DapplError("Expected ident on Choose")
+      case Bind(x, Flip(p), body) if spine and observed_on_every_path(body, x) :
+        self.weight = self.weight * p
+        return self.eval(body, {**env, x : self.const(True)}, spine)
+      case Bind(x, bound, body) :
+        b = self.eval(bound, env, spine)
+        v = self.eval(body, {**env, x : b.val}, spine)
+        return Value(v.val, b.acc & v.acc, b.reward + v.reward)
+      case Loop(n, body) :
+        val, acc, reward = self.const(True), self.const(True), np.zeros(self.n)
+        for _ in range(n) :
+          v = self.eval(body, env, spine)
+          val, acc, reward = val & v.val, acc & v.acc, reward + v.reward
+        return Value(val, acc, reward)
+      case And(l, r) | Or(l, r) | Xor(l, r) :
+        a = self.eval(l, env, spine)
+        b = self.eval(r, env, spine)
+        op = {And : np.logical_and, Or : np.logical_or, Xor : np.logical_xor}[type(e)]
+        return Value(op(a.val, b.val), a.acc & b.acc, a.reward + b.reward)
+      case Not(body) :
+        v = self.eval(body, env, spine)
+        return Value(~v.val, v.acc, v.reward)
+    raise DapplError(f"Cannot evaluate {e}")
+
+# The sums over one chunk of samples that the estimate is built from.
+def run_chunk (program, policy : dict, n : int, seed) :
+  sampler = Sampler(n, np.random.default_rng(seed), policy)
+  v = sampler.eval(program, {})
+  num = sampler.weight * np.where(v.val & v.acc, v.reward, 0.0)
+  den = sampler.weight * v.acc
+  return np.array([n, num.sum(), den.sum(), (num * num).sum(), (den * den).sum(), (num * den).sum()])
+
+def _run_chunk (args) :
+  return run_chunk(*args)
+
+# Estimates the EU of program under policy from samples samples, with a 95%
+# confidence interval by the delta method for the ratio of the two means.
+# Chunks of CHUNK samples run on processes processes (default: one per CPU),
+# or in this process if there is only one chunk or processes is 1.
+def estimate (program, policy : dict, samples : int = CHUNK, processes : int = None, \
+              seed : int = None, chunk : int = CHUNK) :
+  sizes = [min(chunk, samples - i) for i in range(0, samples, chunk)]
+  seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+  tasks = [(program, policy, n, s) for (n, s) in zip(sizes, seeds)]
+  if processes == 1 or len(tasks) == 1 :
+    sums = [_run_chunk(t) for t in tasks]
+  else :
+    with multiprocessing.get_context("fork").Pool(processes) as pool :
+      sums = pool.map(_run_chunk, tasks)
+  (n, s_num, s_den, s_num2, s_den2, s_numden) = np.sum(sums, axis=0)
+  if s_den == 0 :
+    raise DapplError("No sample satisfies the evidence")
+  eu = s_num / s_den
+  m_num, m_den = s_num / n, s_den / n
+  var_num = s_num2 / n - m_num ** 2
+  var_den = s_den2 / n - m_den ** 2
+  cov = s_numden / n - m_num * m_den
+  var = max(var_num - 2 * eu * cov + eu ** 2 * var_den, 0.0) / (n * m_den ** 2)
+  stderr = float(np.sqrt(var))
+  ess = s_den ** 2 / s_den2
+  return Estimate(float(eu), stderr, float(eu - Z * stderr), float(eu + Z * stderr), int(n), float(ess))
+
+# The decision groups of a program, in the order they are declared.
+def decisions (e) :
+  match e :
+    case Decision(names) :
+      return [names]
+    case Reward(_, body) | Return(body) | Not(body) | Loop(_, body) :
+      children = [body]
+    case Bind(_, l, r) | Observe(l, r) | And(l, r) | Or(l, r) | Xor(l, r) :
+      children = [l, r]
+    case Ite(g, thn, els) :
+      children = [g, thn, els]
+    case ChooseWith(x, branches) :
+      children = [x] + [body for (_, body) in branches]
+    case _ :
+      children = []
+  groups = []
+  for child in children :
+    groups += [g for g in decisions(child) if g not in groups]
+  return groups
+
+# A policy from the chosen alternatives: every other alternative of their
+# groups is false, and groups with no chosen alternative take their first.
+def policy_of (program, chosen : list) :
+  policy = {}
+  for group in decisions(program) :
+    picked = [x for x in group if x in chosen] or group[:1]
+    for x in group :
+      policy.setdefault(x, x == picked[0])
+  return policy
@@ -0,0 +1,28 @@
+from collections import namedtuple
+
+#######################
+# The dappl core grammar (lib/core_grammar.ml), one namedtuple per constructor.
+#######################
+
+And         = namedtuple("And", "left, right")
+Or          = namedtuple("Or", "left, right")
+Xor         = namedtuple("Xor", "left, right")
+Not         = namedtuple("Not", "expr")
+Ite         = namedtuple("Ite", "guard, thn, els")
+# branches is a list of (name, expr)
+ChooseWith  = namedtuple("ChooseWith", "expr, branches")
+Flip        = namedtuple("Flip", "prob")
+Reward      = namedtuple("Reward", "reward, expr")
+Decision    = namedtuple("Decision", "names")
+Bind        = namedtuple("Bind", "name, bound, body")
+Observe     = namedtuple("Observe", "expr, body")
+Ident       = namedtuple("Ident", "name")
+Return      = namedtuple("Return", "expr")
+# alternatives is a list of (name, prob)
+Discrete    = namedtuple("Discrete", "alternatives")
+Loop        = namedtuple("Loop", "times, body")
+TrueE       = namedtuple("TrueE", "")
+FalseE      = namedtuple("FalseE", "")
+
+class DapplError (Exception) :
+  pass
@@ -0,0 +1,185 @@
+"""
+Knowledge compilation backend selection for maxeu and ULearner.
+
+Which compiler is fastest varies across program families, so the backend is picked per formula: from timings
+recorded earlier for the same family, on the runs whose formula features are closest, or, with no record yet, by
+racing the candidates one after the other in child processes under a time limit and a memory cap. Every timing a
+race produces is recorded for later runs.
+"""
+import json
+import math
+import multiprocessing
+import os
+import re
+import resource
+import time
+
+from problog import get_evaluatable
+from problog.sdd_formula_explicit import x_constrained_named
+from sdd_options import SddOptions, compile_sddx
+
+# maxeu needs an X-constrained compiler, so its candidates differ only in the initial vtree.
+MAXEU_BACKENDS = ['sddx', 'sddx-right', 'sddx-left', 'sddx-vertical']
+ULEARNER_BACKENDS = ['ddnnf', 'sdd', 'sddx']
+
+# The user's cache directory rather than the repository, which --backend auto would otherwise write into.
+TIMINGS_FILE = os.environ.get('DERK_BACKEND_TIMINGS',
+                              os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                                           'dappl', 'backend_timings.json'))
+# Memory cap in MB for each compiler in a race, if any.
+MEM_CAP_MB = int(os.environ['DERK_BACKEND_MEM_CAP']) if os.environ.get('DERK_BACKEND_MEM_CAP') else None
+
+
+def family_of(filename):
+    """The program family of a file: its base name without extension and without numbers, e.g. ladder_10.pl -> ladder."""
+    name = os.path.basename(filename).split('.')[0]
+    return re.sub(r'[_\-]*\d+', '', name) or name
+
+
+def compile_with(lf, backend, decisions=None):
+    """Compile lf with the named backend. decisions, if any, become the X-constraint."""
+    var_constraint = x_constrained_named(X_named=decisions) if decisions is not None else None
+    if backend.startswith('sddx-'):
+        return compile_sddx(lf, var_constraint, SddOptions(vtree=backend[len('sddx-'):]))
+    kc_class = get_evaluatable(name=backend)
+    if var_constraint is None:
+        return kc_class.create_from(lf)
+    return kc_class.create_from(lf, var_constraint=var_constraint)
+
+
+def features(lf, elimination_budget=2000):
+    """
+    Cheap features of a ground formula: node counts per type, total clause size, and a treewidth proxy, the width
+    of a greedy min-degree elimination of the primal graph (or its maximum degree, beyond elimination_budget nodes).
+    """
+    counts = {'atom': 0, 'conj': 0, 'disj': 0}
+    neighbours = dict()
+    clause_size = 0
+    for i, n, t in lf:
+        counts[t] = counts.get(t, 0) + 1
+        if t in ('conj', 'disj'):
+            clause_size += len(n.children)
+            for c in n.children:
+                neighbours.setdefault(i, set()).add(abs(c))
+                neighbours.setdefault(abs(c), set()).add(i)
+    if len(neighbours) > elimination_budget:
+        width = max((len(v) for v in neighbours.values()), default=0)
+        neighbours = dict()
+    else:
+        width = 0
+    while neighbours:
+        x = min(neighbours, key=lambda v: len(neighbours[v]))
+        nbrs = neighbours.pop(x)
+        width = max(width, len(nbrs))
+        for y in nbrs:
+            neighbours[y].discard(x)
+            neighbours[y] |= nbrs - {y}
+    return {'atoms': counts['atom'], 'conj': counts['conj'], 'disj': counts['disj'],
+            'clause_size': clause_size, 'width': width}
+
+
+def load_timings(path=TIMINGS_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_timings(family, feats, timings, path=TIMINGS_FILE, censored=()):
+    """
+    Append one run per backend in timings ({backend : seconds, or None if it failed}) to the record of family. The
+    runs of the backends in censored were cut off, and took at least their seconds.
+    """
+    records = load_timings(path)
+    for backend, seconds in timings.items():
+        records.setdefault(family, []).append({'features': feats, 'backend': backend, 'time': seconds,
+                                               'censored': backend in censored})
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = '%s.%s.tmp' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(records, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _distance(a, b):
+    return sum((math.log1p(a.get(k, 0)) - math.log1p(b.get(k, 0))) ** 2 for k in set(a) | set(b))
+
+
+def estimate(family, feats, candidates, k=3, path=TIMINGS_FILE):
+    """
+    The candidate with the lowest mean time over its k recorded runs closest in features, among candidates that
+    never failed on those runs. A run that was cut off counts as the time it was cut off at, a lower bound, and on
+    equal means the candidate with fewer such runs wins. None when some candidate has no record for the family.
+    """
+    runs = load_timings(path).get(family, [])
+    best, best_key = None, None
+    for backend in candidates:
+        mine = sorted((r for r in runs if r['backend'] == backend), key=lambda r: _distance(r['features'], feats))[:k]
+        if not mine:
+            return None
+        if any(r['time'] is None for r in mine):
+            continue
+        key = (sum(r['time'] for r in mine) / len(mine), sum(1 for r in mine if r.get('censored', False)))
+        if best_key is None or key < best_key:
+            best, best_key = backend, key
+    return best
+
+
+def _timed_compile(lf, backend, decisions, mem_cap_mb, queue):
+    if mem_cap_mb is not None:
+        cap = mem_cap_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (cap, cap))
+    start = time.time()
+    compile_with(lf, backend, decisions)
+    queue.put(time.time() - start)
+
+
+def race(lf, candidates, decisions=None, time_limit=60.0, mem_cap_mb=None):
+    """
+    Compile lf with each candidate in turn, each in a child process under mem_cap_mb, and with a time limit that
+    shrinks to the best time so far.
+
+    :return: ({backend : seconds, or None if it failed}, the set of backends that were cut off). A backend that was
+        cut off took at least the limit it was given, which is its seconds.
+    """
+    ctx = multiprocessing.get_context('fork')
+    timings = dict()
+    censored = set()
+    limit = time_limit
+    for backend in candidates:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_timed_compile, args=(lf, backend, decisions, mem_cap_mb, queue))
+        process.start()
+        process.join(limit)
+        if process.is_alive():
+            process.kill()
+            process.join()
+            timings[backend] = limit
+            censored.add(backend)
+            continue
+        timings[backend] = queue.get() if process.exitcode == 0 and not queue.empty() else None
+        if timings[backend] is not None:
+            limit = min(limit, timings[backend])
+    return timings, censored
+
+
+def choose(lf, candidates, family, decisions=None, time_limit=60.0, mem_cap_mb=MEM_CAP_MB, path=TIMINGS_FILE):
+    """
+    Pick the backend to compile lf with: estimated from the record of family if every candidate has been timed on
+    it, raced otherwise. Falls back to the first candidate that was cut off if none finished within the limits, and
+    to the first candidate if all failed.
+
+    :return: (backend, features of lf, timings of the race or None if estimated)
+    """
+    feats = features(lf)
+    backend = estimate(family, feats, candidates, path=path)
+    if backend is not None:
+        return backend, feats, None
+    timings, censored = race(lf, candidates, decisions, time_limit, mem_cap_mb)
+    record_timings(family, feats, timings, path, censored)
+    finished = {b: t for b, t in timings.items() if t is not None and b not in censored}
+    if finished:
+        return min(finished, key=finished.get), feats, timings
+    return next((b for b in candidates if b in censored), candidates[0]), feats, timings
@@ -3,10 +3,14 @@ ProbLog expected utility computation task using aProbLog mechanics.
 
 Copyright 2019 KU Leuven, DTAI Research Group
 """
+import heapq
+import itertools
 import sys
 import time
 from collections import namedtuple
 
+import numpy as np
+
 import graphviz
 from graphviz import Digraph
 from ulearner import PrinterDefault
@@ -21,11 +25,18 @@ from problog.util import init_logger
 from problog.sdd_formula import SDD
 from problog.sdd_formula import x_constrained
 from problog.formula import BaseFormula, LogicFormula
+from sdd_options import SddOptions, VTREE_TYPES, compile_sddx, phase_stats
+import backend
 
 printer = PrinterDefault()
 
 pn_weight = namedtuple('pos_neg_weight', 'p_weight, n_weight')
 
+# A ground model compiled into an X-constrained SDD, with its weights fixed for the MAXEU semiring.
+# decision_dict maps the node key of each decision to its name.
+CompiledModel = namedtuple('compiled_model', 'kc, decisions, decision_dict, decision_keys, weights, '
+                                             'compile_time, weight_time')
+
 def main(argv):
     args = argparser().parse_args(argv)
 
@@ -34,10 +45,47 @@ def main(argv):
 
     pl = PrologFile(inputfile)
 
-    return map_task(pl, evaluatable_name='sddx')
-
-
-def get_best_decision(db):
+    sdd_options = None
+    if args.vtree is not None or args.gc_threshold is not None:
+        sdd_options = SddOptions(vtree=args.vtree or 'balanced', search_time_limit=args.search_time_limit,
+                                 gc_threshold=args.gc_threshold, gc_every=args.gc_every)
+    family = backend.family_of(inputfile)
+    if args.voi:
+        engine = DefaultEngine(label_all=True, keep_order=True)
+        candidates = args.candidates
+        if candidates is not None and candidates != ['all']:
+            candidates = [Term.from_string(atom) for atom in candidates]
+        elif candidates is not None:
+            candidates = 'all'
+        return value_of_information(engine.prepare(pl), candidates=candidates, processes=args.processes,
+                                    sdd_options=sdd_options, evaluatable_name=args.backend, family=family)
+    if args.sensitivity:
+        engine = DefaultEngine(label_all=True, keep_order=True)
+        return sensitivity(engine.prepare(pl), sdd_options=sdd_options, evaluatable_name=args.backend, family=family)
+    if args.top_k is not None:
+        engine = DefaultEngine(label_all=True, keep_order=True)
+        return get_top_k_decisions(engine.prepare(pl), args.top_k, sdd_options=sdd_options,
+                                   evaluatable_name=args.backend, family=family)
+    if args.decompose:
+        engine = DefaultEngine(label_all=True, keep_order=True)
+        return get_best_decision(engine.prepare(pl), decompose=True, processes=args.processes,
+                                 sdd_options=sdd_options, evaluatable_name=args.backend, family=family)
+    return map_task(pl, evaluatable_name=args.backend, sdd_options=sdd_options, family=family)
+
+
+def get_best_decision(db, decompose=False, processes=None, sdd_options=None, evaluatable_name='sddx', family=None):
+    """
+    Compute the best decisions and their expected utility.
+
+    :param db: The database to compute the best decision from.
+    :param decompose: When True, independent components of the ground formula are compiled and solved separately,
+        in processes worker processes (default: one per CPU). See decompose_components.
+    :param sdd_options: SddOptions controlling compilation, or None for the default vtree. When given, node counts
+        and peak memory are reported after each phase.
+    :param evaluatable_name: The compiler to use, or 'auto' to select one per formula (see backend.choose), using
+        and extending the timings recorded for family.
+    :return: (decisions, expected utility, size, compile time, runtime)
+    """
     engine = DefaultEngine(label_all=True, keep_order=True)
     utilities = dict(engine.query(db, Term('utility', None, None)))
     true_term = Term('true')
@@ -45,7 +93,58 @@ def get_best_decision(db):
     queries = set(pl_queries).union(set(utilities.keys()))
     # Ground as utilities
     lf = engine.ground_all(db, queries=queries)  # type: LogicFormula
+    if decompose:
+        return _get_best_decision_decomposed(engine, db, lf, utilities, processes, sdd_options,
+                                             evaluatable_name, family)
+    return _solve_formula(lf, utilities, sdd_options, evaluatable_name, family)
+
+
+def _compile(lf, decisions, evaluatable_name, sdd_options, family=None):
+    var_constraint = x_constrained_named(X_named=decisions)
+    if evaluatable_name == 'auto':
+        family = family or 'default'
+        name, feats, timings = backend.choose(lf, backend.MAXEU_BACKENDS, family, decisions=decisions)
+        printer.print("Backend %s chosen for %s with features %s" % (name, family, feats))
+        start = time.time()
+        kc = backend.compile_with(lf, name, decisions)
+        if timings is None:
+            backend.record_timings(family, feats, {name: time.time() - start})
+        return kc
+    if sdd_options is None:
+        return get_evaluatable(name=evaluatable_name).create_from(lf, var_constraint=var_constraint)
+    return compile_sddx(lf, var_constraint, sdd_options)
+
+
+def _print_phase_stats(kc, phase, sdd_options):
+    if sdd_options is not None:
+        printer.print("SDD after %s: %s" % (phase, phase_stats(kc)))
+
+
+def compile_model(db, sdd_options=None, evaluatable_name='sddx', family=None):
+    """
+    Ground and compile the database once, for evaluating many policies with evaluate_policies.
+
+    :return: CompiledModel
+    """
+    lf, utilities = _ground_model(db)
+    return _compile_formula(lf, utilities, sdd_options, evaluatable_name, family)
+
+
+def _ground_model(db):
+    """:return: (the ground formula of db for true and its utilities, the utilities)"""
+    engine = DefaultEngine(label_all=True, keep_order=True)
+    utilities = dict(engine.query(db, Term('utility', None, None)))
+    queries = {Term('true')}.union(set(utilities.keys()))
+    lf = engine.ground_all(db, queries=queries)  # type: LogicFormula
+    return lf, utilities
+
 
+def _compile_formula(lf, utilities, sdd_options=None, evaluatable_name='sddx', family=None):
+    """
+    Compile a ground formula into an X-constrained SDD and fix its weights for the MAXEU semiring.
+
+    :return: CompiledModel
+    """
     # Decisions
     decisions = []
     decision_term = Term("?")
@@ -54,13 +153,12 @@ def get_best_decision(db):
             decisions.append(n.name)
 
     # SDDX
-    kc_class = get_evaluatable(name='sddx')
-    var_constraint = x_constrained_named(X_named=decisions)
     starttime_compilation = time.time()
-    kc = kc_class.create_from(lf, var_constraint=var_constraint)
+    kc = _compile(lf, decisions, evaluatable_name, sdd_options, family)
     endtime_compilation = time.time()
     compile_time = endtime_compilation - starttime_compilation
     printer.print("Compilation took %s seconds." % compile_time)
+    _print_phase_stats(kc, "compilation", sdd_options)
     decision_dict = {kc.get_node_by_name(decision): decision for decision in decisions}
     decision_keys = {*decision_dict.keys()}
     semiring = SemiringMAXEU(decision_keys)
@@ -71,7 +169,22 @@ def get_best_decision(db):
     endtime_weights = time.time()
     weight_time = endtime_weights - starttime_weights
     printer.print("Fixing weights took %s seconds" % weight_time)
+    _print_phase_stats(kc, "fixing weights", sdd_options)
     #print("\nFixed weights: %s" % weights)
+    return CompiledModel(kc, decisions, decision_dict, decision_keys, weights, compile_time, weight_time)
+
+
+def _solve_formula(lf, utilities, sdd_options=None, evaluatable_name='sddx', family=None):
+    """
+    Compile a ground formula into an X-constrained SDD and evaluate it in the MAXEU semiring.
+
+    :return: (decisions, expected utility, size, compile time, runtime)
+    """
+    true_term = Term('true')
+    pl_queries = [true_term]
+    kc, decisions, decision_dict, decision_keys, weights, compile_time, weight_time = \
+        _compile_formula(lf, utilities, sdd_options, evaluatable_name, family)
+    semiring = SemiringMAXEU(decision_keys)
 
     # query True
     starttime_evaluation = time.time()
@@ -79,8 +192,29 @@ def get_best_decision(db):
     endtime_evaluation = time.time()
     evaluation_time = endtime_evaluation - starttime_evaluation
     printer.print("Circuit evaluation took %s seconds." % evaluation_time)
+    _print_phase_stats(kc, "evaluation", sdd_options)
+
+    decision_dict = _decision_terms(decision_dict)
+
+    p, eu, d_set = results[true_term]
+    d_dict = {decision_dict[abs(d_key)]: 1 if d_key >= 0 else 0 for d_key in d_set}
+    runtime = evaluation_time + compile_time + weight_time
+    size = kc.get_manager().get_manager().size()
+    printer.print("Best decisions %s" % d_dict)
+    printer.print("Expected utility %s" % eu)
+    printer.print("Compile time %s" % compile_time)
+    printer.print("Runtime %s" % runtime)
+    return d_dict, eu, size, compile_time, runtime
+
+    #for result_key in results:
+    #    p, eu, d_set = results[result_key]
+    #            d_set_new = {("" if d_key >= 0 else "-") + str(decision_dict[abs(d_key)]) for d_key in d_set}
+    #    results[result_key] = (p, eu, d_set_new)
+    #return results[true_term][2], results[true_term][1]
+
 
-    # Map decision keys to terms
+def _decision_terms(decision_dict):
+    """Map decision keys, and their negations, to terms."""
     temp_dict = dict()
     for key, term in decision_dict.items():
         if key == 0:
@@ -91,26 +225,370 @@ def get_best_decision(db):
         elif isinstance(term, Not):
             temp_dict[key] = term
             temp_dict[-key] = term.args[0]
-    decision_dict = temp_dict
+    return temp_dict
 
-    p, eu, d_set = results[true_term]
-    d_dict = {decision_dict[abs(d_key)]: 1 if d_key >= 0 else 0 for d_key in d_set}
+
+def get_top_k_decisions(db, k, sdd_options=None, evaluatable_name='sddx', family=None):
+    """
+    Compute the k best decision sets and their expected utilities from one compilation, see SemiringKMAXEU.
+
+    :return: (list of (decisions, expected utility) from best to worst, size, compile time, runtime)
+    """
+    true_term = Term('true')
+    kc, decisions, decision_dict, decision_keys, weights, compile_time, weight_time = \
+        compile_model(db, sdd_options, evaluatable_name, family)
+    semiring = SemiringKMAXEU(decision_keys, k)
+
+    starttime_evaluation = time.time()
+    results = evaluate_queries(kc, [true_term], semiring, weights)
+    endtime_evaluation = time.time()
+    evaluation_time = endtime_evaluation - starttime_evaluation
+    printer.print("Circuit evaluation took %s seconds." % evaluation_time)
+    _print_phase_stats(kc, "evaluation", sdd_options)
+
+    decision_dict = _decision_terms(decision_dict)
+    policies = []
+    for p, eu, d_set in results[true_term]:
+        if len(d_set) == semiring.zero_decision_length:
+            continue  # no consistent policy
+        d_dict = {decision_dict[abs(d_key)]: 1 if d_key >= 0 else 0 for d_key in d_set}
+        policies.append((d_dict, eu))
     runtime = evaluation_time + compile_time + weight_time
     size = kc.get_manager().get_manager().size()
+    for i, (d_dict, eu) in enumerate(policies):
+        printer.print("Decisions #%s %s with expected utility %s" % (i + 1, d_dict, eu))
+    printer.print("Compile time %s" % compile_time)
+    printer.print("Runtime %s" % runtime)
+    return policies, size, compile_time, runtime
+
+
+def evaluate_policies(model, assignments, decision_names=None):
+    """
+    Compute the expected utility of many fixed decision assignments in one pass over the compiled circuit.
+
+    :param model: The CompiledModel to evaluate, see compile_model.
+    :param assignments: A matrix with one row per policy and one 0/1 column per decision.
+    :param decision_names: The decision of each column (default: model.decisions, in order).
+    :return: numpy array with the expected utility of each row.
+    """
+    assignments = np.asarray(assignments, dtype=float)
+    if assignments.ndim == 1:
+        assignments = assignments.reshape(1, -1)
+    decision_names = model.decisions if decision_names is None else decision_names
+    name_to_key = {name: key for key, name in model.decision_dict.items()}
+    columns = dict()
+    for j, name in enumerate(decision_names):
+        key = name_to_key[name]
+        columns[abs(key)] = assignments[:, j] if key > 0 else 1 - assignments[:, j]
+    semiring = SemiringPolicyEU(columns, len(assignments))
+    p, eu = model.kc.evaluate(index=model.kc.get_node_by_name(Term('true')), semiring=semiring, weights=model.weights)
+    return np.broadcast_to(np.asarray(eu, dtype=float), (len(assignments),)).copy()
+
+
+def sensitivity(db, sdd_options=None, evaluatable_name='sddx', family=None):
+    """
+    Sensitivity of the maximum expected utility around the best decisions.
+    The policy is fixed to the best decisions and one pass over the compiled circuit in SemiringEUGradient gives the
+    derivative of the expected utility to every probability and utility weight. The margin of a decision is the
+    maximum expected utility minus the best one reachable with that decision flipped, the other decisions re-optimized
+    (inf if no policy allows the flip).
+
+    :return: (decisions, expected utility, {fact : d(EU)/d(probability)}, {utility : d(EU)/d(utility)},
+        {decision : margin})
+    """
+    engine = DefaultEngine(label_all=True, keep_order=True)
+    utilities = dict(engine.query(db, Term('utility', None, None)))
+    model = compile_model(db, sdd_options, evaluatable_name, family)
+    kc = model.kc
+    true_node = kc.get_node_by_name(Term('true'))
+    decision_terms = _decision_terms(model.decision_dict)
+
+    # Best decisions, and the best with each of them flipped, with one evaluator.
+    starttime_evaluation = time.time()
+    semiring = SemiringMAXEU(model.decision_keys)
+    evaluator = kc.get_evaluator(semiring=semiring, weights=model.weights)
+    p, eu, d_set = evaluator.evaluate(true_node)
+    margins = dict()
+    for d_key in d_set:
+        p_f, eu_f, d_set_f = evaluator.evaluate(-d_key)
+        feasible = len(d_set_f) != semiring.zero_decision_length
+        margins[decision_terms[abs(d_key)]] = eu - eu_f if feasible else float('inf')
+
+    # Derivatives under the best decisions.
+    weights, probability_terms, utility_terms = _gradient_weights(kc, utilities, model.decision_keys, d_set)
+    gradient_semiring = SemiringEUGradient(len(probability_terms) + len(utility_terms))
+    p_g, eu_g, dp_g, deu_g = kc.evaluate(index=true_node, semiring=gradient_semiring, weights=weights)
+    endtime_evaluation = time.time()
+    printer.print("Sensitivity analysis took %s seconds." % (endtime_evaluation - starttime_evaluation))
+
+    d_dict = {decision_terms[abs(d_key)]: 1 if d_key >= 0 else 0 for d_key in d_set}
+    probability_gradient = {term: deu_g[i] for i, term in enumerate(probability_terms)}
+    utility_gradient = {term: deu_g[len(probability_terms) + i] for i, term in enumerate(utility_terms)}
+    printer.print("Best decisions %s" % d_dict)
+    printer.print("Expected utility %s" % eu)
+    printer.print("d(EU)/d(probability) %s" % probability_gradient)
+    printer.print("d(EU)/d(utility) %s" % utility_gradient)
+    printer.print("Decision margins %s" % margins)
+    return d_dict, eu, probability_gradient, utility_gradient, margins
+
+
+def _gradient_weights(kc, utilities, decision_keys, d_set):
+    """
+    Weights of kc in SemiringEUGradient's internal representation, for the fixed decisions d_set: a decision literal
+    weighs 1 if d_set takes it and 0 otherwise (decisions d_set leaves free are set to true). The tangents are
+    ordered as the probabilistic facts, then the utilities.
+
+    :return: (dict {node key : pn_weight}, probabilistic fact of each tangent, utility of each following tangent)
+    """
+    names = dict()
+    for name, key in kc.get_names():
+        names.setdefault(key, name)
+    program_weights = kc.get_weights()
+    decision_keys = {abs(key) for key in decision_keys}
+    utility_terms = list(utilities)
+    utility_keys = {util: kc.get_node_by_name(util) for util in utility_terms}
+    keys = {abs(key) for key in program_weights} | decision_keys
+    keys |= {abs(key) for key in utility_keys.values() if key is not None}
+
+    probability_terms = []
+    probability_index = dict()
+    for key in sorted(keys):
+        if key not in decision_keys and isinstance(program_weights.get(key), Constant):
+            probability_index[key] = len(probability_terms)
+            probability_terms.append(names.get(key, key))
+    n = len(probability_terms) + len(utility_terms)
+
+    def literal(p, key, sign):
+        """The weight of literal sign * key with probability p: its utilities and the tangents of both."""
+        dp, deu = np.zeros(n), np.zeros(n)
+        cost = 0.0
+        for i, util in enumerate(utility_terms):
+            if utility_keys[util] == sign * key and (key != 0 or sign > 0):
+                cost += utilities[util].compute_value()
+                deu[len(probability_terms) + i] = p
+        if key in probability_index:
+            dp[probability_index[key]] = sign
+            deu[probability_index[key]] = sign * cost
+        return p, p * cost, dp, deu
+
+    weights = dict()
+    for key in keys | {0}:
+        if key == 0:  # True node, as in _get_fixed_weights.
+            pos_p, neg_p = 1.0, 0.0
+        elif key in decision_keys:
+            pos_p = 0.0 if -key in d_set else 1.0
+            neg_p = 1.0 - pos_p
+        elif key in probability_index:
+            pos_p = program_weights[key].compute_value()
+            neg_p = 1.0 - pos_p
+        else:
+            pos_p, neg_p = 1.0, 1.0
+        weights[key] = pn_weight(literal(pos_p, key, 1), literal(neg_p, key, -1))
+    return weights, probability_terms, utility_terms
+
+
+# Candidates per task when value_of_information runs on a process pool.
+VOI_CHUNK = 64
+
+
+def value_of_information(db, candidates=None, processes=1, sdd_options=None, evaluatable_name='sddx', family=None):
+    """
+    The value of observing each candidate atom before deciding: the expected MEU over its two values, with the
+    decisions re-optimized for each, minus the MEU without the observation. The model is compiled once; the MEU
+    given each value of an atom is one evaluation of the shared circuit with that literal restricted, so all
+    candidates share one evaluator. Candidate sets of more than one VOI_CHUNK are split over processes worker
+    processes (default: one per CPU) unless processes is 1.
+
+    :param candidates: The atoms to rank, or 'all' for every named atom of the ground model that is not a decision.
+        By default, the chance atoms that can be observed before deciding: those of observable_atoms.
+    :return: list of (atom, value of information, probability of the atom), from most to least valuable
+    """
+    global _voi_model
+    import multiprocessing
+
+    lf, utilities = _ground_model(db)
+    if candidates is None:
+        candidates = observable_atoms(lf, utilities)
+    model = _compile_formula(lf, utilities, sdd_options, evaluatable_name, family)
+    kc = model.kc
+    start = time.time()
+    decision_keys = {abs(key) for key in model.decision_keys}
+    if candidates == 'all':
+        candidates = [name for name, key in kc.get_names() if key is not None and abs(key) not in decision_keys]
+    nodes = dict()
+    for atom in candidates:
+        try:
+            node = kc.get_node_by_name(atom)
+        except KeyError:
+            printer.print("VOI %s is not in the ground model" % atom)
+            continue
+        if node is not None and node != 0 and abs(node) not in decision_keys:
+            nodes.setdefault(node, atom)
+    node_list = list(nodes)
+
+    semiring = SemiringMAXEU(model.decision_keys)
+    evaluator = kc.get_evaluator(semiring=semiring, weights=model.weights)
+    meu = evaluator.evaluate(kc.get_node_by_name(Term('true')))[1]
+    if processes == 1 or len(node_list) <= VOI_CHUNK:
+        observed = [_observed_eu(evaluator, node) for node in node_list]
+    else:
+        _voi_model = model
+        chunks = [node_list[i:i + VOI_CHUNK] for i in range(0, len(node_list), VOI_CHUNK)]
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            observed = [r for chunk in pool.map(_voi_chunk, chunks) for r in chunk]
+        _voi_model = None
+
+    ranking = sorted(((nodes[node], eu - meu, p) for node, (p, eu) in zip(node_list, observed)),
+                     key=lambda r: r[1], reverse=True)
+    printer.print("Value of information took %s seconds for %s atoms." % (time.time() - start, len(node_list)))
+    printer.print("Expected utility %s" % meu)
+    for atom, voi, p in ranking:
+        printer.print("VOI %s %s (p=%s)" % (atom, voi, p))
+    return ranking
+
+
+def observable_atoms(lf, utilities):
+    """
+    The named atoms of the ground formula lf that depend on no decision and are not utility atoms: the chance atoms
+    whose value could be known before deciding. An atom downstream of a decision, or one that carries a utility, is
+    an outcome of the decisions rather than an observation to make before them.
+
+    :param utilities: The utilities of the model, by atom.
+    :return: list of atom names
+    """
+    decision_term = Term('?')
+    nodes = list(lf)
+    dependent = {key for key, n, type in nodes if type == 'atom' and n.probability == decision_term}
+    changed = True
+    while changed:
+        changed = False
+        for key, n, type in nodes:
+            if key not in dependent and type != 'atom' and any(abs(c) in dependent for c in n.children):
+                dependent.add(key)
+                changed = True
+    return [name for name, key in lf.get_names()
+            if key is not None and key != 0 and abs(key) not in dependent and name not in utilities]
+
+
+def _observed_eu(evaluator, node):
+    """(P(node), the MEU when node is observed before deciding)."""
+    p_t, eu_t, _ = evaluator.evaluate(node)
+    p_f, eu_f, _ = evaluator.evaluate(-node)
+    return p_t, eu_t + eu_f
+
+
+def _voi_chunk(nodes):
+    model = _voi_model
+    semiring = SemiringMAXEU(model.decision_keys)
+    evaluator = model.kc.get_evaluator(semiring=semiring, weights=model.weights)
+    return [_observed_eu(evaluator, node) for node in nodes]
+
+
+def decompose_components(lf, utilities):
+    """
+    Split a ground formula into connected components over shared nodes.
+    Two nodes are connected when one is a child of the other, or when they occur in the same constraint
+    (e.g. an annotated disjunction). Components are returned only if they contain a utility.
+
+    :param lf: The ground LogicFormula.
+    :param utilities: dict {utility term : cost}
+    :return: (components, constant) where components is a list of (utilities, decisions, evidence) of each
+        component, as a dict of utilities, a list of decision terms and a list of (term, value) evidence, and
+        constant is the total cost of the utilities that are always true.
+    """
+    parent = dict()
+
+    def find(x):
+        root = x
+        while parent.get(root, root) != root:
+            root = parent[root]
+        while x != root:
+            parent[x], x = root, parent.get(x, x)
+        return root
+
+    def union(x, y):
+        x, y = find(abs(x)), find(abs(y))
+        if x != y:
+            parent[x] = y
+
+    decision_term = Term("?")
+    decisions = []
+    for i, n, t in lf:
+        if t in ('conj', 'disj'):
+            for c in n.children:
+                union(i, c)
+        elif t == 'atom' and n.probability == decision_term:
+            decisions.append((n.name, i))
+    for c in lf.constraints():
+        nodes = [x for x in c.get_nodes() if x is not None and x != 0]
+        for x in nodes[1:]:
+            union(nodes[0], x)
+
+    constant = 0.0
+    by_root = dict()
+    for util, cost in utilities.items():
+        key = lf.get_node_by_name(util)
+        if key is None:
+            continue
+        elif key == 0:
+            constant += cost.compute_value()
+        else:
+            by_root.setdefault(find(abs(key)), ({}, [], []))[0][util] = cost
+    for name, key in decisions:
+        if find(abs(key)) in by_root:
+            by_root[find(abs(key))][1].append(name)
+    for name, key, value in lf.evidence_all():
+        if key not in (None, 0) and value in (0, 1) and find(abs(key)) in by_root:
+            by_root[find(abs(key))][2].append((name, bool(value)))
+    return list(by_root.values()), constant
+
+
+# The database and components seen by the worker processes, which are forked after these are set.
+_decomposition = None
+
+
+def _solve_component(i):
+    db, components, sdd_options, evaluatable_name, family = _decomposition
+    utilities, _, evidence = components[i]
+    engine = DefaultEngine(label_all=True, keep_order=True)
+    queries = {Term('true')}.union(set(utilities.keys()))
+    lf = engine.ground_all(db, queries=queries, evidence=evidence)
+    return _solve_formula(lf, utilities, sdd_options, evaluatable_name, family)
+
+
+def _get_best_decision_decomposed(engine, db, lf, utilities, processes, sdd_options, evaluatable_name, family):
+    """
+    Solve each component of lf in its own process. MEUs are summed and decision sets merged, since components
+    share no atoms. The reported compile time is that of the largest component.
+    """
+    global _decomposition
+    import multiprocessing
+
+    start = time.time()
+    components, constant = decompose_components(lf, utilities)
+    printer.print("Decomposed into %s components" % len(components))
+    if len(components) <= 1:
+        return _solve_formula(lf, utilities, sdd_options, evaluatable_name, family)
+    _decomposition = (db, components, sdd_options, evaluatable_name, family)
+    with multiprocessing.get_context('fork').Pool(processes) as pool:
+        results = pool.map(_solve_component, range(len(components)))
+    _decomposition = None
+
+    d_dict = dict()
+    for d, _, _, _, _ in results:
+        d_dict.update(d)
+    eu = constant + sum(r[1] for r in results)
+    size = sum(r[2] for r in results)
+    compile_time = max(r[3] for r in results)
+    runtime = time.time() - start
     printer.print("Best decisions %s" % d_dict)
     printer.print("Expected utility %s" % eu)
     printer.print("Compile time %s" % compile_time)
     printer.print("Runtime %s" % runtime)
     return d_dict, eu, size, compile_time, runtime
 
-    #for result_key in results:
-    #    p, eu, d_set = results[result_key]
-    #            d_set_new = {("" if d_key >= 0 else "-") + str(decision_dict[abs(d_key)]) for d_key in d_set}
-    #    results[result_key] = (p, eu, d_set_new)
-    #return results[true_term][2], results[true_term][1]
 
-
-def map_task(pl: PrologString, evaluatable_name=None):
+def map_task(pl: PrologString, evaluatable_name=None, sdd_options=None, family=None):
     """
     Compute the expected utility using the queries and model described by pl.
 
@@ -123,10 +601,10 @@ def map_task(pl: PrologString, evaluatable_name=None):
      """
     engine = DefaultEngine(label_all=True, keep_order=True)
     db = engine.prepare(pl)
-    return map_task_db(db, evaluatable_name)
+    return map_task_db(db, evaluatable_name, sdd_options, family)
 
 
-def map_task_db(db, evaluatable_name=None):
+def map_task_db(db, evaluatable_name=None, sdd_options=None, family=None):
     """
     Compute the expected utility using the queries and model described by pl.
 
@@ -156,12 +634,11 @@ def map_task_db(db, evaluatable_name=None):
     #print.printer(lf)
 
     # SDD
-    kc_class = get_evaluatable(name=evaluatable_name)
-    var_constraint = x_constrained_named(X_named=decisions)
     starttime_compilation = time.time()
-    kc = kc_class.create_from(lf, var_constraint=var_constraint)
+    kc = _compile(lf, decisions, evaluatable_name, sdd_options, family)
     endtime_compilation = time.time()
     printer.print("Compilation took %s seconds." % (endtime_compilation - starttime_compilation))
+    _print_phase_stats(kc, "compilation", sdd_options)
     decision_dict = {kc.get_node_by_name(decision): decision for decision in decisions}
     decision_keys = {*decision_dict.keys()}
     semiring = SemiringMAXEU(decision_keys)
@@ -171,13 +648,15 @@ def map_task_db(db, evaluatable_name=None):
     weights = _get_fixed_weights(kc, semiring, utilities, decisions, decision_keys)
     endtime_weights = time.time()
     printer.print("Fixing weights took %s seconds" % (endtime_weights - starttime_weights))
+    _print_phase_stats(kc, "fixing weights", sdd_options)
     printer.print("\nFixed weights: %s" % weights)
 
     # query True
     starttime_evaluation = time.time()
-    results = {x: kc.evaluate(index=kc.get_node_by_name(x), semiring=semiring, weights=weights) for x in pl_queries}
+    results = evaluate_queries(kc, pl_queries, semiring, weights)
     endtime_evaluation = time.time()
     printer.print("Circuit evaluation took %s seconds." % (endtime_evaluation - starttime_evaluation))
+    _print_phase_stats(kc, "evaluation", sdd_options)
 
     # Map decision keys to decision names.
     for result_key in results:
@@ -200,6 +679,28 @@ def map_task_db(db, evaluatable_name=None):
     return results
 
 
+def evaluate_queries(kc, queries, semiring, weights):
+    """
+    Evaluate many queries on kc with one evaluator, so evidence is propagated and the normalization is computed once
+    rather than per query, and queries that resolve to the same node are evaluated once.
+
+    This only saves the work around each query: every distinct query is still one bottom-up pass over the whole
+    circuit, with its literal restricted. There is no downward pass sharing partial results between queries, since
+    the max over decision sets in MAXEU does not distribute the way a downward (derivative) pass needs.
+
+    :return: dict {query : result of kc.evaluate for that query}
+    """
+    evaluator = kc.get_evaluator(semiring=semiring, weights=weights)
+    by_node = dict()
+    results = dict()
+    for query in queries:
+        node = kc.get_node_by_name(query)
+        if node not in by_node:
+            by_node[node] = evaluator.evaluate(node)
+        results[query] = by_node[node]
+    return results
+
+
 def _get_fixed_weights(kc: BaseFormula, semiring: Semiring, utilities, decision_names, decision_keys):
     """
     Get the weights present in kc, adjusted with the weights provided in utilities.
@@ -461,6 +962,313 @@ class SemiringMAXEU(Semiring):
             return self.negate(s)
 
 
+class SemiringKMAXEU(SemiringMAXEU):
+    """
+    The k-best variant of SemiringMAXEU. Each element is a tuple of at most k triples (prob, eu, decision_set), sorted
+    from best to worst by eu / prob, with at most one triple per decision set. A plus over decisions merges both lists
+    and keeps the k best, instead of only the best, so the root holds the k best decision sets.
+    Within the X-constraint a times joins independent parts, whose ratios eu / prob add up, so its k best come from a
+    frontier search over the two sorted lists rather than from all k * k pairs.
+    """
+    # element = ((prob, eu, decision_set), ...)
+
+    def __init__(self, decisions, k):
+        """
+        :param decisions: A set of all possible positive decision keys
+        :type decisions: set[int]
+        :param k: The number of decision sets to keep.
+        """
+        SemiringMAXEU.__init__(self, decisions)
+        self.k = k
+        self.val_zero = (self.val_zero,)
+
+    @staticmethod
+    def _ratio(x):
+        p, eu, d = x
+        return eu / p if p != 0 else float('-inf')
+
+    def _best(self, candidates):
+        """Up to k candidates, in the order given, skipping repeated decision sets."""
+        seen = set()
+        result = []
+        for x in candidates:
+            d = frozenset(x[2])
+            if d not in seen:
+                seen.add(d)
+                result.append(x)
+                if len(result) == self.k:
+                    break
+        return tuple(result)
+
+    def one(self):
+        return (SemiringMAXEU.one(self),)
+
+    def is_one(self, value):
+        return len(value) == 1 and SemiringMAXEU.is_one(self, value[0])
+
+    def is_zero(self, value):
+        return all(SemiringMAXEU.is_zero(self, x) for x in value)
+
+    def plus(self, a, b):
+        if any(len(x[2]) for x in itertools.chain(a, b)):
+            a_valid = [x for x in a if len(x[2]) != self.zero_decision_length]  # avoid false
+            b_valid = [x for x in b if len(x[2]) != self.zero_decision_length]
+            if not b_valid:
+                return a
+            if not a_valid:
+                return b
+            # Ties go to a, as in SemiringMAXEU.
+            return self._best(heapq.merge(a_valid, b_valid, key=lambda x: -self._ratio(x)))
+        else:
+            return (SemiringMAXEU.plus(self, a[0], b[0]),)
+
+    def times(self, a, b):
+        ratio = lambda i, j: self._ratio(a[i]) + self._ratio(b[j])
+        frontier = [(-ratio(0, 0), 0, 0)]
+        visited = {(0, 0)}
+        products = []
+        while frontier and len(products) < self.k:
+            _, i, j = heapq.heappop(frontier)
+            products.append(SemiringMAXEU.times(self, a[i], b[j]))
+            for ni, nj in ((i + 1, j), (i, j + 1)):
+                if ni < len(a) and nj < len(b) and (ni, nj) not in visited:
+                    visited.add((ni, nj))
+                    heapq.heappush(frontier, (-ratio(ni, nj), ni, nj))
+        return self._best(products)
+
+    def normalize(self, a, z):
+        return tuple(SemiringMAXEU.normalize(self, x, z[0]) for x in a)
+
+    def negate(self, a):
+        return tuple(SemiringMAXEU.negate(self, x) for x in a)
+
+    def value(self, a):
+        return (SemiringMAXEU.value(self, a),)
+
+    def in_domain(self, a):
+        return all(SemiringMAXEU.in_domain(self, x) for x in a)
+
+    def to_evidence(self, pos_weight, neg_weight, sign):
+        pos, neg = SemiringMAXEU.to_evidence(self, pos_weight[0], neg_weight[0], sign)
+        return (pos,), (neg,)
+
+    def ad_negate(self, pos_weight, neg_weight):
+        return (SemiringMAXEU.ad_negate(self, pos_weight[0], neg_weight[0]),)
+
+    def ad_complement(self, ws, key=None):
+        p, eu, d = ws[0][0]
+        if len(d):
+            return ((0.0, 0.0, set()),)
+        else:
+            s = self.zero()
+            for w in ws:
+                if len(w[0][2]):
+                    return None  # Trigger InvalidValueError, see SemiringMAXEU.ad_complement.
+                s = self.plus(s, w)
+            return self.negate(s)
+
+
+class SemiringEUGradient(Semiring):
+    """
+    The expected utility semiring over dual numbers, for a fixed policy. Each element is (prob, eu, d_prob, d_eu)
+    where d_prob and d_eu are numpy arrays holding the derivatives of prob and eu to each parameter, so a single
+    bottom-up pass gives the gradient of the expected utility. Weights are given in this internal representation,
+    see _gradient_weights.
+    """
+
+    def __init__(self, parameters):
+        """
+        :param parameters: The number of parameters to differentiate to.
+        """
+        Semiring.__init__(self)
+        self.parameters = parameters
+
+    def one(self):
+        return 1.0, 0.0, np.zeros(self.parameters), np.zeros(self.parameters)
+
+    def zero(self):
+        return 0.0, 0.0, np.zeros(self.parameters), np.zeros(self.parameters)
+
+    def is_one(self, value):
+        p, eu, dp, deu = value
+        return 1.0 - 1e-12 < p < 1.0 + 1e-12 and -1e-12 < eu < 1e-12
+
+    def is_zero(self, value):
+        p, eu, dp, deu = value
+        return -1e-12 < p < 1e-12 and -1e-12 < eu < 1e-12
+
+    def plus(self, a, b):
+        return a[0] + b[0], a[1] + b[1], a[2] + b[2], a[3] + b[3]
+
+    def times(self, a, b):
+        p_a, eu_a, dp_a, deu_a = a
+        p_b, eu_b, dp_b, deu_b = b
+        return (p_a * p_b, p_a * eu_b + p_b * eu_a,
+                dp_a * p_b + p_a * dp_b,
+                dp_a * eu_b + p_a * deu_b + dp_b * eu_a + p_b * deu_a)
+
+    def negate(self, a):
+        return 1 - a[0], 0.0, -a[2], np.zeros(self.parameters)
+
+    def normalize(self, a, z):
+        p_a, eu_a, dp_a, deu_a = a
+        p_z, eu_z, dp_z, deu_z = z
+        return (p_a / p_z, eu_a / p_z,
+                dp_a / p_z - p_a * dp_z / p_z ** 2,
+                deu_a / p_z - eu_a * dp_z / p_z ** 2)
+
+    def value(self, a):
+        if type(a) is Constant:
+            return float(a), 0.0, np.zeros(self.parameters), np.zeros(self.parameters)
+        elif type(a) is Term and a.functor == '?':
+            return self.one()
+        else:
+            raise ValueError("Could not interpret %s during conversion from external to internal representation." % a)
+
+    def pos_value(self, a, key=None):
+        if isinstance(a, pn_weight):
+            return a.p_weight
+        else:
+            return self.value(a)
+
+    def neg_value(self, a, key=None):
+        if isinstance(a, pn_weight):
+            return a.n_weight
+        else:
+            return self.negate(self.value(a))
+
+    def is_dsp(self):
+        return True
+
+    def is_nsp(self):
+        return True
+
+    def in_domain(self, a):
+        return 0.0 - 1e-9 <= a[0] <= 1.0 + 1e-9
+
+    def to_evidence(self, pos_weight, neg_weight, sign):
+        if sign > 0:
+            return pos_weight, self.zero()
+        else:
+            return self.zero(), neg_weight
+
+    def ad_negate(self, pos_weight, neg_weight):
+        n_p, n_eu, n_dp, n_deu = neg_weight
+        if n_p == 0:
+            return 1.0, n_eu, np.zeros(self.parameters), n_deu
+        else:
+            return 1.0, n_eu / n_p, np.zeros(self.parameters), n_deu / n_p - n_eu * n_dp / n_p ** 2
+
+    def ad_complement(self, ws, key=None):
+        s = self.zero()
+        for w in ws:
+            s = self.plus(s, w)
+        return self.negate(s)
+
+
+class SemiringPolicyEU(Semiring):
+    """
+    The expected utility semiring, vectorized over a batch of fixed decision assignments. Each element is a pair
+    (prob, eu) of numpy arrays with one entry per assignment. A decision literal weighs 1 in the rows where the
+    assignment takes it and 0 elsewhere, so summing over decisions selects each row's policy and the MAXEU weights
+    can be reused as they are.
+    """
+
+    def __init__(self, columns, rows):
+        """
+        :param columns: dict {positive decision key : 0/1 array, the value of that decision in each row}
+        :param rows: The number of assignments.
+        """
+        Semiring.__init__(self)
+        self.columns = columns
+        self.rows = rows
+
+    def one(self):
+        return np.ones(self.rows), np.zeros(self.rows)
+
+    def zero(self):
+        return np.zeros(self.rows), np.zeros(self.rows)
+
+    def is_one(self, value):
+        p, eu = value
+        return bool(np.all(np.abs(p - 1.0) < 1e-12) and np.all(np.abs(eu) < 1e-12))
+
+    def is_zero(self, value):
+        p, eu = value
+        return bool(np.all(np.abs(p) < 1e-12) and np.all(np.abs(eu) < 1e-12))
+
+    def plus(self, a, b):
+        return a[0] + b[0], a[1] + b[1]
+
+    def times(self, a, b):
+        return a[0] * b[0], a[0] * b[1] + b[0] * a[1]
+
+    def negate(self, a):
+        return 1 - a[0], np.zeros(self.rows)
+
+    def normalize(self, a, z):
+        p_a, eu_a = a
+        p_z, eu_z = z
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(p_z == 0, 0.0, p_a / p_z), np.where(p_z == 0, 0.0, eu_a / p_z)
+
+    def _mask(self, d_set):
+        mask = np.ones(self.rows)
+        for d in d_set:
+            mask = mask * (self.columns[d] if d > 0 else 1 - self.columns[-d])
+        return mask
+
+    def value(self, a):
+        if type(a) is Constant:
+            return np.full(self.rows, float(a)), np.zeros(self.rows)
+        elif type(a) is Term and a.functor == '?':
+            return np.ones(self.rows), np.zeros(self.rows)
+        elif type(a) is Term:
+            mask = self._mask(a.args[2])
+            p = float(a.args[0]) * mask
+            return p, p * float(a.args[1])
+        else:
+            raise ValueError("Could not interpret %s during conversion from external to internal representation." % a)
+
+    def pos_value(self, a, key=None):
+        if isinstance(a, pn_weight):
+            return self.value(a.p_weight)
+        else:
+            return self.value(a)
+
+    def neg_value(self, a, key=None):
+        if isinstance(a, pn_weight):
+            return self.value(a.n_weight)
+        else:
+            return self.negate(self.value(a))
+
+    def is_dsp(self):
+        return True
+
+    def is_nsp(self):
+        return True
+
+    def in_domain(self, a):
+        return bool(np.all(a[0] >= 0.0 - 1e-9) and np.all(a[0] <= 1.0 + 1e-9))
+
+    def to_evidence(self, pos_weight, neg_weight, sign):
+        if sign > 0:
+            return pos_weight, self.zero()
+        else:
+            return self.zero(), neg_weight
+
+    def ad_negate(self, pos_weight, neg_weight):
+        n_p, n_eu = neg_weight
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.ones(self.rows), np.where(n_p == 0, n_eu, n_eu / n_p)
+
+    def ad_complement(self, ws, key=None):
+        s = self.zero()
+        for w in ws:
+            s = self.plus(s, w)
+        return self.negate(s)
+
+
 def kc_to_dot(kc):
     g = Digraph('G', filename='hello.gv')
     for i, n, t in kc:
@@ -497,6 +1305,29 @@ def argparser():
     parser.add_argument('-o', '--output', type=str, default=None,
                         help='Write output to given file (default: write to stdout)')
     parser.add_argument('-v', '--verbose', action='count', help='Increase verbosity')
+    parser.add_argument('--backend', choices=['auto', 'sddx'] + backend.MAXEU_BACKENDS[1:], default='sddx',
+                        help='Knowledge compiler, or auto to select one from recorded timings or a race')
+    parser.add_argument('--decompose', action='store_true',
+                        help='Solve the best decision over independent components of the model in parallel')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of worker processes for --decompose and --voi (default: one per CPU)')
+    parser.add_argument('--voi', action='store_true',
+                        help='Rank atoms by the value of observing them before deciding')
+    parser.add_argument('--candidates', nargs='+', default=None, metavar='ATOM',
+                        help='Atoms ranked by --voi, or all for every atom that is not a decision '
+                             '(default: the chance atoms that depend on no decision and carry no utility)')
+    parser.add_argument('--sensitivity', action='store_true',
+                        help='Report derivatives of the expected utility and decision margins around the best decisions')
+    parser.add_argument('--top-k', type=int, default=None,
+                        help='Report the k best decision sets and their expected utilities')
+    parser.add_argument('--vtree', choices=VTREE_TYPES + ['search'], default=None,
+                        help='Initial vtree type within the decision constraint, or search for the smallest')
+    parser.add_argument('--search-time-limit', type=float, default=10.0,
+                        help='Seconds given to each vtree type by --vtree search')
+    parser.add_argument('--gc-threshold', type=float, default=None,
+                        help='Garbage collect when the fraction of dead SDD nodes exceeds this threshold')
+    parser.add_argument('--gc-every', type=int, default=1000,
+                        help='Check the garbage collection threshold every this many apply operations')
     return parser
 
 
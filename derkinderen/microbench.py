@@ -0,0 +1,279 @@
+"""
+Micro-benchmarks for the Python code behind the Method.derk timings: the plus and times of the semirings, fixing the
+weights of a ground model, reading examples and the MSE of the utility learner. Each runs on synthetic circuits,
+models or example sets of increasing size, so changes to these can be measured without the noise of a whole solver run.
+
+For every benchmark and size, this reports operations per second, the peak and retained memory of one call as traced
+by tracemalloc, and the scaling exponent of the time per call in the size (1 is linear).
+
+Usage: python microbench.py [--bench NAME ...] [--sizes 64,256,1024] [--repeat 5] [--csv FILE]
+"""
+import argparse
+import contextlib
+import csv
+import os
+import random
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from collections import namedtuple
+
+import numpy as np
+
+from problog.engine import DefaultEngine
+from problog.logic import Term
+from problog.program import PrologString
+
+import maxeu
+import ulearner
+
+Result = namedtuple('result', 'bench, size, ops, seconds, ops_per_sec, peak_kb, retained_kb')
+
+# A benchmark builds, for a size, a random generator and a scratch directory that is removed once it is measured, a
+# function to time and the number of operations per call.
+Benchmark = namedtuple('benchmark', 'setup, sizes')
+
+# Every fourth variable of the synthetic circuits and models is a decision.
+DECISION_EVERY = 4
+
+
+def synthetic_circuit(size):
+    """
+    A circuit over size variables in the shape of a compiled X-constrained SDD: each node decides on its first variable
+    x as plus(times(x, r), times(-x, r)), where r, shared by both branches, is the times of nodes on the two halves of
+    the remaining variables. It has 4 operations per variable.
+
+    :param size: The number of variables.
+    :return: (leaves, ops) where leaves is the list of literals (variable, sign) and ops the list of (op, i, j) in
+        topological order, op being 'plus' or 'times' and i, j indices into leaves followed by ops.
+    """
+    leaves = [(x, sign) for x in range(size) for sign in (1, -1)]
+    ops = []
+
+    def emit(op, i, j):
+        ops.append((op, i, j))
+        return len(leaves) + len(ops) - 1
+
+    def node(lo, hi):
+        pos, neg = 2 * lo, 2 * lo + 1
+        if hi - lo == 1:
+            return emit('plus', pos, neg)
+        mid = (lo + 1 + hi) // 2
+        if mid == lo + 1 or mid == hi:
+            rest = node(lo + 1, hi)
+        else:
+            rest = emit('times', node(lo + 1, mid), node(mid, hi))
+        return emit('plus', emit('times', pos, rest), emit('times', neg, rest))
+
+    node(0, size)
+    return leaves, ops
+
+
+def evaluate_circuit(semiring, values, ops):
+    """Evaluate ops bottom-up with the plus and times of semiring, from the values of the leaves."""
+    values = list(values)
+    plus, times = semiring.plus, semiring.times
+    for op, i, j in ops:
+        values.append(plus(values[i], values[j]) if op == 'plus' else times(values[i], values[j]))
+    return values[-1]
+
+
+def _literal(x, sign, rng):
+    """(is decision, probability, utility) of a literal of the synthetic circuit."""
+    if x % DECISION_EVERY == 0:
+        return True, 1.0, 0.0
+    p = rng.random()
+    return False, p if sign > 0 else 1 - p, rng.uniform(-100, 100) if sign > 0 else 0.0
+
+
+def _circuit_bench(make_semiring, make_leaf):
+    def setup(size, rng, workdir):
+        leaves, ops = synthetic_circuit(size)
+        semiring = make_semiring(size, rng)
+        values = [make_leaf(semiring, x, sign, *_literal(x, sign, rng)) for x, sign in leaves]
+        return (lambda: evaluate_circuit(semiring, values, ops)), len(ops)
+    return setup
+
+
+def _decision_keys(size):
+    return {x + 1 for x in range(0, size, DECISION_EVERY)}
+
+
+def _maxeu_leaf(semiring, x, sign, decision, p, u):
+    return (1.0, 0.0, {sign * (x + 1)}) if decision else (p, p * u, set())
+
+
+def _kmaxeu_leaf(semiring, x, sign, decision, p, u):
+    return (_maxeu_leaf(semiring, x, sign, decision, p, u),)
+
+
+def _eu_leaf(semiring, x, sign, decision, p, u):
+    return p, p * u
+
+
+def _policy_eu_semiring(size, rng, rows=64):
+    columns = {key: np.array([rng.random() < 0.5 for _ in range(rows)], dtype=float) for key in _decision_keys(size)}
+    return maxeu.SemiringPolicyEU(columns, rows)
+
+
+def _policy_eu_leaf(semiring, x, sign, decision, p, u):
+    if decision:
+        column = semiring.columns[x + 1]
+        return (column if sign > 0 else 1 - column), np.zeros(semiring.rows)
+    return np.full(semiring.rows, p), np.full(semiring.rows, p * u)
+
+
+def synthetic_model(size, rng, rules=True, unknown_utilities=False):
+    """
+    A ProbLog model with size atoms x_i: a decision for every DECISION_EVERY-th atom and a probabilistic fact
+    otherwise, each with a rule a_i :- x_i, b_i on a probabilistic fact b_i of its own, and a utility on every x_i and
+    a_i.
+
+    :param rules: Whether to include the rules and their facts, or only the atoms x_i.
+    :param unknown_utilities: Whether the utilities of the rules are to be learned, t(_), rather than given.
+    :return: The model as a string.
+    """
+    lines = []
+    for i in range(size):
+        if i % DECISION_EVERY == 0:
+            lines.append('?::x%s.' % i)
+        else:
+            lines.append('%s::x%s.' % (round(rng.random(), 4), i))
+        lines.append('utility(x%s, %s).' % (i, rng.randint(-100, 100)))
+        if rules:
+            lines.append('%s::b%s.' % (round(rng.random(), 4), i))
+            lines.append('a%s :- x%s, b%s.' % (i, i, i))
+            lines.append('utility(a%s, %s).' % (i, 't(_)' if unknown_utilities else rng.randint(-100, 100)))
+    return '\n'.join(lines)
+
+
+def _fixed_weights_setup(size, rng, workdir):
+    # _get_fixed_weights only reads the weights and names of the formula. Without rules, those of the ground formula
+    # are those of its compilation, which is left out: X-constrained compilation blows up with the decisions.
+    engine = DefaultEngine(label_all=True, keep_order=True)
+    db = engine.prepare(PrologString(synthetic_model(size, rng, rules=False)))
+    utilities = dict(engine.query(db, Term('utility', None, None)))
+    lf = engine.ground_all(db, queries=set(utilities.keys()))
+    decisions = [n.name for _, n, type in lf if type == 'atom' and n.probability == Term('?')]
+    decision_keys = {lf.get_node_by_name(decision) for decision in decisions}
+    semiring = maxeu.SemiringMAXEU(decision_keys)
+    return (lambda: maxeu._get_fixed_weights(lf, semiring, utilities, decisions, decision_keys)), len(utilities)
+
+
+def synthetic_examples(size, atoms, rng, observed=5):
+    """size examples in the format of ulearner.read_examples, each observing observed of the atoms x0 .. x{atoms-1}."""
+    examples = []
+    for _ in range(size):
+        lines = ['evidence(x%s, %s).' % (i, rng.choice(['true', 'false']))
+                 for i in rng.sample(range(atoms), min(observed, atoms))]
+        lines.append('utility(%s).' % rng.randint(-200, 200))
+        examples.append('\n'.join(lines))
+    return '\n---\n'.join(examples) + '\n'
+
+
+def _read_examples_setup(size, rng, workdir):
+    path = os.path.join(workdir, 'examples.pl')
+    with open(path, 'w') as f:
+        f.write(synthetic_examples(size, 16, rng))
+    return (lambda: list(ulearner.read_examples(path))), size
+
+
+def _mse_setup(size, rng, workdir, atoms=16):
+    engine = DefaultEngine(label_all=True, keep_order=True)
+    db = engine.prepare(PrologString(synthetic_model(atoms, rng, unknown_utilities=True).replace('?::', '0.5::')))
+    examples = _parse_examples(synthetic_examples(size, atoms, rng), workdir)
+    learner = ulearner.ULearner(db, examples, evaluatable_name='sdd')
+    learner.prepare()
+    processed = learner.get_processed_examples()
+    return (lambda: learner.mse(processed)), size
+
+
+def _parse_examples(text, workdir):
+    path = os.path.join(workdir, 'examples.pl')
+    with open(path, 'w') as f:
+        f.write(text)
+    return list(ulearner.read_examples(path))
+
+
+BENCHMARKS = {
+    'maxeu': Benchmark(_circuit_bench(lambda size, rng: maxeu.SemiringMAXEU(_decision_keys(size)), _maxeu_leaf),
+                       [64, 256, 1024, 4096, 16384]),
+    'kmaxeu': Benchmark(_circuit_bench(lambda size, rng: maxeu.SemiringKMAXEU(_decision_keys(size), 4), _kmaxeu_leaf),
+                        [64, 256, 1024, 4096, 16384]),
+    'eu': Benchmark(_circuit_bench(lambda size, rng: ulearner.SemiringEU(), _eu_leaf),
+                    [64, 256, 1024, 4096, 16384]),
+    'policy_eu': Benchmark(_circuit_bench(_policy_eu_semiring, _policy_eu_leaf),
+                           [64, 256, 1024, 4096, 16384]),
+    'fixed_weights': Benchmark(_fixed_weights_setup, [16, 64, 256, 1024]),
+    'read_examples': Benchmark(_read_examples_setup, [4, 16, 64, 256]),
+    'mse': Benchmark(_mse_setup, [4, 16, 64, 256]),
+}
+
+
+def measure(name, size, repeat=5, seed=0):
+    """
+    Time one benchmark at one size: the best of repeat rounds, each of as many calls as fill 0.2 seconds, then trace
+    the memory of a single call.
+
+    :return: Result
+    """
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        f, ops = BENCHMARKS[name].setup(size, random.Random(seed), workdir)
+        timer = timeit.Timer(f)
+        number, _ = timer.autorange()
+        seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        result = f()
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+    return Result(name, size, ops, seconds, ops / seconds, (peak - before) / 1024, (after - before) / 1024)
+
+
+def scaling_exponent(results):
+    """The slope of log(seconds) over log(size), by least squares: the exponent k of a time per call in O(size^k)."""
+    if len(results) < 2:
+        return None
+    xs = np.log([r.size for r in results])
+    ys = np.log([r.seconds for r in results])
+    return float(np.polyfit(xs, ys, 1)[0])
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bench', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')], default=None,
+                        help='comma-separated sizes, instead of the defaults of each benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', default=None, help='also write every result to this csv file')
+    args = parser.parse_args(argv)
+
+    rows = []
+    print('%-14s %8s %10s %12s %14s %12s %12s' % ('bench', 'size', 'ops', 'sec/call', 'ops/sec', 'peak KB',
+                                                 'retained KB'))
+    for name in args.bench:
+        results = []
+        for size in args.sizes or BENCHMARKS[name].sizes:
+            r = measure(name, size, args.repeat, args.seed)
+            print('%-14s %8d %10d %12.3e %14.1f %12.1f %12.1f' % r)
+            sys.stdout.flush()
+            results.append(r)
+        exponent = scaling_exponent(results)
+        if exponent is not None:
+            print('%-14s scaling exponent %.2f' % (name, exponent))
+        rows.extend(results)
+
+    if args.csv is not None:
+        with open(args.csv, 'w', newline='') as f:
+            w = csv.writer(f)
+            w.writerow(Result._fields)
+            w.writerows(rows)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
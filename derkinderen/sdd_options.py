@@ -0,0 +1,138 @@
+"""
+Compilation controls for the X-constrained SDDs of maxeu: the initial vtree, a search over initial vtrees,
+garbage collection thresholds, and node count and peak memory reporting per phase.
+
+Dynamic minimization in the SDD library reorders the vtree without regard for the X-constraint that the MAXEU
+semiring depends on, so the vtree is chosen up front instead: either given, or searched for by compiling with each
+vtree type under a time limit and keeping the smallest result.
+"""
+import multiprocessing
+import resource
+from collections import namedtuple
+
+from problog.core import transform
+from problog.formula import LogicDAG
+from problog.sdd_formula_explicit import SDDExplicit, SDDExplicitManager, build_explicit_from_logicdag
+
+try:
+    from pysdd import sdd
+    from pysdd.sdd import Vtree
+except Exception:
+    sdd = None
+
+VTREE_TYPES = ['balanced', 'right', 'left', 'vertical']
+
+# SDDManager builds its sdd.SddManager in __init__, with a balanced vtree and no hook to pass another, and keeps it in
+# this private attribute, which get_manager and the auto_gc methods read directly.
+_MANAGER_ATTRIBUTE = '_SDDManager__manager'
+
+SddOptions = namedtuple('sdd_options', 'vtree, search_time_limit, gc_threshold, gc_every')
+SddOptions.__new__.__defaults__ = ('balanced', 10.0, None, 1000)
+SddOptions.__doc__ = """
+:param vtree: The initial vtree type, one of VTREE_TYPES (within the X-constraint), or 'search'.
+:param search_time_limit: For vtree='search', the seconds given to compiling with each vtree type.
+:param gc_threshold: When set, garbage collect every gc_every apply operations if the fraction of dead nodes
+    exceeds gc_threshold.
+"""
+
+
+class ConfiguredSDDExplicitManager(SDDExplicitManager):
+    """An SDDExplicitManager with a chosen initial vtree and garbage collection thresholds."""
+
+    def __init__(self, varcount=0, auto_gc=False, var_constraint=None, options=SddOptions()):
+        SDDExplicitManager.__init__(self, varcount=varcount, auto_gc=auto_gc, var_constraint=None)
+        if not hasattr(self, _MANAGER_ATTRIBUTE):
+            raise RuntimeError('SDDManager no longer keeps its sdd manager in %s, so the vtree of this version of '
+                               'ProbLog cannot be configured' % _MANAGER_ATTRIBUTE)
+        if varcount is None or varcount <= 0:
+            varcount = 1
+        if var_constraint is not None and varcount > 1:
+            vtree = Vtree.new_with_X_constrained(var_count=varcount,
+                                                 is_X_var=self._to_x_constrained_list(varcount, var_constraint),
+                                                 vtree_type=options.vtree)
+        else:
+            vtree = Vtree(var_count=varcount, vtree_type=options.vtree)
+        manager = sdd.SddManager(var_count=varcount, auto_gc_and_minimize=auto_gc, vtree=vtree)
+        setattr(self, _MANAGER_ATTRIBUTE, manager)
+        self.options = options
+        self.operations = 0
+        self.peak_live_size = 0
+
+    def _after_apply(self):
+        self.operations += 1
+        if self.operations % self.options.gc_every == 0:
+            manager = self.get_manager()
+            self.peak_live_size = max(self.peak_live_size, manager.live_size())
+            size = manager.size()
+            if self.options.gc_threshold is not None and size > 0 and \
+                    (size - manager.live_size()) / size > self.options.gc_threshold:
+                manager.garbage_collect()
+
+    def conjoin2(self, a, b):
+        result = SDDExplicitManager.conjoin2(self, a, b)
+        self._after_apply()
+        return result
+
+    def disjoin2(self, a, b):
+        result = SDDExplicitManager.disjoin2(self, a, b)
+        self._after_apply()
+        return result
+
+
+class ConfiguredSDDExplicit(SDDExplicit):
+    """An SDDExplicit compiled with SddOptions."""
+
+    def __init__(self, sdd_options=SddOptions(), **kwdargs):
+        SDDExplicit.__init__(self, **kwdargs)
+        self.sdd_options = sdd_options
+
+    def _create_manager(self):
+        return ConfiguredSDDExplicitManager(auto_gc=self.auto_gc, var_constraint=self.var_constraint,
+                                            varcount=self.init_varcount, options=self.sdd_options)
+
+
+transform(LogicDAG, ConfiguredSDDExplicit, build_explicit_from_logicdag)
+
+
+def phase_stats(kc):
+    """Node counts of kc's manager and the peak memory of this process so far (in kB)."""
+    manager = kc.get_manager()
+    sdd_manager = manager.get_manager()
+    return {'size': sdd_manager.size(),
+            'live_size': sdd_manager.live_size(),
+            'peak_live_size': max(getattr(manager, 'peak_live_size', 0), sdd_manager.live_size()),
+            'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def _compiled_size(lf, var_constraint, options, queue):
+    kc = ConfiguredSDDExplicit.create_from(lf, var_constraint=var_constraint, sdd_options=options)
+    queue.put(kc.get_manager().get_manager().size())
+
+
+def search_vtree(lf, var_constraint, options):
+    """
+    Compile lf with each vtree type in VTREE_TYPES, each in a separate process given options.search_time_limit
+    seconds, and return the type giving the smallest SDD ('balanced' if none finished).
+    """
+    ctx = multiprocessing.get_context('fork')
+    best, best_size = 'balanced', None
+    for vtree in VTREE_TYPES:
+        queue = ctx.Queue()
+        process = ctx.Process(target=_compiled_size, args=(lf, var_constraint, options._replace(vtree=vtree), queue))
+        process.start()
+        process.join(options.search_time_limit)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        elif not queue.empty():
+            size = queue.get()
+            if best_size is None or size < best_size:
+                best, best_size = vtree, size
+    return best
+
+
+def compile_sddx(lf, var_constraint, options):
+    """Compile lf into an X-constrained SDD under options."""
+    if options.vtree == 'search':
+        options = options._replace(vtree=search_vtree(lf, var_constraint, options))
+    return ConfiguredSDDExplicit.create_from(lf, var_constraint=var_constraint, sdd_options=options)
@@ -12,6 +12,7 @@ from problog import get_evaluatable
 import problog.evaluator
 
 from lfi_term import LfiTerm
+import backend
 
 LFI_TERM_NAME = 't'
 EU_TERM_NAME = 's'
@@ -51,7 +52,8 @@ printer = PrinterDefault()
 class ULearner:
 
     def __init__(self, db, util_examples, lfi_p_init_value=0.5, lfi_u_init_value=0,
-                 batch_size=32, max_epoch=100, convergence_threshold=1, learning_rate=0.4):
+                 batch_size=32, max_epoch=100, convergence_threshold=1, learning_rate=0.4,
+                 evaluatable_name="ddnnf", family=None):
         """
         Initialise the utility learner
 
@@ -61,6 +63,8 @@ class ULearner:
         :type util_examples: list[tuple[list[(Term, bool)], int]]
         :param batch_size: The batch size used in gradient descent.
         :type batch_size: int
+        :param evaluatable_name: The knowledge compiler to use, or 'auto' to select one per formula (see
+        backend.choose), using and extending the timings recorded for family.
         """
         assert util_examples is not None
         self.util_examples = util_examples
@@ -75,6 +79,8 @@ class ULearner:
         self.max_epoch = max_epoch
         self.convergence_threshold = convergence_threshold
         self.learning_rate = learning_rate
+        self.evaluatable_name = evaluatable_name
+        self.family = family
 
         self._semiring_eu = SemiringEU()
         self._kc = None
@@ -117,10 +123,16 @@ class ULearner:
         lf = engine.ground_all(self.db, queries=queries)  # type: LogicFormula
 
         # Knowledge compilation
-        kc_class = get_evaluatable(name="ddnnf")
+        name = self.evaluatable_name
+        if name == "auto":
+            family = self.family or "default"
+            name, feats, timings = backend.choose(lf, backend.ULEARNER_BACKENDS, family)
+            printer.print("Backend %s chosen for %s with features %s" % (name, family, feats))
         starttime = time.time()
-        self._kc = kc_class.create_from(lf)  # type: DDNNF
+        self._kc = backend.compile_with(lf, name)  # type: DDNNF
         endtime = time.time()
+        if self.evaluatable_name == "auto" and timings is None:
+            backend.record_timings(family, feats, {name: endtime - starttime})
         print("Compilation took %s" % (endtime - starttime))
 
         # Processed examples
@@ -0,0 +1,36 @@
+import json
+import pandas as pd
+from experiments.framework import *
+
+#######################
+# This file runs `dappl run --time-budget`, which streams lower and upper
+# bounds on the MEU, and records the bound gap over time for each instance.
+#######################
+
+# Runs a dappl file in anytime mode, returning its status and the list of bounds it reported.
+def run_anytime (filepath : str, file : str, budget : float) :
+  cmd = Method.dappl.value + f"--time-budget {budget} " + filepath + file
+  (r, stdout) = run_cmd(Method.dappl, cmd, filepath + file, budget + 30)
+  log_run(r)
+  bounds = [json.loads(l) for l in stdout.split("\n") if l.startswith("{")]
+  # The bounds stand in for the usual report, so a clean exit with bounds is ok.
+  status = "ok" if r.status == "bad-output" and bounds else r.status
+  if status != "ok" :
+    print(f"{status.upper()} ({r.detail}) when calling " + cmd)
+  return (status, bounds)
+
+def anytime (filepath : str, files : list, budget : float = 300) :
+  rows = []
+  for file in files :
+    print(f"Calculating bounds for {file} within {budget} seconds")
+    (status, bounds) = run_anytime(filepath, file, budget)
+    if not bounds :
+      rows.append({"file" : file, "status" : status, "time" : None, "lb" : None, "ub" : None, \
+                   "gap" : None, "done" : False})
+    for b in bounds :
+      gap = None if b["lb"] is None or b["ub"] is None else b["ub"] - b["lb"]
+      rows.append({"file" : file, "status" : status, "time" : b["time"], "lb" : b["lb"], "ub" : b["ub"], \
+                   "gap" : gap, "done" : b["done"]})
+  df = pd.DataFrame(rows)
+  df.to_csv('numbers/anytime.csv', index=False)
+  return df
@@ -0,0 +1,37 @@
+import json
+import os
+import subprocess
+import tempfile
+import pandas as pd
+from experiments.framework import *
+
+#######################
+# This file drives `dappl batch`, which compiles a program once
+# and reruns MEU for every set of observations of its bound variables.
+#######################
+
+DAPPL_BATCH = "./_build/install/default/bin/dappl batch "
+
+# Writes one variant per line, as name=true|false pairs.
+def write_variants (variants : list) :
+  with tempfile.NamedTemporaryFile("w", suffix=".batch", delete=False) as f :
+    for variant in variants :
+      f.write(" ".join(f"{x}={str(v).lower()}" for (x, v) in variant.items()) + "\n")
+  return f.name
+
+# Runs MEU over variants, a list of {name : bool} dicts.
+# Returns the one-off compile time and a DataFrame with a row per variant.
+def batch (filepath : str, file : str, variants : list, to : int, cache : bool = False) :
+  variants_file = write_variants(variants)
+  cmd = DAPPL_BATCH + f"--cache {str(cache).lower()} " + filepath + file + " " + variants_file
+  try :
+    result = subprocess.run(cmd, \
+                          shell=True, \
+                          stdout=subprocess.PIPE, \
+                          stderr=subprocess.PIPE, \
+                          text=True, \
+                          timeout=to)
+  finally :
+    os.remove(variants_file)
+  lines = [json.loads(l) for l in result.stdout.split("\n") if l.startswith("{")]
+  return lines[0]["compile_time"], pd.DataFrame(lines[1:])
@@ -4,6 +4,7 @@ import os
 import numpy as np
 import pandas as pd
 from experiments.framework import *
+from testgen.bif2dappl import generate_all, network_name
 
 #######################
 # This file runs
@@ -15,29 +16,42 @@ class BN(Enum):
   earthquake = "earthquake"
   survey = "survey"
 
+# Other networks are BIF files (or Dice programs), by path or by name in this directory.
+bif_path = "testgen/bn/bif"
+
 # Get a list of all filenames in the directory
 directory_path = "testgen/bn/problog"
 problog_filenames = os.listdir(directory_path)
 
 # print(problog_filenames)
 
-def run_bn (method : Method, b : BN, \
+# b is a BN member or the name of a generated network.
+def run_bn (method : Method, b : BN | str, \
             lbl : int, d : int, \
             to : int, times : int ) :
+  b = b.value if isinstance(b, BN) else b
   match method :
     case Method.dappl :
       filepath = "testgen/bn/processed/"
-      filename = f"{b.value}_{lbl}_method{d}.dappl"
+      filename = f"{b}_{lbl}_method{d}.dappl"
       # print(filepath+filename)
       return run_n_times(method, filepath, filename, to, times)
     case _ :
       filepath = "testgen/bn/problog/"
-      filename = f"{b.value}_{lbl}_method{d}.pl"
+      filename = f"{b}_{lbl}_method{d}.pl"
       # print(filepath+filename)
       return run_n_times(method, filepath, filename, to, times)
 
-def bn_gen(n : int) :
-  for bn in BN :
+def bif_of (network : str) :
+  return network if os.path.exists(network) else os.path.join(bif_path, f"{network}.bif")
+
+def bn_gen(n : int, networks : list = None) :
+  networks = [b.value if isinstance(b, BN) else b for b in (networks or list(BN))]
+  bifs = [bif_of(bn) for bn in networks if bn not in BN.__members__]
+  if bifs :
+    print(f"Generating {n} benchmarks per method from {', '.join(bifs)}")
+    generate_all(bifs, n)
+  for bn in [BN[bn] for bn in networks if bn in BN.__members__] :
     cmd = f"./_build/install/default/bin/dappl test {bn.value} {n}"
     print(cmd)
     subprocess.run(cmd, \
@@ -46,20 +60,23 @@ def bn_gen(n : int) :
                         stderr=subprocess.PIPE, \
                         text=True)
 
-def bn(n : int) :
-  columns_of_df = [f"{b}_{i}" for b in list(BN.__members__.keys()) for i in [1,2]]
+# networks are names of BN members, or BIF files by path or name (default: every BN member).
+def bn(n : int, networks : list = None) :
+  networks = [b.value if isinstance(b, BN) else b for b in (networks or list(BN))]
+  names = [bn if bn in BN.__members__ else network_name(bif_of(bn)) for bn in networks]
+  columns_of_df = [f"{b}_{i}" for b in names for i in [1,2]]
   columns_of_df = [[f"{i}_mean", f"{i}_stdev"] for i in columns_of_df]
   columns_of_df =  list(chain.from_iterable(columns_of_df))
   df = pd.DataFrame(index=list(Method.__members__.keys()), columns=columns_of_df)
 
-  bn_gen(n)
+  bn_gen(n, networks)
 
   for method in Method :
-    for bn in BN:
+    for bn in names :
         for ty in [1,2] :
             print(f"+++++++++++++++++++++++++++++++++++++")
             print(f"Doing BN benchmark on Method {method.name}")
-            print(f"Bayesian network : {bn.value}, Decision inserted via type {ty}")
+            print(f"Bayesian network : {bn}, Decision inserted via type {ty}")
             print(f"+++++++++++++++++++++++++++++++++++++\n\n")
             l = []
             for lbl in range(n) :
@@ -67,8 +84,8 @@ def bn(n : int) :
                 l = l + run_bn(method, bn, lbl, ty, 300, 5)
             if avg_stdev(l) is not None :
               (a,b) = avg_stdev(l)
-              avg_str = f"{bn.name}_{ty}_mean"
-              stdev_str = f"{bn.name}_{ty}_stdev"
+              avg_str = f"{bn}_{ty}_mean"
+              stdev_str = f"{bn}_{ty}_stdev"
               df.loc[method.name, avg_str] = a
               df.loc[method.name, stdev_str] = b
             else : continue
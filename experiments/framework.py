@@ -1,4 +1,11 @@
+import csv
+import itertools
+import os
+import signal
 import subprocess
+import tempfile
+import threading
+from collections import namedtuple
 import numpy as np
 from enum import Enum
 
@@ -12,49 +19,272 @@ class Method(Enum):
   problog = "problog dt -v "
   derk = "python3.11 derkinderen/maxeu.py "
 
-# Runs a process and collects the time taken.
-def run (method : Method, filepath : str, file : str, to : int) :
-  cmd = method.value + filepath + file
-  result = subprocess.run(cmd, \
-                        shell=True, \
-                        stdout=subprocess.PIPE, \
-                        stderr=subprocess.PIPE, \
-                        text=True, \
-                        timeout=to)
+# If set, dappl runs share their results (MEU and size) through this directory,
+# across repetitions and across harness processes.
+RESULT_CACHE = os.environ.get("DAPPL_RESULT_CACHE")
+# If set, dappl runs drop the ub cache past this many MB (see `dappl run --ub-cache-limit`).
+UB_CACHE_LIMIT = os.environ.get("DAPPL_UB_CACHE_LIMIT")
+# If set, dappl runs compile loops in this mode (see `dappl run --loops`).
+LOOPS = os.environ.get("DAPPL_LOOPS")
+# If set, dappl runs reuse the front end cached next to each source file (see `dappl run --ast-cache`).
+AST_CACHE = os.environ.get("DAPPL_AST_CACHE")
+# If set, every solver run is limited to this much memory in MB, and killed past it.
+# Unlike UB_CACHE_LIMIT, this applies to every method and is enforced from outside.
+MEM_LIMIT = int(os.environ["DAPPL_MEM_LIMIT"]) if os.environ.get("DAPPL_MEM_LIMIT") else None
+# If set, the memory limit is enforced by a child of this cgroup (v2) per run, rather than by
+# RLIMIT_AS. The harness must be allowed to create children in it and move processes into them,
+# and the memory controller must be enabled in its cgroup.subtree_control.
+CGROUP = os.environ.get("DAPPL_CGROUP")
+# If set, every run is recorded in this csv.
+RUN_LOG = os.environ.get("DAPPL_RUN_LOG")
+
+# status is one of ok, timeout, oom, crash or bad-output; time is the time the solver
+# reports and meu the MEU dappl reports (None unless ok), and peak_mb the peak memory of the run,
+# measured as peak_source says:
+#   dappl  : the peak resident set size dappl reports for itself,
+#   cgroup : the memory.peak of the run's cgroup,
+#   rusage : the maximum resident set size of the run, which is never below that of the
+#            harness itself since the run starts as a fork of it.
+RunRecord = namedtuple("RunRecord", \
+  "method, file, status, time, meu, peak_mb, peak_source, limit_mb, returncode, detail")
+
+# What the solvers print when an allocation fails: OCaml (the uncaught exception, and the
+# runtime's fatal error), Rust, Python and C++ respectively.
+OOM_MESSAGES = ["Out_of_memory", "out of memory", "memory allocation of", "MemoryError", "std::bad_alloc"]
+# What OCaml prints when the stack cannot grow. Under RLIMIT_AS the stack counts against the
+# limit, so this is how a run that exhausted it in deep recursion fails: it is an oom there,
+# and a crash (a recursion too deep for the stack limit) otherwise.
+STACK_OVERFLOW = "Stack_overflow"
+
+_cgroups = itertools.count()
+
+def command (method : Method, filepath : str, file : str) :
+  if method != Method.dappl :
+    return method.value + filepath + file
+  flags = ""
+  if RESULT_CACHE :
+    flags += f"--result-cache {RESULT_CACHE} "
+  if UB_CACHE_LIMIT :
+    flags += f"--ub-cache-limit {UB_CACHE_LIMIT} "
+  if LOOPS :
+    flags += f"--loops {LOOPS} "
+  if AST_CACHE :
+    flags += "--ast-cache "
+  return method.value + flags + filepath + file
+
+# The time taken, as reported in the output of a method.
+def parse_time (method : Method, stdout : str) :
   match method :
     case Method.dappl :
-      meu = result.stdout.split("\n")[1]
+      meu = stdout.split("\n")[1]
       return float(meu.split(" ")[-1])
     case Method.problog :
       # print(result.stdout)
-      relevant = result.stdout.split('\n')[2:5]
+      relevant = stdout.split('\n')[2:5]
       asdf = list(map(lambda x: x.split(" ")[-1], relevant))
       jkl = list(map(lambda x : float(x[:-1]), asdf))
       return sum(jkl)
     case Method.derk :
-      relevant = result.stdout.split('\n')
+      relevant = stdout.split('\n')
       l = [relevant[0], relevant[4], relevant[7]]
       l = list(map(lambda x : float(x.split(" ")[-2]), l))
       return sum(l)
 
-# Runs a process n times and collects the time taken.
-def run_n_times (method : Method, filepath : str, file : str, to : int, times : int) :
-  cmd = method.value + filepath + file
+# The MEU, as reported in the output of dappl (None for other methods).
+def parse_meu (method : Method, stdout : str) :
+  if method != Method.dappl :
+    return None
+  return float(stdout.split("\n")[0].split(" ")[-1])
+
+# The peak memory in MB, as reported in the output of dappl (None for other methods,
+# or if dappl did not get to report it).
+def parse_peak_mb (method : Method, stdout : str) :
+  if method != Method.dappl :
+    return None
+  for l in stdout.split("\n") :
+    if l.startswith("peak memory is ") :
+      try :
+        return int(l.split(" ")[-2]) / 1024
+      except (IndexError, ValueError) :
+        return None
+  return None
+
+# A fresh child of CGROUP limited to limit MB, or None if there is no CGROUP or it cannot be used.
+def make_cgroup (limit : int) :
+  if CGROUP is None :
+    return None
+  path = os.path.join(CGROUP, f"run-{os.getpid()}-{next(_cgroups)}")
+  try :
+    os.mkdir(path)
+    with open(os.path.join(path, "memory.max"), "w") as f :
+      f.write(str(limit * 1024 * 1024))
+  except OSError as e :
+    print(f"Cannot limit memory in cgroup {CGROUP} ({e}), using RLIMIT_AS")
+    if os.path.isdir(path) :
+      os.rmdir(path)
+    return None
+  try :
+    with open(os.path.join(path, "memory.swap.max"), "w") as f :
+      f.write("0")
+  except OSError :
+    pass
+  return path
+
+def read_cgroup (path : str, file : str) :
+  try :
+    with open(os.path.join(path, file)) as f :
+      return f.read()
+  except OSError :
+    return None
+
+# Runs cmd in its own process group under a memory limit of limit MB (if any), killing the
+# group after to seconds. Returns (returncode, stdout, stderr, (peak_mb, peak_source), timed_out,
+# oom_killed, enforced_by), enforced_by being "cgroup", "rlimit" or None if there is no limit.
+def run_limited (cmd : str, to : int, limit : int = None) :
+  cgroup = make_cgroup(limit) if limit else None
+  enforced_by = None
+  if cgroup is not None :
+    cmd = f"echo $$ > {cgroup}/cgroup.procs && exec {cmd}"
+    enforced_by = "cgroup"
+  elif limit :
+    cmd = f"ulimit -v {limit * 1024} && exec {cmd}"
+    enforced_by = "rlimit"
+  with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err :
+    proc = subprocess.Popen(cmd, shell=True, stdout=out, stderr=err, start_new_session=True)
+    timed_out = threading.Event()
+    def kill () :
+      timed_out.set()
+      try :
+        os.killpg(proc.pid, signal.SIGKILL)
+      except ProcessLookupError :
+        pass
+    timer = threading.Timer(to, kill)
+    timer.start()
+    try :
+      (_, status, usage) = os.wait4(proc.pid, 0)
+    finally :
+      timer.cancel()
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # Whatever the solver left behind goes with it.
+    try :
+      os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError :
+      pass
+    # ru_maxrss is in KB, and covers the descendants the solver waited for.
+    peak_mb = usage.ru_maxrss / 1024
+    peak_source = "rusage"
+    oom_killed = False
+    if cgroup is not None :
+      peak = read_cgroup(cgroup, "memory.peak")
+      if peak is not None :
+        peak_mb = int(peak) / (1024 * 1024)
+        peak_source = "cgroup"
+      events = read_cgroup(cgroup, "memory.events") or ""
+      counts = dict(l.split(" ") for l in events.splitlines())
+      oom_killed = int(counts.get("oom_kill", 0)) > 0
+      try :
+        os.rmdir(cgroup)
+      except OSError :
+        pass
+    out.seek(0)
+    err.seek(0)
+    stdout = out.read().decode(errors="replace")
+    stderr = err.read().decode(errors="replace")
+  return (proc.returncode, stdout, stderr, (peak_mb, peak_source), timed_out.is_set(), oom_killed, enforced_by)
+
+# Classifies a run from what run_limited returns, as (status, time, meu, detail).
+def classify (method : Method, code : int, stdout : str, stderr : str, to : int, \
+              timed_out : bool = False, oom_killed : bool = False, enforced_by : str = None) :
+  last = stderr.strip().split("\n")[-1]
+  if timed_out :
+    return ("timeout", None, None, f"after {to} seconds")
+  if oom_killed or any(m in stderr for m in OOM_MESSAGES) :
+    return ("oom", None, None, last)
+  if STACK_OVERFLOW in stderr :
+    return ("oom" if enforced_by == "rlimit" else "crash", None, None, last)
+  if code < 0 :
+    return ("crash", None, None, signal.Signals(-code).name)
+  if code != 0 :
+    return ("crash", None, None, last)
+  try :
+    return ("ok", parse_time(method, stdout), parse_meu(method, stdout), "")
+  except (IndexError, ValueError) :
+    return ("bad-output", None, None, stdout.strip().split("\n")[0])
+
+# Runs cmd, a command of the given method on file, once and classifies the run.
+# Returns the RunRecord and the stdout of the run, for callers that parse more of it.
+def run_cmd (method : Method, cmd : str, file : str, to : int, limit : int = MEM_LIMIT) :
+  (code, stdout, stderr, (peak_mb, peak_source), timed_out, oom_killed, enforced_by) = run_limited(cmd, to, limit)
+  (status, t, meu, detail) = classify(method, code, stdout, stderr, to, timed_out, oom_killed, enforced_by)
+  # dappl's own figure is preferred, as it is the same with or without a cgroup.
+  reported = parse_peak_mb(method, stdout)
+  if reported is not None :
+    (peak_mb, peak_source) = (reported, "dappl")
+  return (RunRecord(method.name, file, status, t, meu, peak_mb, peak_source, limit, code, detail), stdout)
+
+# Runs a process once and classifies the run.
+def run (method : Method, filepath : str, file : str, to : int, limit : int = MEM_LIMIT) :
+  return run_cmd(method, command(method, filepath, file), filepath + file, to, limit)[0]
+
+def log_run (r : RunRecord) :
+  if RUN_LOG is None :
+    return
+  os.makedirs(os.path.dirname(RUN_LOG) or ".", exist_ok=True)
+  new = not os.path.exists(RUN_LOG)
+  with open(RUN_LOG, "a", newline="") as f :
+    w = csv.writer(f)
+    if new :
+      w.writerow(RunRecord._fields)
+    w.writerow(r)
+
+# Runs dappl and collects the front-end time (parsing and conversion to Boolean formulae)
+# and the back-end time (compilation and MEU), separately.
+def run_phases (filepath : str, file : str, to : int) :
+  cmd = command(Method.dappl, filepath, file)
+  result = subprocess.run(cmd, \
+                        shell=True, \
+                        stdout=subprocess.PIPE, \
+                        stderr=subprocess.PIPE, \
+                        text=True, \
+                        timeout=to)
+  lines = result.stdout.split("\n")
+  front_end = next(l for l in lines if l.startswith("Front-end time"))
+  back_end = next(l for l in lines if l.startswith("Back-end time"))
+  return (float(front_end.split(" ")[-1]), float(back_end.split(" ")[-1]))
+
+# Runs a process up to n times, recording every run; stops at the first run
+# that times out or runs out of memory, as the others would too.
+def run_records (method : Method, filepath : str, file : str, to : int, times : int, \
+                 limit : int = MEM_LIMIT) :
+  cmd = command(method, filepath, file)
   # print(cmd)
-  collect = []
+  records = []
   for i in range(times) :
-    try :
-      res = run (method, filepath, file, to)
-      collect.append(res)
-    except subprocess.TimeoutExpired :
-      timeout = f"TIMEOUT happened after " + str(to) \
-                + " seconds when calling " + cmd
-      print(timeout)
-      collect = []
-      break
-    except :
-      print(f"uhoh bad")
-  return collect
+    r = run(method, filepath, file, to, limit)
+    log_run(r)
+    records.append(r)
+    match r.status :
+      case "ok" :
+        continue
+      case "timeout" :
+        print(f"TIMEOUT happened after " + str(to) + " seconds when calling " + cmd)
+        break
+      case "oom" :
+        print(f"OOM happened under a limit of {r.limit_mb} MB when calling " + cmd)
+        break
+      case _ :
+        print(f"{r.status.upper()} ({r.detail}) when calling " + cmd)
+  return records
+
+# The times taken by the runs, or none if one of them timed out or ran out of memory.
+def times_of (records : list) :
+  if any(r.status in ("timeout", "oom") for r in records) :
+    return []
+  return [r.time for r in records if r.status == "ok"]
+
+# Runs a process n times and collects the time taken.
+def run_n_times (method : Method, filepath : str, file : str, to : int, times : int) :
+  return times_of(run_records(method, filepath, file, to, times))
 
 # Takes a list of times taken and returns the average and standard deviation.
 def avg_stdev(data : list) :
@@ -0,0 +1,40 @@
+import os
+import pandas as pd
+from experiments.framework import *
+
+#######################
+# This file sweeps the BDD variable ordering strategies of `dappl run --order`
+# and records the BDD size and time taken by each.
+#######################
+
+ORDERS = ["encounter", "min-fill", "interaction", \
+          "encounter,decisions-first", "encounter,decisions-last", \
+          "min-fill,decisions-first", "min-fill,decisions-last"]
+
+# Runs a dappl file once under a given order, returning its RunRecord and size (None unless ok).
+def run_order (filepath : str, file : str, order : str, to : int) :
+  cmd = Method.dappl.value + f"--order {order} " + filepath + file
+  (r, stdout) = run_cmd(Method.dappl, cmd, filepath + file, to)
+  log_run(r)
+  if r.status != "ok" :
+    print(f"{r.status.upper()} ({r.detail}) when calling " + cmd)
+    return (r, None)
+  return (r, int(stdout.split("\n")[2].split(" ")[-1]))
+
+def ordering (filepath : str, files : list, to : int = 300, orders : list = ORDERS) :
+  rows = []
+  for file in files :
+    for order in orders :
+      print(f"Calculating numbers for {file} with order {order}")
+      (r, size) = run_order(filepath, file, order, to)
+      rows.append({"file" : file, "order" : order, "status" : r.status, "time" : r.time, "size" : size, \
+                   "peak_mb" : r.peak_mb})
+  df = pd.DataFrame(rows)
+  df.to_csv('numbers/ordering.csv', index=False)
+  return df
+
+# Sweeps every gridworld instance that has been generated into testgen/grid/.
+def gridworld_ordering (to : int = 300) :
+  filepath = "testgen/grid/"
+  files = sorted(f for f in os.listdir(filepath) if f.endswith(".dappl"))
+  return ordering(filepath, files, to)
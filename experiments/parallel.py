@@ -0,0 +1,30 @@
+import pandas as pd
+from experiments.framework import *
+
+#######################
+# This file sweeps the number of worker processes of `dappl run --jobs`
+# and records the time taken and MEU found with each.
+#######################
+
+JOBS = [1, 2, 4, 8, 16, 32]
+
+# Runs a dappl file once with a given number of jobs, returning its RunRecord.
+def run_jobs (filepath : str, file : str, jobs : int, to : int) :
+  cmd = Method.dappl.value + f"--jobs {jobs} " + filepath + file
+  (r, _) = run_cmd(Method.dappl, cmd, filepath + file, to)
+  log_run(r)
+  if r.status != "ok" :
+    print(f"{r.status.upper()} ({r.detail}) when calling " + cmd)
+  return r
+
+def parallel (filepath : str, files : list, to : int = 300, jobs : list = JOBS) :
+  rows = []
+  for file in files :
+    for n in jobs :
+      print(f"Calculating numbers for {file} with {n} jobs")
+      r = run_jobs(filepath, file, n, to)
+      rows.append({"file" : file, "jobs" : n, "status" : r.status, "meu" : r.meu, "time" : r.time, \
+                   "peak_mb" : r.peak_mb})
+  df = pd.DataFrame(rows)
+  df.to_csv('numbers/parallel.csv', index=False)
+  return df
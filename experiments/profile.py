@@ -0,0 +1,60 @@
+import json
+import os
+import tempfile
+import pandas as pd
+from experiments.framework import *
+
+#######################
+# This file collects `dappl run --profile` traces, with and without the
+# upper-bound cache, and tabulates them per benchmark family.
+#######################
+
+# Runs a dappl file once with profiling on, returning its RunRecord and the parsed JSON
+# profile (None unless the run is ok).
+def run_profile (filepath : str, file : str, cache : bool, to : int) :
+  with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f :
+    out = f.name
+  cmd = Method.dappl.value + f"--cache {str(cache).lower()} --profile {out} " + filepath + file
+  try :
+    (r, _) = run_cmd(Method.dappl, cmd, filepath + file, to)
+    log_run(r)
+    if r.status != "ok" :
+      print(f"{r.status.upper()} ({r.detail}) when calling " + cmd)
+      return (r, None)
+    with open(out) as f :
+      return (r, json.load(f))
+  finally :
+    os.remove(out)
+
+# Flattens a profile into one table row, with one column per phase.
+def profile_row (family : str, file : str, cache : bool, status : str, profile : dict) :
+  row = {"family" : family, "file" : file, "cache" : cache, "status" : status}
+  for (k, v) in profile.items() :
+    if k == "phases" :
+      row.update({f"t_{p}" : t for (p, t) in v.items()})
+    elif k == "decision_levels" :
+      row["decision_levels"] = len(v)
+      row["max_level"] = max(v, default=0)
+    elif k != "file" :
+      row[k] = v
+  # how many bexpr nodes a tree walk would translate per node actually translated
+  if profile.get("translate_unique_nodes") :
+    row["sharing"] = profile["bexpr_tree_nodes"] / profile["translate_unique_nodes"]
+  return row
+
+def profile (family : str, filepath : str, files : list, to : int = 300) :
+  rows = []
+  for file in files :
+    for cache in [True, False] :
+      print(f"Profiling {file} with cache {cache}")
+      (r, p) = run_profile(filepath, file, cache, to)
+      rows.append(profile_row(family, file, cache, r.status, p or {}))
+  df = pd.DataFrame(rows)
+  df.to_csv(f'numbers/profile_{family}.csv', index=False)
+  return df
+
+# Profiles every instance that has been generated into testgen/<family>/.
+def family_profile (family : str, to : int = 300) :
+  filepath = f"testgen/{family}/"
+  files = sorted(f for f in os.listdir(filepath) if f.endswith(".dappl"))
+  return profile(family, filepath, files, to)
@@ -0,0 +1,210 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import sys
+import numpy as np
+from experiments.framework import *
+from experiments.sweep import SUITES, expand, file_of
+
+#######################
+# Performance regression suite: runs a quick subset of every family
+# (experiments/regress.json, a sweep spec as in experiments/sweep.py) and
+# compares it against a stored baseline of the same runs.
+#
+# A benchmark regresses if its times or peak memory are significantly
+# larger than the baseline's, by a one-sided Mann-Whitney U test at level
+# ALPHA, and larger by at least MIN_RATIO in median; if its MEU differs
+# from the baseline's; or if it no longer runs to completion.
+#
+# Peak memory is compared only where it was measured the same way in both
+# (see peak_source in experiments/framework.py), and never when it is the
+# rusage of the run, which includes the harness itself.
+#######################
+
+BASELINE = "numbers/regress_baseline.csv"
+SPEC = "experiments/regress.json"
+
+ALPHA = 0.01
+MIN_RATIO = 1.1
+MEU_TOL = 1e-6
+# Above this many rank assignments, the U test uses the normal approximation.
+EXACT = 200000
+
+FIELDS = ["benchmark", "status", "time", "meu", "peak_mb", "peak_source"]
+MEM_SOURCES = ["dappl", "cgroup"]
+
+# Ranks from 1, ties getting their average rank.
+def rank (a : np.ndarray) :
+  order = np.argsort(a, kind="stable")
+  ranks = np.empty(len(a))
+  ranks[order] = np.arange(1, len(a) + 1)
+  for v in np.unique(a) :
+    tied = a == v
+    ranks[tied] = ranks[tied].mean()
+  return ranks
+
+# The p-value of the one-sided Mann-Whitney U test that current tends to be
+# larger than baseline: exact over every assignment of the pooled ranks if
+# there are at most EXACT of them, by the normal approximation otherwise.
+def mann_whitney (current : list, baseline : list) :
+  (n, m) = (len(current), len(baseline))
+  if n == 0 or m == 0 :
+    return 1.0
+  ranks = rank(np.array(current + baseline, dtype=float))
+  offset = n * (n + 1) / 2
+  u = ranks[:n].sum() - offset
+  if math.comb(n + m, n) <= EXACT :
+    us = np.array([ranks[list(c)].sum() - offset for c in itertools.combinations(range(n + m), n)])
+    return float(np.mean(us >= u - 1e-9))
+  (_, ties) = np.unique(ranks, return_counts=True)
+  var = n * m / 12 * ((n + m + 1) - (ties ** 3 - ties).sum() / ((n + m) * (n + m - 1)))
+  if var == 0 :
+    return 1.0
+  z = (u - n * m / 2 - 0.5) / math.sqrt(var)
+  return 0.5 * math.erfc(z / math.sqrt(2))
+
+# The benchmarks of spec, as (name, method, filepath, file, timeout, repetitions),
+# after generating their files.
+def benchmarks (spec : list) :
+  result = []
+  for sweep in spec :
+    suite = SUITES[sweep["suite"]]
+    jobs = expand(sweep)
+    suite.gen(jobs)
+    for method in [Method[m] for m in sweep.get("methods", list(Method.__members__))] :
+      for p in jobs :
+        (filepath, file) = file_of(suite, method, p)
+        result.append((f"{sweep.get('name', sweep['suite'])}/{file}/{method.name}", method, filepath, file, \
+                       sweep.get("timeout", 300), sweep.get("repetitions", 10)))
+  return result
+
+# Runs every benchmark, all of its repetitions, and returns the runs as rows of FIELDS.
+def measure (spec : list, repetitions : int = None) :
+  rows = []
+  for (name, method, filepath, file, to, times) in benchmarks(spec) :
+    print(f"Running {name}")
+    for r in run_records(method, filepath, file, to, repetitions or times) :
+      rows.append({"benchmark" : name, "status" : r.status, "time" : r.time, "meu" : r.meu, \
+                   "peak_mb" : r.peak_mb, "peak_source" : r.peak_source})
+  return rows
+
+def write_rows (path : str, rows : list, fields : list) :
+  os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+  with open(path, "w", newline="") as f :
+    w = csv.DictWriter(f, fieldnames=fields)
+    w.writeheader()
+    w.writerows(rows)
+
+def by_benchmark (rows : list) :
+  runs = {}
+  for r in rows :
+    runs.setdefault(r["benchmark"], []).append(r)
+  return runs
+
+def column (runs : list, field : str) :
+  return [float(r[field]) for r in runs if r["status"] == "ok" and r[field] not in (None, "")]
+
+# The source of the peak memory of runs, if every run that completed measured it the same
+# way and by one of MEM_SOURCES, and None otherwise.
+def mem_source (runs : list) :
+  sources = {r.get("peak_source") for r in runs if r["status"] == "ok"}
+  return sources.pop() if len(sources) == 1 and sources <= set(MEM_SOURCES) else None
+
+# The peak memory of runs, and of their baseline old, if both were measured the same way.
+def memory (runs : list, old : list) :
+  source = mem_source(runs)
+  if source is None or source != mem_source(old) :
+    return ([], [], source)
+  return (column(runs, "peak_mb"), column(old, "peak_mb"), source)
+
+# Compares one sample against its baseline: (ratio of medians, p-value, regressed).
+def compare (current : list, baseline : list, alpha : float) :
+  if not current or not baseline :
+    return (None, None, False)
+  ratio = np.median(current) / np.median(baseline) if np.median(baseline) > 0 else None
+  p = mann_whitney(current, baseline)
+  return (ratio, p, p < alpha and ratio is not None and ratio >= MIN_RATIO)
+
+def same_meu (a : float, b : float) :
+  return abs(a - b) <= MEU_TOL * max(1.0, abs(a), abs(b))
+
+# The report of every benchmark of current against baseline, as rows.
+def report (current : list, baseline : list, alpha : float = ALPHA) :
+  base = by_benchmark(baseline)
+  rows = []
+  for (name, runs) in by_benchmark(current).items() :
+    old = base.get(name, [])
+    (time_ratio, time_p, slower) = compare(column(runs, "time"), column(old, "time"), alpha)
+    (mem, old_mem, source) = memory(runs, old)
+    (mem_ratio, mem_p, larger) = compare(mem, old_mem, alpha)
+    (meu, old_meu) = (column(runs, "meu"), column(old, "meu"))
+    verdict = []
+    if not old :
+      verdict.append("new")
+    if old and any(r["status"] == "ok" for r in old) and any(r["status"] != "ok" for r in runs) :
+      verdict.append("/".join(sorted({r["status"] for r in runs if r["status"] != "ok"})))
+    if slower :
+      verdict.append("slower")
+    if larger :
+      verdict.append("larger")
+    if meu and old_meu and not same_meu(np.median(meu), np.median(old_meu)) :
+      verdict.append("meu")
+    rows.append({"benchmark" : name, \
+                 "time_ratio" : time_ratio, "time_p" : time_p, \
+                 "mem_ratio" : mem_ratio, "mem_p" : mem_p, "mem_source" : source, \
+                 "meu" : np.median(meu) if meu else None, \
+                 "baseline_meu" : np.median(old_meu) if old_meu else None, \
+                 "verdict" : ",".join(verdict) or "ok"})
+  return rows
+
+def fmt (x, spec : str) :
+  return format("-", ">" + spec.split(".")[0]) if x is None else format(x, spec)
+
+def record (spec : list, baseline : str = BASELINE, repetitions : int = None) :
+  rows = measure(spec, repetitions)
+  write_rows(baseline, rows, FIELDS)
+  print(f"Recorded {len(rows)} runs into {baseline}")
+
+# Runs the suite against the baseline; returns whether nothing regressed. The runs and
+# the report go to runs and report, by default regress.csv and regress_report.csv in
+# the directory of the baseline.
+def check (spec : list, baseline : str = BASELINE, alpha : float = ALPHA, repetitions : int = None, \
+           runs : str = None, report_file : str = None) :
+  runs = runs or os.path.join(os.path.dirname(baseline), "regress.csv")
+  report_file = report_file or os.path.join(os.path.dirname(baseline), "regress_report.csv")
+  with open(baseline, newline="") as f :
+    old = list(csv.DictReader(f))
+  current = measure(spec, repetitions)
+  write_rows(runs, current, FIELDS)
+  rows = report(current, old, alpha)
+  write_rows(report_file, rows, list(rows[0].keys()) if rows else ["benchmark"])
+  print("+++++++++++++++++++++++++++++++++++++")
+  print(f"{'benchmark':<50} {'time':>7} {'p':>7} {'mem':>7} {'p':>7} {'source':>7}  verdict")
+  for r in rows :
+    print(f"{r['benchmark']:<50} {fmt(r['time_ratio'], '7.2f')} {fmt(r['time_p'], '7.4f')} " \
+          f"{fmt(r['mem_ratio'], '7.2f')} {fmt(r['mem_p'], '7.4f')} {r['mem_source'] or '-':>7}  {r['verdict']}")
+  failed = [r for r in rows if r["verdict"] not in ("ok", "new")]
+  print("+++++++++++++++++++++++++++++++++++++")
+  print(f"{len(failed)} of {len(rows)} benchmarks regressed")
+  return not failed
+
+if __name__ == "__main__" :
+  parser = argparse.ArgumentParser(description="Run the performance regression suite")
+  parser.add_argument("command", choices=["record", "check"], \
+                      help="record a new baseline, or check against the current one")
+  parser.add_argument("--spec", default=SPEC)
+  parser.add_argument("--baseline", default=BASELINE)
+  parser.add_argument("--alpha", type=float, default=ALPHA)
+  parser.add_argument("--repetitions", type=int, default=None, help="override the repetitions of the spec")
+  parser.add_argument("--runs", default=None, help="csv of the runs of check (default: regress.csv next to the baseline)")
+  parser.add_argument("--report", default=None, \
+                      help="csv of the report of check (default: regress_report.csv next to the baseline)")
+  args = parser.parse_args()
+  with open(args.spec) as f :
+    spec = json.load(f)
+  if args.command == "record" :
+    record(spec, args.baseline, args.repetitions)
+  elif not check(spec, args.baseline, args.alpha, args.repetitions, args.runs, args.report) :
+    sys.exit(1)
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import tempfile
+from experiments.framework import *
+
+#######################
+# This file drives `dappl sweep`, which compiles a program once
+# and reruns MEU for every new assignment of flip probabilities and rewards.
+#######################
+
+DAPPL_SWEEP = "./_build/install/default/bin/dappl sweep "
+
+# Writes one sweep point per line, as name=value pairs.
+def write_points (points : list) :
+  with tempfile.NamedTemporaryFile("w", suffix=".sweep", delete=False) as f :
+    for point in points :
+      f.write(" ".join(f"{x}={v}" for (x, v) in point.items()) + "\n")
+  return f.name
+
+# Runs a sensitivity sweep over points, a list of {name : weight} dicts.
+# Returns the one-off compile time and a (meu, time) pair per point.
+def sweep (filepath : str, file : str, points : list, to : int, cache : bool = False) :
+  points_file = write_points(points)
+  cmd = DAPPL_SWEEP + f"--cache {str(cache).lower()} " + filepath + file + " " + points_file
+  try :
+    result = subprocess.run(cmd, \
+                          shell=True, \
+                          stdout=subprocess.PIPE, \
+                          stderr=subprocess.PIPE, \
+                          text=True, \
+                          timeout=to)
+  finally :
+    os.remove(points_file)
+  lines = result.stdout.split("\n")
+  compile_time = float(lines[0].split(" ")[-1])
+  meus = [float(l.split(" ")[-1]) for l in lines if l.startswith("MEU is")]
+  times = [float(l.split(" ")[-1]) for l in lines if l.startswith("Time elapsed")]
+  return compile_time, list(zip(meus, times))
@@ -0,0 +1,251 @@
+import argparse
+import itertools
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from itertools import chain
+import pandas as pd
+from experiments.framework import *
+from experiments.bn import bn_gen
+
+#######################
+# Sharded sweeps: a declarative spec expands into jobs, which go into an
+# SQLite work queue. Any number of workers, on any number of hosts sharing
+# the queue's directory, claim jobs, run them and report their times.
+#
+# A spec is a JSON list of sweeps, each
+#   {"suite" : "gridworld",
+#    "params" : {"states" : [5], "rocks" : {"range" : [3, 5]}, ...},
+#    "exclude" : [{"rocks" : 4, "horizon" : 1}],
+#    "methods" : ["dappl"], "timeout" : 300, "repetitions" : 5,
+#    "name" : "grid_dappl", "key" : ["states", "rocks", "horizon", "instances"]}
+# where a range is inclusive, an excluded job is one that matches every given
+# parameter, name is the csv written by collect (default: the suite) and key
+# the parameters naming its columns (default: all). experiments/paper.json
+# is the sweep of experiment.py.
+#
+# A claimed job is leased to its worker, which renews the lease while it
+# runs. A job whose lease expired (its worker died) is claimable again,
+# until it has been tried MAX_ATTEMPTS times.
+#
+# SQLite relies on the file locks of the filesystem: on NFS, these need
+# lockd (the default of most mounts, but not of `nolock` ones).
+#######################
+
+DAPPL_TEST = "./_build/install/default/bin/dappl test "
+
+# Seconds a lease lasts without being renewed.
+LEASE = 120
+MAX_ATTEMPTS = 3
+
+Suite = namedtuple("Suite", "params, gen, dappl_path, problog_path, stem")
+
+def gen_commands (cmds : set) :
+  for cmd in sorted(cmds) :
+    print(DAPPL_TEST + cmd)
+    subprocess.run(DAPPL_TEST + cmd, \
+                        shell=True, \
+                        stdout=subprocess.PIPE, \
+                        stderr=subprocess.PIPE, \
+                        text=True)
+
+def gen_bn (jobs : list) :
+  for network in {p["network"] for p in jobs} :
+    bn_gen(max(p["lbl"] for p in jobs if p["network"] == network) + 1, [network])
+
+def gen_grid (jobs : list) :
+  instances = {}
+  for p in jobs :
+    k = (p["states"], p["rocks"], p["horizon"])
+    instances[k] = max(instances.get(k, 0), p["instances"])
+  gen_commands({f"gridworld {s} {r} {h} {n}" for ((s, r, h), n) in instances.items()})
+
+SUITES = {
+  "bn" : Suite(["network", "lbl", "type"], gen_bn, \
+               "testgen/bn/processed/", "testgen/bn/problog/", "{network}_{lbl}_method{type}"),
+  "dr" : Suite(["columns"], lambda jobs : gen_commands({f"mdp {p['columns']}" for p in jobs}), \
+               "testgen/mdp/", "testgen/mdp/", "mdp{columns}"),
+  "ladder" : Suite(["columns", "depth"], \
+                   lambda jobs : gen_commands({f"ladder {p['columns']} {p['depth']}" for p in jobs}), \
+                   "testgen/ladder/", "testgen/ladder/", "ladder{columns}_{depth}"),
+  "gridworld" : Suite(["states", "rocks", "horizon", "instances"], gen_grid, \
+                      "testgen/grid/", "testgen/grid/", "grid_{states}_{rocks}_{horizon}_{instances}"),
+}
+
+def values (v) :
+  if isinstance(v, dict) :
+    (low, high) = v["range"]
+    return list(range(low, high + 1))
+  return v if isinstance(v, list) else [v]
+
+# The parameter assignments of a sweep, in the suite's parameter order.
+def expand (sweep : dict) :
+  suite = SUITES[sweep["suite"]]
+  ranges = [values(sweep["params"][p]) for p in suite.params]
+  jobs = [dict(zip(suite.params, combo)) for combo in itertools.product(*ranges)]
+  excluded = sweep.get("exclude", [])
+  return [p for p in jobs if not any(all(p[k] == v for (k, v) in ex.items()) for ex in excluded)]
+
+def file_of (suite : Suite, method : Method, p : dict) :
+  if method == Method.dappl :
+    return (suite.dappl_path, suite.stem.format(**p) + ".dappl")
+  return (suite.problog_path, suite.stem.format(**p) + ".pl")
+
+def connect (db : str) :
+  conn = sqlite3.connect(db, timeout=600, isolation_level=None)
+  conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    sweep TEXT, suite TEXT, params TEXT, method TEXT,
+    filepath TEXT, file TEXT, timeout INTEGER, repetitions INTEGER,
+    status TEXT DEFAULT 'pending', worker TEXT, lease_until REAL,
+    attempts INTEGER DEFAULT 0, times TEXT, started REAL, finished REAL,
+    outcomes TEXT, peak_mb REAL,
+    UNIQUE (sweep, params, method))""")
+  conn.execute("CREATE TABLE IF NOT EXISTS sweeps (name TEXT PRIMARY KEY, spec TEXT)")
+  return conn
+
+# Generates the files of every sweep in spec and queues its jobs.
+# Queueing a job again leaves it as it is, so a spec can be extended and re-queued.
+def enqueue (db : str, spec : list) :
+  conn = connect(db)
+  for sweep in spec :
+    suite = SUITES[sweep["suite"]]
+    name = sweep.get("name", sweep["suite"])
+    jobs = expand(sweep)
+    suite.gen(jobs)
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("INSERT OR REPLACE INTO sweeps VALUES (?, ?)", (name, json.dumps(sweep)))
+    for method in [Method[m] for m in sweep.get("methods", list(Method.__members__))] :
+      for p in jobs :
+        (filepath, file) = file_of(suite, method, p)
+        conn.execute("""INSERT OR IGNORE INTO jobs
+          (sweep, suite, params, method, filepath, file, timeout, repetitions)
+          VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", \
+          (name, sweep["suite"], json.dumps(p), method.name, filepath, file, \
+           sweep.get("timeout", 300), sweep.get("repetitions", 5)))
+    conn.execute("COMMIT")
+    print(f"Queued {len(jobs)} jobs per method for {name}")
+
+# Claims the next job for worker, after releasing the jobs of dead workers.
+def claim (conn, worker : str, lease : int) :
+  now = time.time()
+  conn.execute("BEGIN IMMEDIATE")
+  conn.execute("""UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, worker = NULL
+    WHERE status = 'leased' AND lease_until < ?""", (MAX_ATTEMPTS, now))
+  job = conn.execute("""SELECT id, method, filepath, file, timeout, repetitions FROM jobs
+    WHERE status = 'pending' ORDER BY id LIMIT 1""").fetchone()
+  if job is not None :
+    conn.execute("""UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?,
+      attempts = attempts + 1, started = ? WHERE id = ?""", (worker, now + lease, now, job[0]))
+  conn.execute("COMMIT")
+  return job
+
+# Renews the lease of job every third of a lease, until stop is set.
+def heartbeat (db : str, job : int, worker : str, lease : int, stop : threading.Event) :
+  conn = connect(db)
+  while not stop.wait(lease / 3) :
+    conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ?", \
+                 (time.time() + lease, job, worker))
+  conn.close()
+
+# Runs jobs until the queue is empty (or, with wait, forever).
+def work (db : str, worker : str = None, lease : int = LEASE, wait : bool = False) :
+  worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+  conn = connect(db)
+  while True :
+    job = claim(conn, worker, lease)
+    if job is None :
+      if not wait :
+        return
+      time.sleep(lease / 3)
+      continue
+    (id, method, filepath, file, to, times) = job
+    print(f"[{worker}] Running {method} on {filepath}{file}")
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(db, id, worker, lease, stop), daemon=True)
+    beat.start()
+    try :
+      records = run_records(Method[method], filepath, file, to, times)
+    except Exception as e :
+      # The harness itself failed, not the solver; the job is not retried.
+      print(f"[{worker}] FAILED ({e!r}) on {filepath}{file}")
+      conn.execute("""UPDATE jobs SET status = 'failed', finished = ?
+        WHERE id = ? AND worker = ? AND status = 'leased'""", (time.time(), id, worker))
+      continue
+    finally :
+      stop.set()
+      beat.join()
+    # A job whose lease was lost is someone else's now; its result is dropped.
+    conn.execute("""UPDATE jobs SET status = 'done', times = ?, outcomes = ?, peak_mb = ?, finished = ?
+      WHERE id = ? AND worker = ? AND status = 'leased'""", \
+      (json.dumps(times_of(records)), json.dumps([r.status for r in records]), \
+       max((r.peak_mb for r in records if r.peak_mb is not None), default=None), time.time(), id, worker))
+
+def status (db : str) :
+  conn = connect(db)
+  for (sweep, st, n) in conn.execute("SELECT sweep, status, COUNT(*) FROM jobs GROUP BY sweep, status ORDER BY sweep") :
+    print(f"{sweep} : {n} {st}")
+  runs = {}
+  for (sweep, outcomes) in conn.execute("SELECT sweep, outcomes FROM jobs WHERE outcomes IS NOT NULL") :
+    for o in json.loads(outcomes) :
+      runs[(sweep, o)] = runs.get((sweep, o), 0) + 1
+  for ((sweep, o), n) in sorted(runs.items()) :
+    print(f"{sweep} : {n} runs {o}")
+
+# Writes numbers/{sweep}.csv for every sweep, in the layout of the other experiments:
+# one row per method, and a mean and stdev column per value of the key, over the
+# times of every job with that value.
+def collect (db : str, out : str = "numbers") :
+  conn = connect(db)
+  for (name, spec) in conn.execute("SELECT name, spec FROM sweeps").fetchall() :
+    sweep = json.loads(spec)
+    key = sweep.get("key", SUITES[sweep["suite"]].params)
+    column = lambda p : "_".join(str(p[k]) for k in key)
+    columns_of_df = list(dict.fromkeys(column(p) for p in expand(sweep)))
+    columns_of_df = [[f"{i}_mean", f"{i}_stdev"] for i in columns_of_df]
+    columns_of_df =  list(chain.from_iterable(columns_of_df))
+    df = pd.DataFrame(index=list(Method.__members__.keys()), columns=columns_of_df)
+    collected = {}
+    for (params, method, times) in conn.execute("""SELECT params, method, times FROM jobs
+        WHERE sweep = ? AND status = 'done' ORDER BY id""", (name,)) :
+      c = column(json.loads(params))
+      collected[(method, c)] = collected.get((method, c), []) + json.loads(times)
+    for ((method, c), s) in collected.items() :
+      if avg_stdev(s) is not None :
+        (a,b) = avg_stdev(s)
+        df.loc[method, f"{c}_mean"] = a
+        df.loc[method, f"{c}_stdev"] = b
+    df.to_csv(os.path.join(out, f"{name}.csv"), index=True)
+
+if __name__ == "__main__" :
+  parser = argparse.ArgumentParser(description="Run experiment sweeps from a shared work queue")
+  sub = parser.add_subparsers(dest="command", required=True)
+  q = sub.add_parser("enqueue", help="generate the benchmarks of a spec and queue its jobs")
+  q.add_argument("db")
+  q.add_argument("spec")
+  w = sub.add_parser("work", help="run queued jobs")
+  w.add_argument("db")
+  w.add_argument("--worker", default=None)
+  w.add_argument("--lease", type=int, default=LEASE)
+  w.add_argument("--wait", action="store_true", help="keep polling once the queue is empty")
+  s = sub.add_parser("status", help="count jobs by sweep and status")
+  s.add_argument("db")
+  c = sub.add_parser("collect", help="write the results of every sweep as csv")
+  c.add_argument("db")
+  c.add_argument("--out", default="numbers")
+  args = parser.parse_args()
+  match args.command :
+    case "enqueue" :
+      with open(args.spec) as f :
+        enqueue(args.db, json.load(f))
+    case "work" :
+      work(args.db, args.worker, args.lease, args.wait)
+    case "status" :
+      status(args.db)
+    case "collect" :
+      collect(args.db, args.out)
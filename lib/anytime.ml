@@ -0,0 +1,147 @@
+(*
+  Anytime MEU under a time budget.
+
+  The whole run happens in a forked child, so that compilation and MEU can
+  both be cut off at the deadline. The child splits MEU over decision
+  subtrees (see Parallel) and solves them one at a time, printing a JSON line
+  of bounds after each: the best sub-problem solved so far is a lower bound,
+  and the upper bound is the larger of it and the bound of every sub-problem
+  not solved yet. A sub-problem does no better than collecting every positive
+  reward that its decisions do not rule out (see reward_bound), so the upper
+  bound tightens as sub-problems are solved, down to the MEU once all are.
+  The parent passes these lines through and, at the deadline, kills the
+  child and repeats the last bounds it saw.
+*)
+
+open Core
+open Bc
+
+type bounds = { time : float; lb : float option; ub : float option; finished : bool }
+
+let json_of_bounds (b : bounds) : string =
+  let num = fun x -> Option.value_map x ~default:"null" ~f:(sprintf "%.17g") in
+  sprintf "{\"time\": %.17g, \"lb\": %s, \"ub\": %s, \"done\": %b}" b.time (num b.lb) (num b.ub) b.finished
+
+let bounds_of_json (s : string) : bounds =
+  let num = fun x -> if String.equal x "null" then None else Some (Float.of_string x) in
+  Scanf.sscanf s "{\"time\": %f, \"lb\": %[^,], \"ub\": %[^,], \"done\": %B}"
+    (fun time lb ub finished -> { time ; lb = num lb ; ub = num ub ; finished })
+
+let emit (b : bounds) : unit =
+  Out_channel.output_string stdout (json_of_bounds b ^ "\n");
+  Out_channel.flush stdout
+
+(* Variables that are false in every model of a formula, or All if it has no model. *)
+type forced = All | Vars of String.Set.t
+
+let union (a : forced) (b : forced) : forced =
+  match (a, b) with
+  | (All, _) | (_, All)   -> All
+  | (Vars x, Vars y)      -> Vars (Set.union x y)
+
+let inter (a : forced) (b : forced) : forced =
+  match (a, b) with
+  | (All, x) | (x, All)   -> x
+  | (Vars x, Vars y)      -> Vars (Set.inter x y)
+
+(* The variables e forces false, given the value of some variables. This is
+  an under-approximation: a negation is only looked into over a variable. *)
+let forced_false (value : string -> bool option) (e : bexpr) : forced =
+  let memo = Phys_tbl.create 1024 in
+  let none = Vars String.Set.empty in
+  let rec go e =
+    match Phys_tbl.find_opt memo e with
+    | Some r  -> r
+    | None    ->
+      let r = (match e with
+              | FF                            -> All
+              | Id x                          -> (match value x with Some false -> All | _ -> none)
+              | Not (Id x)                    -> (match value x with Some true -> All
+                                                                   | _ -> Vars (String.Set.singleton x))
+              | And(a,b)                      -> union (go a) (go b)
+              | Or(a,b)                       -> inter (go a) (go b)
+              | TT | Not _ | Xor _ | ExactlyOne _ -> none) in
+      Phys_tbl.add memo e r; r in
+  go e
+
+(* Sum of the positive reward constants that can be collected once the decisions
+  in options are taken: those of reward variables that the program does not
+  force false when each option is true and the rest of its group false. *)
+let reward_bound (prop : propexpr) (options : string list) : float =
+  let chosen  = String.Set.of_list options in
+  let fixed   = String.Set.of_list (List.concat (List.filter_map (groups prop) ~f:(fun (l, d) ->
+                  Option.some_if (d && List.exists l ~f:(Set.mem chosen)) l))) in
+  let value   = fun x -> if Set.mem chosen x then Some true
+                         else if Set.mem fixed x then Some false else None in
+  let forced  = union (forced_false value prop.unn) (forced_false value prop.acc) in
+  Map.fold prop.wtmap ~init:0. ~f:(fun ~key ~data:(_, (_, rw)) acc ->
+    let possible = (match forced with All -> false | Vars s -> not (Set.mem s key)) in
+    if String.is_prefix key ~prefix:"rew_" && possible then acc +. Float.max rw 0. else acc)
+
+(* How many sub-problems the child aims to split MEU into. *)
+let granularity = 16
+
+(* Child side: the MEU solver handed to Bc.infer. start is the start of the run. *)
+let perform_meu (start : float) (prop : propexpr) (c : compiled) (cache : bool)
+  : (float * float) * int =
+  let now         = fun () -> Core_unix.gettimeofday () -. start in
+  let subproblems = Parallel.split prop granularity in
+  let n           = List.length subproblems in
+  let ubs         = Array.of_list_map subproblems ~f:(reward_bound prop) in
+  (* the bound of the sub-problems from i on *)
+  let rest        = fun i -> Array.fold (Array.sub ubs ~pos:i ~len:(n - i)) ~init:0. ~f:Float.max in
+  emit { time = now () ; lb = None ; ub = Some (rest 0) ; finished = false };
+  List.foldi subproblems ~init:None ~f:(fun i best options ->
+    let r     = Bc.perform_meu (Parallel.condition c options) cache in
+    let best  = Some (Option.value_map best ~default:r ~f:(fun b -> Parallel.best b r)) in
+    let lb    = Option.bind best ~f:(fun ((_, meu), _) -> Option.some_if (not (Float.is_nan meu)) meu) in
+    let last  = i + 1 = n in
+    let ub    = rest (i + 1) in
+    emit { time = now () ; lb ;
+           ub = if last then lb else Some (Option.value_map lb ~default:ub ~f:(Float.max ub)) ;
+           finished = last };
+    best)
+  |> Option.value_exn
+
+(* Parent side: runs f in a child whose stdout is passed through, line by line,
+  until it exits or budget seconds after start. *)
+let run (start : float) (budget : float) (f : unit -> unit) : unit =
+  Out_channel.flush stdout;
+  let (r, w) = Core_unix.pipe () in
+  match Core_unix.fork () with
+  | `In_the_child       ->
+    Core_unix.close r;
+    Core_unix.dup2 ~src:w ~dst:Core_unix.stdout ();
+    f ();
+    Out_channel.flush stdout;
+    Core_unix.exit_immediately 0
+  | `In_the_parent pid  ->
+    Core_unix.close w;
+    let buf     = Bytes.create 4096 in
+    let pending = Buffer.create 256 in
+    let last    = ref { time = 0. ; lb = None ; ub = None ; finished = false } in
+    let flush_lines = fun () ->
+      let lines = String.split (Buffer.contents pending) ~on:'\n' in
+      Buffer.clear pending;
+      Buffer.add_string pending (List.last_exn lines);
+      List.iter (List.drop_last_exn lines) ~f:(fun l ->
+        if String.is_prefix l ~prefix:"{" then (last := bounds_of_json l; emit !last)) in
+    let rec loop () =
+      let remaining = budget -. (Core_unix.gettimeofday () -. start) in
+      if Float.(remaining <= 0.) then `Deadline else
+      let ready = Core_unix.select ~read:[r] ~write:[] ~except:[]
+                    ~timeout:(`After (Time_ns.Span.of_sec remaining)) () in
+      if List.is_empty ready.read then `Deadline else
+      let k = Core_unix.read r ~buf in
+      if k = 0 then `Exited else (
+        Buffer.add_subbytes pending buf ~pos:0 ~len:k;
+        flush_lines ();
+        loop ()) in
+    let outcome = loop () in
+    (match outcome with
+    | `Deadline -> Signal_unix.send_i Signal.kill (`Pid pid)
+    | `Exited   -> ());
+    ignore (Core_unix.waitpid pid);
+    Core_unix.close r;
+    if not !last.finished then
+      emit { !last with time = Core_unix.gettimeofday () -. start }
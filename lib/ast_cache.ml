@@ -0,0 +1,64 @@
+(*
+  An on-disk cache for dappl's front end: the core expr of a program and
+  its PropExpr, stored next to the source as FILE.bc.
+
+  An entry is a key line followed by the marshalled entry. The key digests
+  the source text, the options that change bc's output and the dappl binary
+  itself, so a stale or foreign entry is never unmarshalled. Marshal keeps
+  the sharing of the hash-consed PropExpr. Besides its output, bc leaves the
+  fresh name counter Bc.ct and the bound variables Bc.bound behind, so an
+  entry carries both and a hit restores them.
+*)
+
+open Core
+
+let path (filename : string) : string = filename ^ ".bc"
+
+let key (source : string) : string =
+  let binary = Md5.to_hex (Md5.digest_file_blocking Stdlib.Sys.executable_name) in
+  Md5.to_hex (Md5.digest_string (String.concat ~sep:"\n"
+    [source ; Bool.to_string !Bc.symbolic_loops ; binary]))
+
+let front_end_of_source (source : string) : Core_grammar.expr * Bc.propexpr =
+  let parsed   = Profile.time "parse" (fun () -> Util.parse_program source) in
+  let internal = (Core_grammar.from_external_program parsed).body in
+  (internal, Profile.time "bc" (fun () -> Bc.bc internal))
+
+type entry = {
+  expr  : Core_grammar.expr ;
+  prop  : Bc.propexpr ;
+  ct    : int ;
+  bound : (string * Bc.bexpr) list
+}
+
+let find (filename : string) (key : string) : entry option =
+  try
+    In_channel.with_file (path filename) ~binary:true ~f:(fun ic ->
+      match In_channel.input_line ic with
+      | Some k when String.equal k key  -> Some (Stdlib.Marshal.from_channel ic)
+      | _                               -> None)
+  with Sys_error _ | End_of_file | Failure _ -> None
+
+let store (filename : string) (key : string) (v : entry) : unit =
+  let tmp = sprintf "%s.%i.tmp" (path filename) (Pid.to_int (Core_unix.getpid ())) in
+  Out_channel.with_file tmp ~binary:true ~f:(fun oc ->
+    Out_channel.output_string oc (key ^ "\n");
+    Stdlib.Marshal.to_channel oc v []);
+  Stdlib.Sys.rename tmp (path filename)
+
+(* The core expr and PropExpr of filename, from the cache when it is up to date. *)
+let front_end (filename : string) : Core_grammar.expr * Bc.propexpr =
+  let source = Util.read_whole_file filename in
+  let key    = key source in
+  match Profile.time "ast_cache" (fun () -> find filename key) with
+  | Some v  ->
+    Profile.set "ast_cache_hit" (Profile.Bool true);
+    Bc.ct := v.ct;
+    Hashtbl.clear Bc.bound;
+    List.iter v.bound ~f:(fun (key, data) -> Hashtbl.set Bc.bound ~key ~data);
+    (v.expr, v.prop)
+  | None    ->
+    let (expr, prop) = front_end_of_source source in
+    let v = { expr ; prop ; ct = !Bc.ct ; bound = Hashtbl.to_alist Bc.bound } in
+    (try store filename key v with Sys_error _ -> ());
+    (expr, prop)
@@ -53,6 +53,52 @@ type bexpr =
 
 let print_bexpr = fun be -> (Sexplib0__Sexp.to_string_hum (sexp_of_bexpr be))
 
+(* build_h splices the same formula into every use of a bound variable,
+  so bexprs are DAGs in memory. Tables keyed on physical identity let us
+  walk each shared node once. *)
+module Phys_tbl = Stdlib.Hashtbl.Make (struct
+  type t = bexpr
+  let equal = phys_equal
+  let hash = Stdlib.Hashtbl.hash
+end)
+
+(* Hash-consing: rebuilds e so that structurally equal sub-formulas are one
+  physical node, each with a unique id. Children are consed first, so a node
+  is identified by its constructor and the ids of its children. *)
+type node_key =
+| Leaf      of bexpr
+| Not_k     of int
+| And_k     of int * int
+| Or_k      of int * int
+| Xor_k     of int * int
+
+type hashcons_tbl = {
+  nodes : (node_key, bexpr * int) Hashtbl.t;
+  memo  : (bexpr * int) Phys_tbl.t;
+}
+
+let new_hashcons_tbl () : hashcons_tbl =
+  { nodes = Hashtbl.Poly.create () ; memo = Phys_tbl.create 1024 }
+
+let hashcons (h : hashcons_tbl) (e : bexpr) : bexpr =
+  let cons = fun key mk ->
+    match Hashtbl.find h.nodes key with
+    | Some n  -> n
+    | None    -> let n = (mk (), Hashtbl.length h.nodes) in
+                 Hashtbl.add_exn h.nodes ~key ~data:n; n in
+  let rec go e =
+    match Phys_tbl.find_opt h.memo e with
+    | Some n  -> n
+    | None    ->
+      let n = (match e with
+              | TT | FF | Id _ | ExactlyOne _ -> cons (Leaf e) (fun () -> e)
+              | Not a     -> let (a, i) = go a in cons (Not_k i) (fun () -> Not a)
+              | And(a,b)  -> let (a, i) = go a in let (b, j) = go b in cons (And_k (i, j)) (fun () -> And(a, b))
+              | Or(a,b)   -> let (a, i) = go a in let (b, j) = go b in cons (Or_k (i, j)) (fun () -> Or(a, b))
+              | Xor(a,b)  -> let (a, i) = go a in let (b, j) = go b in cons (Xor_k (i, j)) (fun () -> Xor(a, b))) in
+      Phys_tbl.add h.memo e n; n in
+  fst (go e)
+
 (* subst e x e' = e[x/e'] *)
 let rec subst : bexpr -> string -> bexpr -> bexpr = fun e s e' -> match e with
 | Id t            -> if String.equal s t then e' else Id t
@@ -68,6 +114,38 @@ let conj (b : bexpr) (r : string list) (do_not_negate : bool) =
     List.fold r ~init:b ~f:(fun b s -> And(b, Id s))
   else List.fold r ~init:b ~f:(fun b s -> And(b, Not(Id s)))
 
+(* Renames the variables of e by f, keeping every node f leaves unchanged shared. *)
+let rename (f : string -> string) (e : bexpr) : bexpr =
+  let memo = Phys_tbl.create 1024 in
+  let rec go e =
+    match Phys_tbl.find_opt memo e with
+    | Some e' -> e'
+    | None    ->
+      let bin = fun a b mk -> let (a', b') = (go a, go b) in
+                              if phys_equal a a' && phys_equal b b' then e else mk a' b' in
+      let e' = (match e with
+              | TT | FF           -> e
+              | Id s              -> let s' = f s in if String.equal s s' then e else Id s'
+              | ExactlyOne(l, b)  -> let l' = List.map l ~f in
+                                     if List.equal String.equal l l' then e else ExactlyOne(l', b)
+              | Not a             -> let a' = go a in if phys_equal a a' then e else Not a'
+              | And(a,b)          -> bin a b (fun a b -> And(a, b))
+              | Or(a,b)           -> bin a b (fun a b -> Or(a, b))
+              | Xor(a,b)          -> bin a b (fun a b -> Xor(a, b))) in
+      Phys_tbl.add memo e e'; e' in
+  go e
+
+(* Shifts the fresh names flip_k and rew_k with first <= k < first + width by offset. *)
+let shift_fresh (first : int) (width : int) (offset : int) (x : string) : string =
+  let shift = fun prefix ->
+    Option.bind (String.chop_prefix x ~prefix) ~f:(fun k ->
+      match Int.of_string_opt k with
+      | Some k when k >= first && k < first + width -> Some (prefix ^ Int.to_string (k + offset))
+      | _                                           -> None) in
+  match shift "flip_" with
+  | Some y  -> y
+  | None    -> Option.value (shift "rew_") ~default:x
+
 (* -----------------------------------------------------------------
   Defining the weight map and elements of the expectation semiring
 ------------------------------------------------------------------ *)
@@ -97,6 +175,13 @@ let print_ident_tbl(t : ident_tbl) =
 let ct = ref (-1)
 let fresh = fun _ -> (ct := !ct + 1) ; Int.to_string !ct
 
+(* The formula of every variable bound by bc, for observations in batch mode.
+  Names refer to the last binding of that name. *)
+let bound : (string, bexpr) Hashtbl.t = Hashtbl.create (module String)
+
+(* When set, loops are compiled symbolically (see loop) rather than unrolled. *)
+let symbolic_loops = ref false
+
 
 (* -------------------------------------
   Compiling AST to PropExpr
@@ -130,9 +215,13 @@ let rec bc : expr -> propexpr = fun e ->
     tbl : maps vars to weights
     rws : extra reward variables in the cache, that are added on in the end.
   *)
+  Hashtbl.clear bound;
   let (unn, acc, tbl, rws)  = build_h e empty_tbl empty_ident_tbl in
   let final_unn             = List.fold rws ~init:unn ~f:(fun b r -> And(Id(r),b)) in
-  { unn = final_unn ; acc = acc ; wtmap = tbl}
+  let h                     = new_hashcons_tbl () in
+  let prop                  = { unn = hashcons h final_unn ; acc = hashcons h acc ; wtmap = tbl} in
+  Hashtbl.map_inplace bound ~f:(hashcons h);
+  prop
 (* which takes in an:
   expression e,
   a weight function wts
@@ -224,10 +313,12 @@ fun e' wts ids  -> match e' with
                         | _       -> raise (BCError "Expected ident on Choose"))
 | Bind(x,b,e')      ->  let (phi_b, gamma_b, wt_b, rw_b) = build_h b wts ids in
                         let ids' = Map.add_exn ids ~key:x ~data:phi_b in
+                        Hashtbl.set bound ~key:x ~data:phi_b;
                         (* print_ident_tbl ids'; *)
                         let (phi_e, gamma_e, wt_e, rw_e) = build_h e' wt_b ids' in
                         (phi_e, And(gamma_b, gamma_e), wt_e, rw_b @ rw_e)
-| Loop(n,e)         ->  build_h (unroll n e) wts ids
+| Loop(n,e)         ->  if !symbolic_loops && n > 0 then loop n e wts ids
+                        else build_h (unroll n e) wts ids
 (* Boolean operations *)
 | And(a,b)          ->  let (phi_a, gamma_a, wt_a, rw_a) = build_h a wts ids in
                         let (phi_b, gamma_b, wt_b, rw_b) = build_h b wt_a ids in
@@ -240,6 +331,41 @@ fun e' wts ids  -> match e' with
                         (Xor(phi_a, phi_b), And(gamma_a, gamma_b), wt_b, rw_a @ rw_b)
 | Not(a)            ->  let (phi_a, gamma_a, wt_a, rw_a) = build_h a wts ids in
                         (Not(phi_a), gamma_a, wt_a, rw_a)
+(* Builds the body once and instantiates iteration i by shifting the fresh
+  names the body allocated by i times their number. Names and weights come
+  out as they would from building unroll n e, and formulas are equivalent.
+  So do the entries of bound: the body's bindings refer to the last
+  iteration, and LOOP_VAR_i to iteration i, unless the body rebinds it. *)
+and loop : int -> expr -> tbl -> ident_tbl -> bexpr * bexpr * tbl * string list =
+fun n e wts ids ->
+  let first                       = !ct + 1 in
+  let before                      = Hashtbl.copy bound in
+  let (phi, gamma, wts_e, rws)    = build_h e wts ids in
+  let width                       = !ct + 1 - first in
+  let body_bound                  = Hashtbl.filteri bound ~f:(fun ~key ~data ->
+                                      match Hashtbl.find before key with
+                                      | Some old  -> not (phys_equal old data)
+                                      | None      -> true) in
+  let body_wts                    = Map.to_alist (Map.filter_keys wts_e ~f:(fun x -> not (Map.mem wts x))) in
+  let iteration = fun i ->
+    if i = 0 then (phi, gamma, rws) else
+    let f = shift_fresh first width (i * width) in
+    (rename f phi, rename f gamma, List.map rws ~f) in
+  let iterations                  = List.init n ~f:iteration in
+  ct := first + n * width - 1;
+  let wts' = List.fold (List.range 1 n) ~init:wts_e ~f:(fun wts i ->
+              let f = shift_fresh first width (i * width) in
+              List.fold body_wts ~init:wts ~f:(fun wts (x, wt) -> Map.add_exn wts ~key:(f x) ~data:wt)) in
+  List.iteri iterations ~f:(fun i (phi, _, _) ->
+    let x = "LOOP_VAR_"^(Int.to_string i) in
+    if i = n - 1 || not (Hashtbl.mem body_bound x) then Hashtbl.set bound ~key:x ~data:phi);
+  let last = shift_fresh first width ((n - 1) * width) in
+  Hashtbl.iteri body_bound ~f:(fun ~key ~data ->
+    if not (String.equal key ("LOOP_VAR_"^(Int.to_string (n - 1)))) then
+      Hashtbl.set bound ~key ~data:(rename last data));
+  let phi'    = List.fold iterations ~init:TT ~f:(fun acc (phi, _, _) -> And(acc, phi)) in
+  let gamma'  = List.fold_right iterations ~init:TT ~f:(fun (_, gamma, _) acc -> And(gamma, acc)) in
+  (phi', gamma', wts', List.concat_map iterations ~f:(fun (_, _, rws) -> rws))
 and unroll : int -> expr -> expr =
 fun n e ->
   let list_of_names = List.init n ~f:(fun i -> "LOOP_VAR_"^(Int.to_string i)) in
@@ -305,23 +431,75 @@ let print_seen_vars(t : seen_vars) =
 type decision_list = (string, rsdd_bdd_ptr, String.comparator_witness) Map.t
 let empty_decisions : decision_list = Map.empty (module String)
 
-let rec translate (prop : propexpr) : cf * rsdd_tbl =
+(* Every PropExpr variable that has been given an RSDD variable,
+  with its label and pointer. Lets us find weights by name later on. *)
+let vars : (string, int64 * rsdd_bdd_ptr) Hashtbl.t = Hashtbl.create (module String)
+
+(* translate memoises every shared node of the PropExpr to its BDD.
+  translate_calls counts the calls, hits included, and translate_hits
+  the calls answered from the memo, for --profile. *)
+let translated : rsdd_bdd_ptr Phys_tbl.t = Phys_tbl.create 1024
+let translate_calls = ref 0
+let translate_hits = ref 0
+
+(* A compiled program keeps the builder and the variable map alive,
+  so that new weights can be swapped in without recompiling. *)
+type compiled =
+{
+  cf        : cf;
+  builder   : rsdd_bdd_builder;
+  raw_unn   : rsdd_bdd_ptr;
+  eus       : rsdd_tbl;
+  seen      : seen_vars;
+  decisions : decision_list;
+}
+
+let wmc_params_of_tbl (eus : rsdd_tbl) : rsdd_wmc_params_e_u =
+  new_wmc_params_eu (List.map (Map.to_alist ~key_order:`Increasing eus) ~f:snd)
+
+(* RSDD orders variables by allocation. Variables listed in order are
+  allocated up front, in that order; the rest on first encounter.
+  order must only mention variables that occur in prop. *)
+let rec compile ?(order = []) (prop : propexpr) : compiled =
   let builder                   = mk_bdd_builder_default_order 0L in
+  dlist := [];
+  Hashtbl.clear vars;
+  Phys_tbl.reset translated;
+  translate_calls := 0;
+  translate_hits := 0;
+  let (eus, seen)               = List.fold order ~init:(empty_tbl, empty_seen_vars)
+                                    ~f:(fun (eus, seen) x ->
+                                      if Map.mem seen x then (eus, seen) else
+                                      let (lbl, ptr) = bdd_new_var builder true in
+                                      Hashtbl.set vars ~key:x ~data:(lbl, ptr);
+                                      (Map.add_exn eus ~key:lbl ~data:(Map.find_exn prop.wtmap x),
+                                       Map.add_exn seen ~key:x ~data:ptr)) in
   (* Format.printf "Printing unn\n"; *)
-  let (ptr_unn, wt_map', sv, d) = _translate prop.unn prop.wtmap empty_tbl empty_seen_vars empty_decisions builder in
+  let (ptr_unn, wt_map', sv, d) = Profile.time "translate_unn" (fun () ->
+                                    _translate prop.unn prop.wtmap eus seen empty_decisions builder) in
   (* Format.printf "Printing acc\n"; *)
-  let (ptr_acc, wt_map'', _, _) = _translate prop.acc prop.wtmap wt_map' sv d builder in
-  let wt_map_list               = Map.to_alist ~key_order:`Increasing wt_map'' in
-  let wmcparams                 = new_wmc_params_eu (
-                                    List.map
-                                      wt_map_list
-                                      ~f:snd) in
+  let (ptr_acc, wt_map'', sv', d') = Profile.time "translate_acc" (fun () ->
+                                    _translate prop.acc prop.wtmap wt_map' sv d builder) in
   let (n, _)                    = bdd_new_var builder true in
-  ({ unn           = bdd_and builder ptr_unn ptr_acc ;
-    acc           = ptr_acc ;
-    decision_vars = (List.map (List.rev !dlist) ~f:snd) ;
-    num_vars      = n ;
-    fn            = wmcparams }, wt_map'')
+  Profile.set "bdd_vars" (Profile.Int (Int64.to_int_exn n));
+  Profile.set "decision_vars" (Profile.Int (List.length !dlist));
+  Profile.set "translate_calls" (Profile.Int !translate_calls);
+  Profile.set "translate_hits" (Profile.Int !translate_hits);
+  Profile.set "translate_misses" (Profile.Int (!translate_calls - !translate_hits));
+  Profile.set "translate_unique_nodes" (Profile.Int (Phys_tbl.length translated));
+  { cf        = { unn           = bdd_and builder ptr_unn ptr_acc ;
+                  acc           = ptr_acc ;
+                  decision_vars = (List.map (List.rev !dlist) ~f:snd) ;
+                  num_vars      = n ;
+                  fn            = wmc_params_of_tbl wt_map'' } ;
+    builder   = builder ;
+    raw_unn   = ptr_unn ;
+    eus       = wt_map'' ;
+    seen      = sv' ;
+    decisions = d' }
+and translate ?order (prop : propexpr) : cf * rsdd_tbl =
+  let c = compile ?order prop in
+  (c.cf, c.eus)
 and _translate
   (exp : bexpr)
   (wts : tbl)
@@ -331,7 +509,11 @@ and _translate
   (builder : rsdd_bdd_builder)
   : rsdd_bdd_ptr * rsdd_tbl * seen_vars * decision_list =
 (* Format.printf "DOING BEXPR %s\n" (print_bexpr exp); *)
-match exp with
+translate_calls := !translate_calls + 1;
+match Phys_tbl.find_opt translated exp with
+| Some ptr  -> translate_hits := !translate_hits + 1; (ptr, eus, seen, d)
+| None      ->
+let (ptr, eus, seen, d) = (match exp with
 | TT            ->  (bdd_true builder, eus, seen, d)
 | FF            ->  (bdd_false builder, eus, seen, d)
 | Id s          ->  (match Map.find seen s with
@@ -340,6 +522,7 @@ match exp with
                                     let v     = Map.find_exn wts s in
                                     let eus'  = Map.add_exn eus ~key:x ~data:v in
                                     let seen' = Map.add_exn seen ~key:s ~data:y in
+                                    Hashtbl.set vars ~key:s ~data:(x,y);
                                     (y, eus', seen', d)
                     | Some ptr  ->  (ptr, eus, seen, d))
 | And(a,b)      ->  let (ptr_a, eus_a, seen_a, d_a)  = _translate a wts eus seen d builder in
@@ -348,37 +531,242 @@ match exp with
 | Or(a,b)       ->  let (ptr_a, eus_a, seen_a, d_a)  = _translate a wts eus seen d builder in
                     let (ptr_b, eus_b, seen_b, d_b)  = _translate b wts eus_a seen_a d_a builder in
                     (bdd_or builder ptr_a ptr_b, eus_b, seen_b, d_b)
-| Xor(a,b)      ->  _translate (And(Or(a,b), Not(And(a,b)))) wts eus seen d builder
+| Xor(a,b)      ->  let (ptr_a, eus_a, seen_a, d_a)  = _translate a wts eus seen d builder in
+                    let (ptr_b, eus_b, seen_b, d_b)  = _translate b wts eus_a seen_a d_a builder in
+                    let either                       = bdd_or builder ptr_a ptr_b in
+                    let both                         = bdd_and builder ptr_a ptr_b in
+                    (bdd_and builder either (bdd_negate builder both), eus_b, seen_b, d_b)
 | Not a         ->  let (x,y,s, d')           = _translate a wts eus seen d builder in
                     (bdd_negate builder x, y, s, d')
 | ExactlyOne(l, b)  ->  let hsh = List.fold l ~init:"" ~f:String.append in
                         match Map.find d hsh with
                         | None ->
-                          let l'              = List.map l ~f:(fun _ -> bdd_new_var builder true) in
+                          (* reuse variables that were allocated up front or seen as an Id *)
+                          let l'              = List.map l ~f:(fun x -> match Hashtbl.find vars x with
+                                                  | Some v  -> v
+                                                  | None    -> bdd_new_var builder true) in
                           let exactly_one     = bdd_exactlyone builder (List.map l' ~f:fst) in
                           let l''             = zip_with_fn l l' (fun x (y,z) -> (x,y,z)) in
                           let eus'            = List.fold l'' ~init:eus
-                                                  ~f:(fun e (x,y,_) -> Map.add_exn e ~key:y ~data:(Map.find_exn wts x)) in
+                                                  ~f:(fun e (x,y,_) -> Map.set e ~key:y ~data:(Map.find_exn wts x)) in
                           let seen'           = List.fold l'' ~init:seen
-                                                  ~f:(fun e (x,_,z) -> Map.add_exn e ~key:x ~data:z) in
+                                                  ~f:(fun e (x,_,z) -> Map.set e ~key:x ~data:z) in
                           let d'              = Map.add_exn d ~key:hsh ~data:exactly_one in
+                          List.iter l'' ~f:(fun (x,y,z) -> Hashtbl.set vars ~key:x ~data:(y,z));
                           if b then insert_decision_list (zip_with_fn l l' (fun x (y,_) -> (x, mk_varlabel y)));
                           (exactly_one, eus', seen', d')
-                        | Some ptr -> (ptr, eus, seen, d)
+                        | Some ptr -> (ptr, eus, seen, d)) in
+Phys_tbl.add translated exp ptr;
+(ptr, eus, seen, d)
 
-(* MEU. If cache is true, it is performed with caching, if not, it is just with pruning. *)
+(* MEU. If cache is true, it is performed with caching, if not, it is just with pruning.
+  Every call is counted for --profile, with its BDD size and whether it was infeasible. *)
 let perform_meu (c : cf) (cache : bool) =
-  if cache then
+  let (meu, size) = if cache then
       let (meu, _, size) = bdd_meu c.unn c.acc c.decision_vars c.num_vars c.fn in
       (extract meu, (Int64.to_int_exn size))
-  else
+    else
       let (meu, _, size) = bdd_meu_without_cache c.unn c.acc c.decision_vars c.num_vars c.fn in
-      (extract meu, (Int64.to_int_exn size))
+      (extract meu, (Int64.to_int_exn size)) in
+  Profile.add "meu_calls" 1;
+  Profile.add "meu_bdd_nodes" size;
+  if Float.is_nan (snd meu) then Profile.add "meu_infeasible" 1;
+  (meu, size)
+
+(* Swaps new flip probabilities and reward constants into a compiled program.
+  Parameters are named as in the weight map (see --debug 2); reward variables
+  are the ones prefixed with rew_, everything else is read as a probability. *)
+let reweight (c : compiled) (params : (string * float) list) : cf =
+  let is_decision = fun lbl ->
+    List.exists c.cf.decision_vars ~f:(fun d -> Int64.equal (extract_varlabel d) lbl) in
+  let eus = List.fold params ~init:c.eus ~f:(fun eus (x, v) ->
+    match Hashtbl.find vars x with
+    | None                          -> raise (BCError ("Unknown parameter "^x))
+    | Some (lbl, _) when is_decision lbl
+                                    -> raise (BCError ("Cannot reweight decision "^x))
+    | Some (lbl, _)                 ->
+      let wt = if String.is_prefix x ~prefix:"rew_" then rw_to_expect v else prob_to_expect v in
+      Map.set eus ~key:lbl ~data:wt) in
+  { c.cf with fn = wmc_params_of_tbl eus }
+
+(* RSDD never evicts from the upper-bound cache of bdd_meu, nor from its node
+  table, so memory cannot be bounded from here. With a limit (in kB), the cache
+  is only used if the process takes at most limit once compiled; past that, MEU
+  falls back to pruning alone. *)
+let ub_cache_within_limit (cache : bool) (ub_cache_limit : int option) : bool =
+  match ub_cache_limit with
+  | None    -> cache
+  | Some kb -> let rss = Mem.rss_kb () in
+               Profile.set "rss_after_compile_kb" (Profile.Int rss);
+               Profile.set "ub_cache_limit_kb" (Profile.Int kb);
+               cache && rss <= kb
+
+(* -------------------------------------
+  Canonical forms and the result cache
+
+RSDD cannot serialise BDDs, so compiled programs cannot be cached.
+What we persist across runs is the result of a run, its MEU and BDD
+size, keyed by a digest of the canonical PropExpr, the order in which
+RSDD variables get allocated and every option that affects the result.
+-------------------------------------- *)
+
+let rec flatten_and (e : bexpr) (l : bexpr list) : bexpr list = match e with
+| And(a,b)  -> flatten_and a (flatten_and b l)
+| x         -> x :: l
+let rec flatten_or (e : bexpr) (l : bexpr list) : bexpr list = match e with
+| Or(a,b)   -> flatten_or a (flatten_or b l)
+| x         -> x :: l
+
+(* Digest of e up to flattening, reordering and deduplication of And/Or operands. *)
+let canonical_digest (e : bexpr) : string =
+  let memo = Phys_tbl.create 1024 in
+  let operands = fun tag l ->
+    tag ^ String.concat ~sep:"," (List.dedup_and_sort l ~compare:String.compare) in
+  let rec go e =
+    match Phys_tbl.find_opt memo e with
+    | Some d  -> d
+    | None    ->
+      let d = (match e with
+              | TT                -> "T"
+              | FF                -> "F"
+              | Id s              -> "I" ^ s
+              | And _             -> operands "A" (List.map (flatten_and e []) ~f:go)
+              | Or _              -> operands "O" (List.map (flatten_or e []) ~f:go)
+              | Xor(a,b)          -> "X" ^ String.concat ~sep:"," (List.sort [go a; go b] ~compare:String.compare)
+              | Not a             -> "N" ^ go a
+              | ExactlyOne(l, b)  -> operands ("E" ^ Bool.to_string b) l) in
+      let d = Md5.to_hex (Md5.digest_string d) in
+      Phys_tbl.add memo e d; d in
+  go e
+
+(* The order in which translate allocates RSDD variables: first encounter in unn, then acc. *)
+let encounter_order (prop : propexpr) : string list =
+  let visited = Phys_tbl.create 1024 in
+  let seen    = Hash_set.create (module String) in
+  let order   = ref [] in
+  let add     = fun x -> if not (Hash_set.mem seen x) then (Hash_set.add seen x; order := x :: !order) in
+  let rec go e =
+    if not (Phys_tbl.mem visited e) then (
+      Phys_tbl.add visited e ();
+      match e with
+      | TT | FF                       -> ()
+      | Id s                          -> add s
+      | And(a,b) | Or(a,b) | Xor(a,b) -> go a; go b
+      | Not a                         -> go a
+      | ExactlyOne(l, _)              -> List.iter l ~f:add) in
+  go prop.unn; go prop.acc;
+  List.rev !order
+
+(* -------------------------------------
+  Observations for batch mode
+
+A batch shares unn and acc between variants, each of which conjoins
+an observation (an assignment to bound variables) onto acc.
+-------------------------------------- *)
 
-(* The entire pipeline *)
-let rec infer (e : expr) (cache : bool) (debug_level : int) =
-  let pe = bc e in
-  let (cf, wt_map) = translate pe in
+let observation (obs : (string * bool) list) : bexpr =
+  List.fold obs ~init:TT ~f:(fun acc (x, b) ->
+    match Hashtbl.find bound x with
+    | Some phi  -> And(acc, if b then phi else Not phi)
+    | None      -> raise (BCError ("Unknown observed variable "^x)))
+
+(* The encounter order, extended with every variable the observations mention,
+  so that compile allocates them all before MEU's variable count is fixed. *)
+let observed_order (prop : propexpr) (variants : (string * bool) list list) : string list =
+  encounter_order { prop with acc = List.fold variants ~init:prop.acc ~f:(fun acc obs -> And(acc, observation obs)) }
+
+(* c must have been compiled with observed_order. *)
+let observe (c : compiled) (prop : propexpr) (obs : (string * bool) list) : cf =
+  let (ptr, _, _, _) = _translate (observation obs) prop.wtmap c.eus c.seen c.decisions c.builder in
+  let acc            = bdd_and c.builder c.cf.acc ptr in
+  { c.cf with unn = bdd_and c.builder c.raw_unn acc ; acc = acc }
+
+(* The ExactlyOne groups of the PropExpr, and whether each is a decision. *)
+let groups (prop : propexpr) : (string list * bool) list =
+  let visited = Phys_tbl.create 1024 in
+  let found   = ref [] in
+  let rec go e =
+    if not (Phys_tbl.mem visited e) then (
+      Phys_tbl.add visited e ();
+      match e with
+      | TT | FF | Id _                -> ()
+      | And(a,b) | Or(a,b) | Xor(a,b) -> go a; go b
+      | Not a                         -> go a
+      | ExactlyOne(l, d)              -> found := (l, d) :: !found) in
+  go prop.unn; go prop.acc;
+  List.rev !found
+
+(* Size of e as a DAG (distinct nodes in memory) and as a tree (what a naive walk visits). *)
+let dag_and_tree_size (e : bexpr) : int * float =
+  let memo = Phys_tbl.create 1024 in
+  let rec go e =
+    match Phys_tbl.find_opt memo e with
+    | Some n  -> n
+    | None    ->
+      let n = 1. +. (match e with
+                    | TT | FF | Id _ | ExactlyOne _   -> 0.
+                    | Not a                           -> go a
+                    | And(a,b) | Or(a,b) | Xor(a,b)   -> go a +. go b) in
+      Phys_tbl.add memo e n; n in
+  let tree = go e in
+  (Phys_tbl.length memo, tree)
+
+let profile_prop (prop : propexpr) : unit =
+  let (dag_unn, tree_unn) = dag_and_tree_size prop.unn in
+  let (dag_acc, tree_acc) = dag_and_tree_size prop.acc in
+  let levels              = List.filter_map (groups prop) ~f:(fun (l, d) ->
+                              if d then Some (List.length l) else None) in
+  Profile.set "bexpr_dag_nodes" (Profile.Int (dag_unn + dag_acc));
+  Profile.set "bexpr_tree_nodes" (Profile.Float (tree_unn +. tree_acc));
+  Profile.set "weighted_vars" (Profile.Int (Map.length prop.wtmap));
+  Profile.set "decision_levels" (Profile.List (List.map levels ~f:(fun n -> Profile.Int n)));
+  Profile.set "decision_space_log2"
+    (Profile.Float (List.fold levels ~init:0. ~f:(fun acc n -> acc +. Float.log2 (Float.of_int n))))
+
+(* order is the list of variables allocated up front, if any, and options
+  the other options that affect the result, each as a name=value string. *)
+let cache_key (prop : propexpr) (order : string list) (cache : bool) (options : string list) : string =
+  let wts = List.map (Map.to_alist prop.wtmap)
+              ~f:(fun (x, ((a,b),(c,d))) -> sprintf "%s:%h,%h,%h,%h" x a b c d) in
+  let parts = [canonical_digest prop.unn; canonical_digest prop.acc; Bool.to_string cache]
+              @ options @ ["|"] @ wts @ order @ ["|"] @ encounter_order prop in
+  Md5.to_hex (Md5.digest_string (String.concat ~sep:";" parts))
+
+(* The entire pipeline. With a result cache directory, results are
+  looked up by cache_key before compiling, and stored after. *)
+(* meu solves a compiled program, perform_meu unless given (see Parallel);
+  meu_options name how, for the result cache key (e.g. jobs=4).
+  prop is the PropExpr of e, if it is already known (see Ast_cache). *)
+let rec infer ?result_cache ?(order = fun _ -> []) ?ub_cache_limit ?(meu = fun _ c cache -> perform_meu c.cf cache)
+  ?(meu_options = []) ?prop (e : expr) (cache : bool) (debug_level : int) =
+  let pe = (match prop with
+           | Some pe  -> pe
+           | None     -> Profile.time "bc" (fun () -> bc e)) in
+  if !Profile.enabled then profile_prop pe;
+  let order = Profile.time "order" (fun () -> order pe) in
+  let infer_prop = infer_prop ~meu in
+  match result_cache with
+  | None      -> infer_prop e pe order ub_cache_limit cache debug_level
+  | Some dir  ->
+    let limit = Option.value_map ub_cache_limit ~default:"none" ~f:Int.to_string in
+    let key = cache_key pe order cache (("ub_cache_limit=" ^ limit) :: meu_options) in
+    (match Cache.find dir key with
+    | Some v  -> Profile.set "result_cache_hit" (Profile.Bool true);
+                 Scanf.sscanf v "%h %h %i" (fun a b size -> ((a, b), size))
+    | None    ->
+      let ((a, b), size) = infer_prop e pe order ub_cache_limit cache debug_level in
+      Cache.store dir key (sprintf "%h %h %i" a b size);
+      ((a, b), size))
+and infer_prop
+  ~(meu : propexpr -> compiled -> bool -> (float * float) * int)
+  (e : expr)
+  (pe : propexpr)
+  (order : string list)
+  (ub_cache_limit : int option)
+  (cache : bool)
+  (debug_level : int) =
+  let c = compile ~order pe in
+  let (cf, wt_map) = (c.cf, c.eus) in
   if debug_level >= 1 then(
     Format.printf "AST:\n%s\n\n" (Sexplib0__Sexp.to_string_hum ~indent:2 (Core_grammar.sexp_of_expr e)) ;
     Format.printf "UNN : \n%s\n\n" (Sexplib0__Sexp.to_string_hum ~indent:2 (sexp_of_bexpr pe.unn));
@@ -393,7 +781,11 @@ let rec infer (e : expr) (cache : bool) (debug_level : int) =
       )
     )
   );
-  perform_meu cf cache
+  let cache = ub_cache_within_limit cache ub_cache_limit in
+  Profile.set "ub_cache" (Profile.Bool cache);
+  let ((a, b), size) = Profile.time "meu" (fun () -> meu pe c cache) in
+  Profile.set "bdd_size" (Profile.Int size);
+  ((a, b), size)
 and get_varlabels (l : rsdd_var_label list) : unit =
   Format.printf("LIST OF DECISION VARLABELS:\n");
   List.iter l ~f:(fun x -> Format.printf "%i \t " (Int64.to_int_exn (extract_varlabel x)));
@@ -0,0 +1,21 @@
+(*
+  A persistent, content-addressed store for the results of runs,
+  shared between runs and between processes of the experiment harness.
+
+  Entries are plain files in a directory, named by their key.
+  Writes go through a temporary file and a rename, so concurrent
+  writers of the same key never leave a torn entry behind.
+*)
+
+open Core
+
+let path (dir : string) (key : string) : string = Filename.concat dir key
+
+let find (dir : string) (key : string) : string option =
+  try Some (In_channel.read_all (path dir key)) with Sys_error _ -> None
+
+let store (dir : string) (key : string) (data : string) : unit =
+  Core_unix.mkdir_p dir;
+  let tmp = path dir (sprintf "%s.%i.tmp" key (Pid.to_int (Core_unix.getpid ()))) in
+  Out_channel.write_all tmp ~data;
+  Stdlib.Sys.rename tmp (path dir key)
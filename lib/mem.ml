@@ -0,0 +1,22 @@
+(*
+  Memory usage of the running process, read from /proc/self/status.
+  Figures are in kB, and 0 where the kernel does not report them.
+*)
+
+open Core
+
+let status_kb (field : string) : int =
+  let parse = fun v -> Int.of_string (String.strip (String.chop_suffix_exn (String.strip v) ~suffix:"kB")) in
+  try
+    In_channel.read_lines "/proc/self/status"
+    |> List.find_map ~f:(fun l -> match String.lsplit2 l ~on:':' with
+        | Some (k, v) when String.equal k field -> Some (parse v)
+        | _                                     -> None)
+    |> Option.value ~default:0
+  with Sys_error _ -> 0
+
+(* resident set size *)
+let rss_kb () : int = status_kb "VmRSS"
+
+(* peak resident set size *)
+let peak_kb () : int = status_kb "VmHWM"
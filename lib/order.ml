@@ -0,0 +1,178 @@
+(*
+  Variable ordering heuristics for the BDD translation.
+
+  RSDD lays variables out in the order they are allocated, so by default
+  the order is whatever order translate first meets them in. Here an
+  order is picked over the PropExpr instead, and handed to Bc.compile.
+
+  A strategy is a base order, optionally followed by a decision constraint:
+    encounter | min-fill | interaction | file:PATH
+    [,decisions-first | ,decisions-last]
+  e.g. min-fill,decisions-first.
+*)
+
+open Core
+open Bc
+
+type base = Encounter | Min_fill | Interaction | File of string
+type constr = Unconstrained | Decisions_first | Decisions_last
+type strategy = base * constr
+
+let of_string (s : string) : strategy =
+  List.fold (String.split s ~on:',') ~init:(Encounter, Unconstrained) ~f:(fun (b, c) part ->
+    match part with
+    | "decisions-first" -> (b, Decisions_first)
+    | "decisions-last"  -> (b, Decisions_last)
+    | "encounter"       -> (Encounter, c)
+    | "min-fill"        -> (Min_fill, c)
+    | "interaction"     -> (Interaction, c)
+    | _                 ->
+      (match String.chop_prefix part ~prefix:"file:" with
+      | Some f  -> (File f, c)
+      | None    -> raise (BCError ("Unknown variable order "^part))))
+
+(* -------------------------------------
+  The interaction graph
+
+Variables interact if they occur together in a small sub-formula.
+The cliques of the graph are the supports of the maximal sub-formulas
+with at most clique_bound variables, plus every ExactlyOne group.
+-------------------------------------- *)
+
+let clique_bound = 8
+
+type support = Small of String.Set.t | Large
+
+let cliques (prop : propexpr) : String.Set.t list =
+  let memo  = Phys_tbl.create 1024 in
+  let found = ref [] in
+  let keep  = fun s -> match s with
+    | Small s when not (Set.is_empty s) -> found := s :: !found
+    | _                                 -> () in
+  let union = fun a b -> match a, b with
+    | Small x, Small y  -> let s = Set.union x y in
+                           if Set.length s > clique_bound then (keep a; keep b; Large) else Small s
+    | Large, _          -> keep b; Large
+    | _, Large          -> keep a; Large in
+  let rec support e =
+    match Phys_tbl.find_opt memo e with
+    | Some s  -> s
+    | None    ->
+      let s = (match e with
+              | TT | FF                       -> Small String.Set.empty
+              | Id x                          -> Small (String.Set.singleton x)
+              | Not a                         -> support a
+              | And(a,b) | Or(a,b) | Xor(a,b) -> union (support a) (support b)
+              | ExactlyOne(l, _)              ->
+                let s = String.Set.of_list l in
+                if Set.length s > clique_bound then (found := s :: !found; Large) else Small s) in
+      Phys_tbl.add memo e s; s in
+  keep (support prop.unn);
+  keep (support prop.acc);
+  !found
+
+let graph (nodes : string list) (cs : String.Set.t list) : (string, String.Hash_set.t) Hashtbl.t =
+  let g = Hashtbl.create (module String) in
+  List.iter nodes ~f:(fun x -> Hashtbl.set g ~key:x ~data:(String.Hash_set.create ()));
+  List.iter cs ~f:(fun c ->
+    Set.iter c ~f:(fun x -> Set.iter c ~f:(fun y ->
+      if not (String.equal x y) then Hash_set.add (Hashtbl.find_exn g x) y)));
+  g
+
+(* The min-fill queue: variables ordered by their score. *)
+module Scored = struct
+  type t = (int * int * int) * string [@@deriving compare, sexp]
+end
+module Scored_set = Set.Make (Scored)
+
+(* Greedy min-fill elimination, ties broken by degree then encounter position.
+  The BDD order is the reverse of the elimination order. Scores are kept in a
+  priority queue: eliminating x only changes the neighbourhoods of its
+  neighbours, and with them the fill of the neighbours' neighbours, so only
+  those are rescored. *)
+let min_fill (nodes : string list) (cs : String.Set.t list) : string list =
+  let g      = graph nodes cs in
+  let pos    = String.Table.of_alist_exn (List.mapi nodes ~f:(fun i x -> (x, i))) in
+  let fill   = fun x ->
+    let nbrs = Hash_set.to_list (Hashtbl.find_exn g x) in
+    List.foldi nbrs ~init:0 ~f:(fun i acc y ->
+      List.fold (List.drop nbrs (i+1)) ~init:acc ~f:(fun acc z ->
+        if Hash_set.mem (Hashtbl.find_exn g y) z then acc else acc + 1)) in
+  let score  = fun x -> (fill x, Hash_set.length (Hashtbl.find_exn g x), Hashtbl.find_exn pos x) in
+  let scores = String.Table.create () in
+  let queue  = ref Scored_set.empty in
+  let push   = fun x -> let s = score x in
+                        Hashtbl.set scores ~key:x ~data:s;
+                        queue := Set.add !queue (s, x) in
+  Hashtbl.iter_keys g ~f:push;
+  let order  = ref [] in
+  while not (Set.is_empty !queue) do
+    let (_, x) as top = Set.min_elt_exn !queue in
+    queue := Set.remove !queue top;
+    Hashtbl.remove scores x;
+    let nbrs = Hash_set.to_list (Hashtbl.find_exn g x) in
+    List.iter nbrs ~f:(fun y ->
+      let ny = Hashtbl.find_exn g y in
+      Hash_set.remove ny x;
+      List.iter nbrs ~f:(fun z -> if not (String.equal y z) then Hash_set.add ny z));
+    Hashtbl.remove g x;
+    let touched = String.Hash_set.of_list nbrs in
+    List.iter nbrs ~f:(fun y -> Hash_set.iter (Hashtbl.find_exn g y) ~f:(Hash_set.add touched));
+    Hash_set.iter touched ~f:(fun y ->
+      queue := Set.remove !queue (Hashtbl.find_exn scores y, y);
+      push y);
+    order := x :: !order
+  done;
+  !order
+
+(* Cuthill-McKee: breadth-first over the interaction graph, from low degree
+  nodes first, so that interacting variables end up close together. *)
+let interaction (nodes : string list) (cs : String.Set.t list) : string list =
+  let g       = graph nodes cs in
+  let deg     = fun x -> Hash_set.length (Hashtbl.find_exn g x) in
+  let by_deg  = List.stable_sort ~compare:(fun x y -> Int.compare (deg x) (deg y)) in
+  let visited = String.Hash_set.create () in
+  let order   = ref [] in
+  List.iter (by_deg nodes) ~f:(fun root ->
+    if not (Hash_set.mem visited root) then (
+      let q = Queue.singleton root in
+      Hash_set.add visited root;
+      while not (Queue.is_empty q) do
+        let x = Queue.dequeue_exn q in
+        order := x :: !order;
+        List.iter (by_deg (Hash_set.to_list (Hashtbl.find_exn g x))) ~f:(fun y ->
+          if not (Hash_set.mem visited y) then (Hash_set.add visited y; Queue.enqueue q y))
+      done));
+  List.rev !order
+
+(* Keeps the variables of every ExactlyOne group together, at the position
+  of their first member, then applies the decision constraint. *)
+let finalize (prop : propexpr) (c : constr) (order : string list) : string list =
+  let group_of  = Hashtbl.create (module String) in
+  List.iter (groups prop) ~f:(fun (l, d) ->
+    List.iter l ~f:(fun x -> Hashtbl.set group_of ~key:x ~data:(l, d)));
+  let emitted   = String.Hash_set.create () in
+  let blocks    = List.filter_map order ~f:(fun x ->
+                    if Hash_set.mem emitted x then None else
+                    match Hashtbl.find group_of x with
+                    | Some (l, d) -> List.iter l ~f:(Hash_set.add emitted); Some (l, d)
+                    | None        -> Hash_set.add emitted x; Some ([x], false)) in
+  let (decs, rest) = List.partition_tf blocks ~f:snd in
+  let blocks    = (match c with
+                  | Unconstrained   -> blocks
+                  | Decisions_first -> decs @ rest
+                  | Decisions_last  -> rest @ decs) in
+  List.concat_map blocks ~f:fst
+
+let compute ((b, c) : strategy) (prop : propexpr) : string list =
+  let nodes = encounter_order prop in
+  let base  = (match b with
+              | Encounter   -> nodes
+              | Min_fill    -> min_fill nodes (cliques prop)
+              | Interaction -> interaction nodes (cliques prop)
+              | File f      ->
+                let present = String.Hash_set.of_list nodes in
+                let listed  = String.split_on_chars (In_channel.read_all f) ~on:[' '; '\t'; '\n'; '\r']
+                              |> List.filter ~f:(Hash_set.mem present) in
+                listed @ nodes) in
+  finalize prop c base
@@ -0,0 +1,83 @@
+(*
+  Parallel MEU over decision subtrees.
+
+  The first few decision groups (in the order RSDD sees them) are fixed to
+  each of their combinations of options, giving independent sub-problems
+  that are conditioned on those options and dealt out round-robin to forked
+  workers. The MEU of the program is the best MEU among the sub-problems.
+
+  bdd_meu takes no initial lower bound, so workers cannot share bounds:
+  each sub-problem is pruned with its own bound only.
+*)
+
+open Core
+open Rsdd
+open Bc
+
+(* The decision groups to split on: groups are taken in order until they
+  yield at least jobs sub-problems. Each sub-problem is a list of options,
+  one per group. *)
+let split (prop : propexpr) (jobs : int) : string list list =
+  let decisions = List.filter_map (groups prop) ~f:(fun (l, d) ->
+                    if d && List.for_all l ~f:(Hashtbl.mem vars) then Some l else None) in
+  let rec go subproblems decisions =
+    match decisions with
+    | l :: rest when List.length subproblems < jobs ->
+      go (List.concat_map subproblems ~f:(fun s -> List.map l ~f:(fun x -> x :: s))) rest
+    | _                                             -> subproblems in
+  List.map (go [[]] decisions) ~f:List.rev
+
+let condition (c : compiled) (options : string list) : cf =
+  let lit = List.fold options ~init:(bdd_true c.builder) ~f:(fun acc x ->
+              bdd_and c.builder acc (snd (Hashtbl.find_exn vars x))) in
+  { c.cf with unn = bdd_and c.builder c.cf.unn lit ;
+              acc = bdd_and c.builder c.cf.acc lit }
+
+(* The better of two results; NaN stands for an infeasible sub-problem. *)
+let best ((x, sx) : (float * float) * int) ((y, sy) : (float * float) * int) =
+  if Float.is_nan (snd x) || (not (Float.is_nan (snd y)) && Float.(snd y > snd x))
+  then (y, Int.max sx sy) else (x, Int.max sx sy)
+
+let solve (c : compiled) (cache : bool) (subproblems : string list list) : (float * float) * int =
+  List.map subproblems ~f:(fun options -> perform_meu (condition c options) cache)
+  |> List.reduce_exn ~f:best
+
+(* Runs f in a forked child, returning a function that waits for its result.
+  The child exits with status 1 if f raises, and the parent checks the exit
+  status before it parses what the child wrote. *)
+let spawn (f : unit -> (float * float) * int) : unit -> (float * float) * int =
+  let (r, w) = Core_unix.pipe () in
+  match Core_unix.fork () with
+  | `In_the_child     ->
+    Core_unix.close r;
+    (try
+       let ((a, b), size) = f () in
+       let oc = Core_unix.out_channel_of_descr w in
+       Out_channel.output_string oc (sprintf "%h %h %i" a b size);
+       Out_channel.flush oc
+     with _ -> Core_unix.exit_immediately 1);
+    Core_unix.exit_immediately 0
+  | `In_the_parent pid ->
+    Core_unix.close w;
+    fun () ->
+      let ic = Core_unix.in_channel_of_descr r in
+      let v  = In_channel.input_all ic in
+      In_channel.close ic;
+      match Core_unix.waitpid pid with
+      | Error e -> raise (BCError (sprintf "MEU worker %s: %s" (Pid.to_string pid)
+                                     (Core_unix.Exit_or_signal.to_string_hum (Error e))))
+      | Ok ()   ->
+        (try Scanf.sscanf v "%h %h %i" (fun a b size -> ((a, b), size))
+         with Scanf.Scan_failure _ | End_of_file | Failure _ ->
+           raise (BCError (sprintf "MEU worker %s returned no result" (Pid.to_string pid))))
+
+let perform_meu (jobs : int) (prop : propexpr) (c : compiled) (cache : bool) : (float * float) * int =
+  let subproblems = split prop jobs in
+  Profile.set "jobs" (Profile.Int jobs);
+  Profile.set "subproblems" (Profile.Int (List.length subproblems));
+  if jobs <= 1 || List.length subproblems <= 1 then Bc.perform_meu c.cf cache else
+  List.init jobs ~f:(fun i -> List.filteri subproblems ~f:(fun j _ -> j % jobs = i))
+  |> List.filter ~f:(fun l -> not (List.is_empty l))
+  |> List.map ~f:(fun l -> spawn (fun () -> solve c cache l))
+  |> List.map ~f:(fun wait -> wait ())
+  |> List.reduce_exn ~f:best
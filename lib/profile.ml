@@ -0,0 +1,62 @@
+(*
+  Profile of a single dappl run: wall-clock time per phase and a set of
+  named counters, written out as one JSON object with dappl run --profile.
+
+  The branch-and-bound search itself runs inside RSDD, whose bdd_meu and
+  bdd_meu_without_cache hand back only the MEU, the policy and the BDD size:
+  nodes expanded, ub cache hits and prunes are not returned, and cannot be
+  counted without RSDD reporting them. The counters describe what we can
+  observe from OCaml: the formulas, the variables, the decision space, the
+  translate memo (translate_hits and translate_misses) and every MEU call
+  (meu_calls, meu_bdd_nodes and meu_infeasible).
+*)
+
+open Core
+
+type value =
+| Int     of int
+| Float   of float
+| String  of string
+| Bool    of bool
+| List    of value list
+
+(* counters that need an extra pass over the formulas are only collected when enabled *)
+let enabled = ref false
+
+(* phases in the order they first ran, and their accumulated time *)
+let phases : (string * float ref) list ref = ref []
+let fields : (string * value) list ref = ref []
+
+let time (phase : string) (f : unit -> 'a) : 'a =
+  let t = Core_unix.gettimeofday () in
+  let r = f () in
+  let dt = Core_unix.gettimeofday () -. t in
+  (match List.Assoc.find !phases ~equal:String.equal phase with
+  | Some acc  -> acc := !acc +. dt
+  | None      -> phases := !phases @ [(phase, ref dt)]);
+  r
+
+let set (name : string) (v : value) : unit =
+  fields := List.Assoc.add !fields ~equal:String.equal name v
+
+let add (name : string) (n : int) : unit =
+  match List.Assoc.find !fields ~equal:String.equal name with
+  | Some (Int m)  -> set name (Int (m + n))
+  | _             -> set name (Int n)
+
+let rec json_of_value (v : value) : string =
+  match v with
+  | Int i     -> Int.to_string i
+  | Float f   -> if Float.is_finite f then sprintf "%.17g" f else "null"
+  | String s  -> sprintf "%S" s
+  | Bool b    -> Bool.to_string b
+  | List l    -> "[" ^ String.concat ~sep:", " (List.map l ~f:json_of_value) ^ "]"
+
+let to_json () : string =
+  let phases = List.map !phases ~f:(fun (p, t) -> sprintf "%S: %s" p (json_of_value (Float !t))) in
+  let fields = List.rev_map !fields ~f:(fun (k, v) -> sprintf "%S: %s" k (json_of_value v)) in
+  let fields = fields @ [sprintf "\"phases\": {%s}" (String.concat ~sep:", " phases)] in
+  "{" ^ String.concat ~sep:", " fields ^ "}"
+
+let write (filename : string) : unit =
+  Out_channel.write_all filename ~data:(to_json () ^ "\n")
@@ -0,0 +1,448 @@
+import argparse
+import multiprocessing
+import os
+import random
+import re
+from collections import namedtuple
+
+#######################
+# Generates Bayesian network benchmarks from networks of any size, as
+# matching dappl and ProbLog programs, following the methodology of
+# testgen/gen.ml (Derkinderen et al., ECAI 2020):
+# - root nodes become decisions, and every other binary node has
+#   decision_rate chance to introduce a new one (see introduce_new_dec
+#   in testgen/method.ml);
+# - utilities are added by method 1 (Select) or method 2 (New).
+#
+# Networks are read either from BIF files or from Dice programs like
+# testgen/insurance.bif.txt (`let X = if ((Y == int(w; k))) then ... in`).
+# Both are streamed: a BIF file is scanned once for its structure, then
+# each CPT is read back on its own in topological order; a Dice program
+# is read one `let` at a time. Only the structure and the current CPT are
+# held in memory, and each node is written out as soon as it is read.
+#
+# A node with states s_0 .. s_{k-1} is Boolean if k = 2 (true is s_0), and
+# otherwise has one Boolean per state, x_s_i (made a fresh identifier), true when x takes s_i:
+#   x_s_i <- if x_s_0 then ff else ... if x_s_{i-1} then ff else flip q_i
+# with q_i = p_i / (1 - p_0 - ... - p_{i-1}), and x_s_{k-1} the rest.
+# In ProbLog the states are one annotated disjunction per row.
+#######################
+
+# A CPT as a decision tree over the states of the parents.
+Leaf = namedtuple("Leaf", "probs")
+Test = namedtuple("Test", "parent, state, thn, els")
+
+Node = namedtuple("Node", "name, states, parents, cpt")
+
+RESERVED = {"if", "else", "discrete", "then", "tt", "ff", "in", "loop", "return", "observe", "flip", \
+            "reward", "choose", "with", "true", "false", "fail", "not", "call", "is", "query", \
+            "evidence", "utility"}
+
+class Names :
+  # Lowercase identifiers valid in both dappl and ProbLog, unique within a network.
+  def __init__ (self) :
+    self.taken = set()
+    self.of = {}
+
+  def fresh (self, raw : str) :
+    base = re.sub(r"[^a-z0-9_]", "_", raw.lower())
+    if not re.match(r"[a-z]", base) or base in RESERVED :
+      base = "v_" + base
+    name, i = base, 1
+    while name in self.taken :
+      name, i = f"{base}_{i}", i + 1
+    self.taken.add(name)
+    return name
+
+  def node (self, raw : str) :
+    if raw not in self.of :
+      self.of[raw] = self.fresh(raw)
+    return self.of[raw]
+
+#######################
+# Reading BIF
+#######################
+
+BIF_TOKEN = re.compile(r"//[^\n]*|/\*.*?\*/|[A-Za-z0-9_.+\-]+|[{}()\[\]|,;]")
+
+# Yields (token, byte offset) over a BIF file, a line at a time.
+def bif_tokens (path : str, offset : int = 0) :
+  with open(path, "rb") as f :
+    f.seek(offset)
+    pos = offset
+    for line in f :
+      text = line.decode("utf-8", errors="replace")
+      for m in BIF_TOKEN.finditer(text) :
+        tok = m.group()
+        if not tok.startswith("/") or tok == "/" :
+          yield (tok, pos + len(text[:m.start()].encode("utf-8")))
+      pos += len(line)
+
+def skip_block (tokens) :
+  depth = 1
+  for (tok, _) in tokens :
+    depth += {"{" : 1, "}" : -1}.get(tok, 0)
+    if depth == 0 :
+      return
+
+# First pass: the states of every variable, and the parents and file offset of every CPT.
+def bif_structure (path : str) :
+  states, parents, offsets = {}, {}, {}
+  tokens = bif_tokens(path)
+  for (tok, _) in tokens :
+    if tok == "variable" :
+      name = next(tokens)[0]
+      next(tokens)
+      depth, block = 1, []
+      for (t, _) in tokens :
+        depth += {"{" : 1, "}" : -1}.get(t, 0)
+        if depth == 0 :
+          break
+        block.append(t)
+      i = block.index("[")
+      states[name] = [t for t in block[i + 3:] if t not in ("{", "}", ",", ";")]
+    elif tok == "probability" :
+      head = []
+      for (t, _) in tokens :
+        if t == ")" :
+          break
+        if t not in ("(", ",") :
+          head.append(t)
+      (t, offset) = next(tokens)
+      parents[head[0]] = head[2:] if len(head) > 1 and head[1] == "|" else []
+      offsets[head[0]] = offset
+      skip_block(tokens)
+  return states, parents, offsets
+
+def topological (parents : dict) :
+  children = {x : [] for x in parents}
+  missing = {x : len(ps) for (x, ps) in parents.items()}
+  for (x, ps) in parents.items() :
+    for p in ps :
+      children[p].append(x)
+  ready = [x for x in parents if missing[x] == 0]
+  order = []
+  while ready :
+    x = ready.pop()
+    order.append(x)
+    for c in children[x] :
+      missing[c] -= 1
+      if missing[c] == 0 :
+        ready.append(c)
+  if len(order) != len(parents) :
+    raise ValueError("The network has a cycle")
+  return order
+
+# Second pass: reads the CPT of one variable back from its offset.
+def bif_cpt (path : str, offset : int, parents : list, states : dict, child : str) :
+  rows, default, table = {}, None, None
+  tokens = bif_tokens(path, offset)
+  next(tokens)
+  key, values = None, []
+  for (tok, _) in tokens :
+    if tok == "}" :
+      break
+    if tok == "(" :
+      key = []
+      for (t, _) in tokens :
+        if t == ")" :
+          break
+        if t != "," :
+          key.append(t)
+      key = tuple(key)
+    elif tok in ("table", "default") :
+      key = tok
+    elif tok == ";" :
+      if key == "table" :
+        table = values
+      elif key == "default" :
+        default = values
+      else :
+        rows[key] = values
+      key, values = None, []
+    elif tok != "," :
+      values.append(float(tok))
+  k = len(states[child])
+  if table is not None :
+    # child states vary slowest, the last parent fastest
+    width = len(table) // k
+    def row (i : int) :
+      return [table[j * width + i] for j in range(k)]
+    flat = [[]]
+    for p in parents :
+      flat = [prefix + [s] for prefix in flat for s in states[p]]
+    rows = {tuple(assignment) : row(i) for (i, assignment) in enumerate(flat)}
+  def tree (i : int, assignment : tuple) :
+    if i == len(parents) :
+      probs = rows.get(assignment, default)
+      if probs is None :
+        raise ValueError(f"No row {assignment} in the CPT of {child}")
+      return Leaf(probs)
+    p = parents[i]
+    sub = [tree(i + 1, assignment + (s,)) for s in states[p]]
+    result = sub[-1]
+    for j in reversed(range(len(sub) - 1)) :
+      result = Test(p, j, sub[j], result)
+    return result
+  return tree(0, ())
+
+def read_bif (path : str) :
+  states, parents, offsets = bif_structure(path)
+  for x in topological(parents) :
+    yield Node(x, states[x], parents[x], bif_cpt(path, offsets[x], parents[x], states, x))
+
+#######################
+# Reading Dice programs
+#######################
+
+DICE_TOKEN = re.compile(r"==|[A-Za-z_][A-Za-z0-9_]*|[0-9.eE+\-]+|[();=,]")
+
+def dice_tokens (path : str) :
+  with open(path) as f :
+    for line in f :
+      for m in DICE_TOKEN.finditer(line) :
+        yield m.group()
+
+# expr := ( expr ) | discrete ( p ; ... ) | if ( ( X == int ( w ; k ) ) ) then expr else expr
+def dice_expr (tokens, parents : list) :
+  tok = next(tokens)
+  if tok == "(" :
+    e = dice_expr(tokens, parents)
+    next(tokens)
+    return e
+  if tok == "discrete" :
+    next(tokens)
+    probs = []
+    for t in tokens :
+      if t == ")" :
+        break
+      if t != ";" :
+        probs.append(float(t))
+    return Leaf(probs)
+  if tok == "if" :
+    next(tokens); next(tokens)
+    parent = next(tokens)
+    next(tokens); next(tokens); next(tokens); next(tokens); next(tokens)
+    state = int(float(next(tokens)))
+    next(tokens); next(tokens); next(tokens)
+    if parent not in parents :
+      parents.append(parent)
+    next(tokens)
+    thn = dice_expr(tokens, parents)
+    next(tokens)
+    return Test(parent, state, thn, dice_expr(tokens, parents))
+  raise ValueError(f"Unexpected {tok} in Dice program")
+
+def read_dice (path : str) :
+  tokens = dice_tokens(path)
+  for tok in tokens :
+    if tok == "let" :
+      name = next(tokens)
+      next(tokens)
+      parents = []
+      cpt = dice_expr(tokens, parents)
+      leaf = cpt
+      while isinstance(leaf, Test) :
+        leaf = leaf.thn
+      yield Node(name, [str(i) for i in range(len(leaf.probs))], parents, cpt)
+
+def read_network (path : str) :
+  with open(path) as f :
+    head = f.read(4096)
+  return read_dice(path) if re.search(r"^\s*let\s", head, re.MULTILINE) else read_bif(path)
+
+#######################
+# Writing dappl and ProbLog
+#######################
+
+def fmt (x : float) :
+  return repr(float(x))
+
+# q_i = p_i / (1 - p_0 - ... - p_{i-1}), the chance of s_i once s_0 .. s_{i-1} are ruled out.
+def conditional (probs : list, i : int) :
+  rest = 1.0 - sum(probs[:i])
+  return min(max(probs[i] / rest, 0.0), 1.0) if rest > 1e-12 else 0.0
+
+class Writer :
+  def __init__ (self, dappl, pl, rng : random.Random, decision_rate : float) :
+    self.dappl = dappl
+    self.pl = pl
+    self.rng = rng
+    self.decision_rate = decision_rate
+    self.names = Names()
+    self.bools_of = {}
+    self.bools = []
+    self.ct = -1
+
+  def inc (self) :
+    self.ct += 1
+    return str(self.ct)
+
+  # The Booleans of a node: its own name if binary, one per state otherwise,
+  # named after the node and the state, as raw states need not be identifiers.
+  def booleans (self, raw : str, states : list) :
+    if raw not in self.bools_of :
+      name = self.names.node(raw)
+      self.bools_of[raw] = [name] if len(states) == 2 else [self.names.fresh(f"{name}_{s}") for s in states]
+    return self.bools_of[raw]
+
+  # The dappl guard and ProbLog literal of parent == state.
+  def guard (self, parent : str, state : int) :
+    bools = self.bools_of[parent]
+    if len(bools) == 1 :
+      return (bools[0], state == 0)
+    return (bools[state], True)
+
+  def dappl_tree (self, t, leaf) :
+    if isinstance(t, Leaf) :
+      return leaf(t.probs)
+    (g, positive) = self.guard(t.parent, t.state)
+    (a, b) = (t.thn, t.els) if positive else (t.els, t.thn)
+    return f"(if {g} then {self.dappl_tree(a, leaf)} else {self.dappl_tree(b, leaf)})"
+
+  # Yields (body literals, probabilities) for every path of the tree.
+  def paths (self, t, body : list) :
+    if isinstance(t, Leaf) :
+      yield (body, t.probs)
+      return
+    (g, positive) = self.guard(t.parent, t.state)
+    (pos, neg) = (g, f"\\+{g}")
+    (yes, no) = (pos, neg) if positive else (neg, pos)
+    yield from self.paths(t.thn, body + [yes])
+    yield from self.paths(t.els, body + [no])
+
+  def rule (self, head : str, body : list) :
+    return f"{head} :- {', '.join(body)}.\n" if body else f"{head}.\n"
+
+  def node (self, n : Node) :
+    name = self.names.node(n.name)
+    bools = self.booleans(n.name, n.states)
+    self.bools += bools
+    for b in bools :
+      self.pl.write(f"query({b}).\n")
+    k = len(n.states)
+    if not n.parents :
+      self.decision(name, bools)
+      return
+    if k == 2 :
+      e = self.dappl_tree(n.cpt, lambda probs : f"flip {fmt(probs[0])}")
+      for (body, probs) in self.paths(n.cpt, []) :
+        self.pl.write(self.rule(f"{fmt(probs[0])}::{name}", body))
+      if self.rng.random() < self.decision_rate :
+        e = self.introduce_new_dec(name, e, self.rng.random())
+      self.dappl.write(f"{name} <- {e} ;\n")
+      return
+    for i in range(k - 1) :
+      leaf = lambda probs, i=i : f"flip {fmt(conditional(probs, i))}"
+      e = self.dappl_tree(n.cpt, leaf)
+      for b in reversed(bools[:i]) :
+        e = f"(if {b} then return ff else {e})"
+      self.dappl.write(f"{bools[i]} <- {e} ;\n")
+    self.dappl.write(f"{bools[-1]} <- !({' || '.join(bools[:-1])}) ;\n")
+    for (body, probs) in self.paths(n.cpt, []) :
+      head = "; ".join(f"{fmt(p)}::{b}" for (p, b) in zip(probs, bools))
+      self.pl.write(self.rule(head, body))
+
+  # Roots become decisions; a state of a k-valued root is decided on in turn,
+  # so every choice of the k-1 decisions picks exactly one state.
+  def decision (self, name : str, bools : list) :
+    if len(bools) == 1 :
+      self.dappl.write(f"{name} <- [{name}_dec] ;\n")
+      self.pl.write(f"?::{name}.\n")
+      return
+    decs = [self.names.fresh(f"{b}_dec") for b in bools[:-1]]
+    for (i, (b, dec)) in enumerate(zip(bools, decs)) :
+      e = f"[{dec}]"
+      for prev in reversed(bools[:i]) :
+        e = f"(if {prev} then return ff else {e})"
+      self.dappl.write(f"{b} <- {e} ;\n")
+      self.pl.write(f"?::{dec}.\n")
+      self.pl.write(self.rule(b, [f"\\+{prev}" for prev in decs[:i]] + [dec]))
+    self.dappl.write(f"{bools[-1]} <- !({' || '.join(bools[:-1])}) ;\n")
+    self.pl.write(self.rule(bools[-1], [f"\\+{d}" for d in decs]))
+
+  # As introduce_new_dec in testgen/method.ml: name is e, or a new decision and flip f.
+  def introduce_new_dec (self, name : str, e : str, f : float) :
+    n = self.inc()
+    dec = self.names.fresh(f"new_dec{n}")
+    self.pl.write(f"?::{dec}.\n")
+    self.pl.write(f"{fmt(f)}::{name} :- {dec}.\n")
+    return f"({dec} <- [TMP_VAR{n}] ; bind_to{n} <- {e} ; ite_{n} <- (if {dec} then flip {fmt(f)} else return ff) ; " \
+           f"return bind_to{n} || ite_{n})"
+
+  # Method 1 (Select), as in testgen/method.ml.
+  def method_1 (self) :
+    kept = []
+    for (i, x) in enumerate(self.bools) :
+      b1, b2 = self.rng.randrange(100), self.rng.randrange(100)
+      if b1 >= 80 and b2 >= 30 :
+        continue
+      r1 = f"(reward {b1} ; return tt)" if b1 < 80 else "(return tt)"
+      r2 = f"(reward {b2} ; return tt)" if b2 < 30 else "(return tt)"
+      var = self.names.fresh(f"method_1_var_{i}")
+      self.dappl.write(f"{var} <- if {x} then {r1} else {r2} ;\n")
+      if b1 < 80 :
+        self.pl.write(f"utility({x}, {b1}).\n")
+      if b2 < 30 :
+        neg = self.names.fresh(f"var{i}")
+        self.pl.write(f"{neg} :- \\+({x}).\nutility({neg}, {b2}).\n")
+      kept.append(var)
+    self.dappl.write(" && ".join(kept + ["tt"]) + "\n")
+
+  # Method 2 (New), as in testgen/method.ml.
+  def method_2 (self) :
+    rews = []
+    for i in range(6) :
+      literals = [x if self.rng.random() < 0.5 else f"!{x}" for _ in range(6) for x in self.bools]
+      sample = self.names.fresh(f"method_2_sample_{i}")
+      rew = self.names.fresh(f"method_2_rew_{i}")
+      (ra, rb) = (self.rng.uniform(-100, 100), self.rng.uniform(-100, 100))
+      self.dappl.write(f"{sample} <- {' && '.join(['tt'] + literals)} ;\n")
+      self.dappl.write(f"{rew} <- if {sample} then (reward {fmt(ra)} ; return tt) " \
+                       f"else (reward {fmt(rb)} ; return tt) ;\n")
+      body = [l if not l.startswith("!") else f"\\+{l[1:]}" for l in literals]
+      neg = self.names.fresh(f"method_2_not_{i}")
+      self.pl.write(self.rule(sample, body))
+      self.pl.write(f"utility({sample}, {fmt(ra)}).\n{neg} :- \\+{sample}.\nutility({neg}, {fmt(rb)}).\n")
+      rews.append(rew)
+    self.dappl.write(" || ".join(["ff"] + rews) + "\n")
+
+# Writes one benchmark, {network}_{lbl}_method{method}.dappl and .pl.
+def generate (path : str, network : str, lbl : int, method : int, \
+              dappl_dir : str = "testgen/bn/processed", problog_dir : str = "testgen/bn/problog", \
+              decision_rate : float = 0.5) :
+  rng = random.Random(f"{network}_{lbl}_{method}")
+  stem = f"{network}_{lbl}_method{method}"
+  with open(os.path.join(dappl_dir, stem + ".dappl"), "w") as dappl, \
+       open(os.path.join(problog_dir, stem + ".pl"), "w") as pl :
+    w = Writer(dappl, pl, rng, decision_rate)
+    for n in read_network(path) :
+      w.node(n)
+    w.method_1() if method == 1 else w.method_2()
+  return stem
+
+def _generate (args) :
+  return generate(*args)
+
+# Writes n benchmarks per method for every network, one process per benchmark.
+def generate_all (paths : list, n : int, processes : int = None, decision_rate : float = 0.5, \
+                  dappl_dir : str = "testgen/bn/processed", problog_dir : str = "testgen/bn/problog") :
+  os.makedirs(dappl_dir, exist_ok=True)
+  os.makedirs(problog_dir, exist_ok=True)
+  jobs = [(path, network_name(path), lbl, method, dappl_dir, problog_dir, decision_rate) \
+          for path in paths for lbl in range(n) for method in [1, 2]]
+  with multiprocessing.get_context("fork").Pool(processes) as pool :
+    return pool.map(_generate, jobs)
+
+def network_name (path : str) :
+  return re.sub(r"[^a-z0-9_]", "_", os.path.basename(path).split(".")[0].lower())
+
+if __name__ == "__main__" :
+  parser = argparse.ArgumentParser(description="Generate dappl and ProbLog benchmarks from BIF networks")
+  parser.add_argument("networks", nargs="+", help="BIF files or Dice programs")
+  parser.add_argument("-n", type=int, default=5, help="benchmarks per network and method")
+  parser.add_argument("--processes", type=int, default=None)
+  parser.add_argument("--decision-rate", type=float, default=0.5)
+  args = parser.parse_args()
+  for stem in generate_all(args.networks, args.n, args.processes, args.decision_rate) :
+    print(stem)
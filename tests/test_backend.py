@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+import pytest
+
+pytest.importorskip("problog")
+pytest.importorskip("pysdd")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "derkinderen"))
+
+import backend
+
+FEATS = {"atoms" : 10, "conj" : 5, "disj" : 5, "clause_size" : 20, "width" : 3}
+
+def slow_compile (lf, name, decisions, mem_cap_mb, queue) :
+  if name == "fails" :
+    raise RuntimeError(name)
+  time.sleep(0.1 if name == "fast" else 30)
+  queue.put(0.1)
+
+# A candidate cut off by the race is recorded as taking at least its limit, not as a failure.
+def test_race_censors_cut_off (monkeypatch) :
+  monkeypatch.setattr(backend, "_timed_compile", slow_compile)
+  (timings, censored) = backend.race(None, ["slow", "fails", "fast"], time_limit=1.0)
+  assert timings == {"slow" : 1.0, "fails" : None, "fast" : 0.1}
+  assert censored == {"slow"}
+
+def test_estimate_keeps_censored (tmp_path) :
+  path = str(tmp_path / "timings.json")
+  backend.record_timings("f", FEATS, {"a" : 5.0, "b" : 2.0, "c" : None}, path, censored={"a"})
+  assert backend.estimate("f", FEATS, ["a", "c"], path=path) == "a"
+  assert backend.estimate("f", FEATS, ["a", "b"], path=path) == "b"
+  # On equal means, the candidate that finished wins.
+  backend.record_timings("g", FEATS, {"a" : 2.0, "b" : 2.0}, path, censored={"a"})
+  assert backend.estimate("g", FEATS, ["a", "b"], path=path) == "b"
@@ -0,0 +1,60 @@
+import re
+import pytest
+from testgen.bif2dappl import generate, read_network
+
+# States that are not identifiers, or that become the same one.
+BIF = """network odd { }
+variable Level {
+  type discrete [ 3 ] { Low-1, 0.5, High };
+}
+variable Alarm {
+  type discrete [ 4 ] { a-b, a_b, A.B, then };
+}
+variable Ok {
+  type discrete [ 2 ] { Yes, No };
+}
+probability ( Level ) {
+  table 0.2, 0.3, 0.5;
+}
+probability ( Alarm | Level ) {
+  (Low-1) 0.1, 0.2, 0.3, 0.4;
+  (0.5) 0.25, 0.25, 0.25, 0.25;
+  (High) 0.4, 0.3, 0.2, 0.1;
+}
+probability ( Ok | Alarm ) {
+  (a-b) 0.9, 0.1;
+  (a_b) 0.8, 0.2;
+  (A.B) 0.7, 0.3;
+  (then) 0.6, 0.4;
+}
+"""
+
+DAPPL_ID = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+
+@pytest.fixture
+def network (tmp_path) :
+  path = tmp_path / "odd.bif"
+  path.write_text(BIF)
+  return str(path)
+
+def test_reads_odd_states (network) :
+  assert [n.states for n in read_network(network)] == \
+    [["Low-1", "0.5", "High"], ["a-b", "a_b", "A.B", "then"], ["Yes", "No"]]
+
+@pytest.mark.parametrize("method", [1, 2])
+def test_odd_states_become_distinct_identifiers (network, tmp_path, method) :
+  stem = generate(network, "odd", 0, method, str(tmp_path), str(tmp_path))
+  dappl = (tmp_path / f"{stem}.dappl").read_text()
+  pl = (tmp_path / f"{stem}.pl").read_text()
+  bound = [l.split(" <- ")[0] for l in dappl.splitlines() if " <- " in l]
+  assert all(DAPPL_ID.fullmatch(x) for x in bound)
+  assert len(bound) == len(set(bound))
+  queries = re.findall(r"^query\((.*)\)\.$", pl, re.M)
+  assert queries == ["level_low_1", "level_0_5", "level_high", \
+                     "alarm_a_b", "alarm_a_b_1", "alarm_a_b_2", "alarm_then", "ok"]
+  assert set(queries) <= set(bound)
+
+def test_problog_program_parses (network, tmp_path) :
+  problog = pytest.importorskip("problog.program")
+  stem = generate(network, "odd", 0, 1, str(tmp_path), str(tmp_path))
+  assert len(list(problog.PrologFile(str(tmp_path / f"{stem}.pl")))) > 0
@@ -0,0 +1,92 @@
+import os
+import pytest
+
+pytest.importorskip("numpy")
+
+import dappl_mc.sampler as sampler
+from dappl_mc import parse, parse_file, estimate, policy_of
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+SAMPLES = 1 << 16
+
+# (program, chosen alternatives, EU worked out by hand)
+EXAMPLES = [
+  ("construct_decision.dappl", [], 0.0),
+  ("destruct_decision.dappl", ["a1"], 3.0),
+  ("destruct_decision.dappl", ["a2"], 50.0),
+  ("single_decision.dappl", ["test"], 3.0),
+  # P(m) * P(flip 0.5)
+  ("discrete_test.dappl", [], 0.25),
+  # P(door2 | monty) = (1/3) / (1/3 * 0.5 + 1/3)
+  ("fullmonty.dappl", ["yes"], 2 / 3),
+  ("fullmonty.dappl", ["no"], 1 / 3),
+  # door3 is observed, which rules out the doors either choice pays on
+  ("monty_test.dappl", ["switch"], 0.0),
+  ("loop_test.dappl", ["a"], 9.0),
+  ("loop_test.dappl", ["b"], 0.0),
+  # the reward only counts where the program returns true
+  ("reward_test.dappl", [], 0.5),
+  ("tests.dappl", [], 0.5),
+]
+
+PROGRAMS = {
+  # x is fixed to true and the sample weighed by 0.3; given x, z is y
+  "likelihood_weighting" : ("""x <- flip 0.3 ;
+y <- flip 0.6 ;
+observe x ;
+z <- (if x then y else !y) ;
+if z then (reward 5 ; return tt) else return tt""", [], 3.0),
+  # a discrete is an exactly-one constraint over flips 0.9 and 0.1: odds 0.9 * 0.9 to 0.1 * 0.1
+  "discrete_odds" : ("""x <- discrete[a : 0.9, b : 0.1] ;
+choose x with
+| a -> (reward 1 ; return tt)
+| b -> return tt""", [], 81 / 82),
+  # only the chosen branch pays, and only where it returns true
+  "choose_masks_rewards" : ("""d <- [a, b] ;
+choose d with
+| a -> (reward 3 ; flip 0.5)
+| b -> (reward 100 ; return tt)""", ["a"], 1.5),
+  "loop_of_flips" : ("""loop 3 {
+  (x <- flip 0.5 ;
+  if x then (reward 1 ; return tt) else return tt)
+}""", [], 1.5),
+}
+
+# Within the reported 95% interval, widened to 4 standard errors: across this
+# many checks, a 95% interval would miss one now and then.
+def within_ci (est, eu) :
+  assert est.high - est.low == pytest.approx(2 * sampler.Z * est.stderr, abs=1e-12)
+  return abs(est.eu - eu) <= 4 * est.stderr + 1e-12
+
+@pytest.mark.parametrize("file, chosen, eu", EXAMPLES)
+def test_examples (file, chosen, eu) :
+  program = parse_file(os.path.join(ROOT, "examples", file))
+  est = estimate(program, policy_of(program, chosen), SAMPLES, processes=1, seed=0)
+  assert within_ci(est, eu), est
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_programs (name) :
+  (source, chosen, eu) = PROGRAMS[name]
+  program = parse(source)
+  est = estimate(program, policy_of(program, chosen), SAMPLES, processes=1, seed=0)
+  assert within_ci(est, eu), est
+
+# Clamping an observed flip and weighing by its probability targets the same EU
+# as rejecting the samples where it came out false, and keeps every sample.
+def test_weighting_matches_rejection (monkeypatch) :
+  (source, chosen, eu) = PROGRAMS["likelihood_weighting"]
+  program = parse(source)
+  policy = policy_of(program, chosen)
+  weighted = estimate(program, policy, SAMPLES, processes=1, seed=1)
+  monkeypatch.setattr(sampler, "observed_on_every_path", lambda e, x : False)
+  rejected = estimate(program, policy, SAMPLES, processes=1, seed=1)
+  assert within_ci(weighted, eu) and within_ci(rejected, eu)
+  assert abs(weighted.eu - rejected.eu) <= 3 * (weighted.stderr ** 2 + rejected.stderr ** 2) ** 0.5
+  assert weighted.ess == pytest.approx(SAMPLES)
+  assert rejected.ess == pytest.approx(0.3 * SAMPLES, rel=0.05)
+
+def test_chunks_in_processes () :
+  (source, chosen, eu) = PROGRAMS["loop_of_flips"]
+  program = parse(source)
+  est = estimate(program, policy_of(program, chosen), SAMPLES, processes=2, seed=0, chunk=SAMPLES // 4)
+  assert est.samples == SAMPLES and within_ci(est, eu)
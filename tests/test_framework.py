@@ -0,0 +1,74 @@
+import sys
+import pytest
+import experiments.framework as framework
+from experiments.framework import Method, classify, run_limited
+
+DAPPL_OK = "MEU is 1.5\nTime elapsed: 0.25\npeak memory is 2048 kB\n"
+
+@pytest.fixture(autouse=True)
+def no_cgroup (monkeypatch) :
+  monkeypatch.setattr(framework, "CGROUP", None)
+
+def test_ok () :
+  assert classify(Method.dappl, 0, DAPPL_OK, "", 10) == ("ok", 0.25, 1.5, "")
+
+def test_timeout_before_anything_else () :
+  (status, _, _, _) = classify(Method.dappl, -9, "", "Fatal error: exception Out_of_memory", 10, timed_out=True)
+  assert status == "timeout"
+
+@pytest.mark.parametrize("stderr", ["Fatal error: exception Out_of_memory",
+                                    "Fatal error: out of memory",
+                                    "memory allocation of 8 bytes failed",
+                                    "MemoryError",
+                                    "terminate called after throwing an instance of 'std::bad_alloc'"])
+def test_oom_messages (stderr) :
+  assert classify(Method.dappl, 2, "", stderr, 10)[0] == "oom"
+
+def test_oom_killed_by_cgroup () :
+  assert classify(Method.dappl, -9, "", "", 10, oom_killed=True, enforced_by="cgroup")[0] == "oom"
+
+@pytest.mark.parametrize("enforced_by, status", [("rlimit", "oom"), ("cgroup", "crash"), (None, "crash")])
+def test_stack_overflow (enforced_by, status) :
+  stderr = "Fatal error: exception Stack_overflow"
+  assert classify(Method.dappl, 2, "", stderr, 10, enforced_by=enforced_by) == (status, None, None, stderr)
+
+def test_crashes () :
+  assert classify(Method.dappl, -11, "", "", 10) == ("crash", None, None, "SIGSEGV")
+  assert classify(Method.dappl, 1, "", "error\nFatal error: exception Not_found", 10) \
+    == ("crash", None, None, "Fatal error: exception Not_found")
+
+def test_bad_output () :
+  assert classify(Method.dappl, 0, "MEU is nan?\n", "", 10)[0] == "bad-output"
+
+# The RLIMIT_AS fallback, end to end: without a cgroup the limit is a ulimit -v on the run.
+def test_rlimit_fallback_oom () :
+  cmd = f"{sys.executable} -c 'bytearray(1 << 31)'"
+  (code, stdout, stderr, _, timed_out, oom_killed, enforced_by) = run_limited(cmd, 60, 256)
+  assert enforced_by == "rlimit" and not oom_killed
+  assert classify(Method.problog, code, stdout, stderr, 60, timed_out, oom_killed, enforced_by)[0] == "oom"
+
+def test_rlimit_fallback_stack_overflow () :
+  cmd = "echo 'Fatal error: exception Stack_overflow' >&2; exit 2"
+  (code, stdout, stderr, _, timed_out, oom_killed, enforced_by) = run_limited(cmd, 60, 256)
+  assert enforced_by == "rlimit"
+  assert classify(Method.dappl, code, stdout, stderr, 60, timed_out, oom_killed, enforced_by)[0] == "oom"
+
+def test_no_limit () :
+  (code, _, _, _, _, _, enforced_by) = run_limited("exit 3", 60)
+  assert (code, enforced_by) == (3, None)
+
+def test_parse_peak_mb () :
+  assert framework.parse_peak_mb(Method.dappl, DAPPL_OK) == 2.0
+  assert framework.parse_peak_mb(Method.dappl, "MEU is 1.5\n") is None
+  assert framework.parse_peak_mb(Method.problog, DAPPL_OK) is None
+
+def test_peak_source () :
+  (_, _, _, (peak_mb, source), _, _, _) = run_limited("exit 0", 60)
+  assert source == "rusage" and peak_mb > 0
+
+# The sweeps over dappl flags keep the run's stdout and record why a run failed.
+def test_run_cmd () :
+  (r, stdout) = framework.run_cmd(Method.dappl, f"printf '{DAPPL_OK}'", "f.dappl", 60, None)
+  assert (r.status, r.time, r.meu, r.peak_source, stdout) == ("ok", 0.25, 1.5, "dappl", DAPPL_OK)
+  (r, _) = framework.run_cmd(Method.dappl, "echo 'Fatal error: exception Not_found' >&2; exit 2", "f.dappl", 60, None)
+  assert (r.status, r.file, r.time) == ("crash", "f.dappl", None)
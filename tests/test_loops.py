@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import pytest
+
+# Symbolic loops must give the same MEU as unrolling: `dappl run --loops symbolic`
+# against `dappl run --loops unroll`, on the built binary.
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DAPPL = os.path.join(ROOT, "_build", "install", "default", "bin", "dappl")
+
+PROGRAMS = {
+  "choice_per_iteration" : open(os.path.join(ROOT, "examples", "loop_test.dappl")).read(),
+  "fresh_flips_and_rewards" : """d <- [a,b] ;
+loop 4 {
+  (c <- flip 0.3 ;
+  if c then
+    (choose d with
+    | a -> (reward 2 ; return tt)
+    | b -> (reward 1 ; return tt))
+  else (reward 1 ; return tt))
+}
+""",
+  "nested" : """d <- [a,b] ;
+x <- flip 0.6 ;
+loop 2 {
+  loop 3 {
+    (y <- flip 0.5 ;
+    if x then
+      (choose d with
+      | a -> (reward 1 ; return y)
+      | b -> return tt)
+    else (reward 2 ; return y))
+  }
+}
+""",
+}
+
+def meu (path, mode) :
+  out = subprocess.run([DAPPL, "run", "--loops", mode, path], capture_output=True, text=True, timeout=120)
+  assert out.returncode == 0, out.stderr
+  return float(out.stdout.split("\n")[0].split(" ")[-1])
+
+@pytest.mark.skipif(not os.path.exists(DAPPL), reason="dappl is not built (dune build)")
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_symbolic_loops_match_unrolled (name, tmp_path) :
+  path = tmp_path / f"{name}.dappl"
+  path.write_text(PROGRAMS[name])
+  assert meu(str(path), "symbolic") == pytest.approx(meu(str(path), "unroll"), rel=1e-9, abs=1e-12)
+
+# Observations name the last binding of a variable, so observing the body's
+# variables and LOOP_VAR_i must mean the same under both modes.
+VARIANTS = {
+  "fresh_flips_and_rewards" : ["c=true", "c=false", "LOOP_VAR_0=true LOOP_VAR_3=true"],
+  "nested" : ["y=true", "x=true y=false", "LOOP_VAR_0=true", "LOOP_VAR_1=true LOOP_VAR_2=false"],
+}
+
+def batch (path, variants, mode) :
+  out = subprocess.run([DAPPL, "batch", "--loops", mode, path, variants], capture_output=True, text=True, timeout=120)
+  assert out.returncode == 0, out.stderr
+  return [(r["observe"], r["meu"]) for r in map(json.loads, out.stdout.splitlines()[1:])]
+
+@pytest.mark.skipif(not os.path.exists(DAPPL), reason="dappl is not built (dune build)")
+@pytest.mark.parametrize("name", sorted(VARIANTS))
+def test_symbolic_loops_match_unrolled_batch (name, tmp_path) :
+  path = tmp_path / f"{name}.dappl"
+  path.write_text(PROGRAMS[name])
+  variants = tmp_path / f"{name}.variants"
+  variants.write_text("\n".join(VARIANTS[name]) + "\n")
+  symbolic = batch(str(path), str(variants), "symbolic")
+  unrolled = batch(str(path), str(variants), "unroll")
+  assert [o for o, _ in symbolic] == [o for o, _ in unrolled]
+  for (_, s), (_, u) in zip(symbolic, unrolled) :
+    if u is None : assert s is None
+    else : assert s == pytest.approx(u, rel=1e-9, abs=1e-12)
@@ -0,0 +1,21 @@
+from experiments.regress import memory, report
+
+def runs (name, peaks, source, status="ok") :
+  return [{"benchmark" : name, "status" : status, "time" : 1.0, "meu" : 1.0, "peak_mb" : p, "peak_source" : source}
+          for p in peaks]
+
+def test_memory_compared_from_same_source () :
+  (mem, old, source) = memory(runs("a", [2.0, 3.0], "dappl"), runs("a", [1.0], "dappl"))
+  assert (mem, old, source) == ([2.0, 3.0], [1.0], "dappl")
+
+def test_memory_not_compared_across_sources_or_from_rusage () :
+  assert memory(runs("a", [2.0], "dappl"), runs("a", [1.0], "cgroup"))[:2] == ([], [])
+  assert memory(runs("a", [2.0], "rusage"), runs("a", [1.0], "rusage")) == ([], [], None)
+
+def test_report_larger () :
+  current = runs("a", [20.0] * 6, "cgroup")
+  baseline = runs("a", [10.0] * 6, "cgroup")
+  [row] = report(current, baseline)
+  assert row["mem_source"] == "cgroup" and row["verdict"] == "larger"
+  [row] = report(runs("a", [20.0] * 6, "rusage"), runs("a", [10.0] * 6, "rusage"))
+  assert row["mem_ratio"] is None and row["verdict"] == "ok"
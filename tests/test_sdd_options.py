@@ -0,0 +1,53 @@
+import os
+import sys
+import pytest
+
+pytest.importorskip("problog")
+pytest.importorskip("pysdd")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "derkinderen"))
+
+from problog.program import PrologString
+from problog.engine import DefaultEngine
+from maxeu import get_best_decision
+import sdd_options
+from sdd_options import SddOptions
+
+MODEL = """
+?::umbrella.
+?::raincoat.
+0.3::rain.
+0.5::wind.
+broken_umbrella :- umbrella, rain, wind.
+dry :- rain, raincoat.
+dry :- rain, umbrella, \\+broken_umbrella.
+dry :- \\+rain.
+utility(broken_umbrella, -40).
+utility(raincoat, -20).
+utility(umbrella, -2).
+utility(dry, 60).
+"""
+
+
+def best(options):
+  db = DefaultEngine(label_all=True, keep_order=True).prepare(PrologString(MODEL))
+  decisions, eu = get_best_decision(db, sdd_options=options)[:2]
+  return decisions, eu
+
+
+def test_gc_threshold_keeps_result(monkeypatch):
+  # A threshold of 0 collects on every apply that left a dead node.
+  dead = []
+  after_apply = sdd_options.ConfiguredSDDExplicitManager._after_apply
+  def spy(self):
+    manager = self.get_manager()
+    before = manager.size() - manager.live_size()
+    after_apply(self)
+    dead.append((before, manager.size() - manager.live_size()))
+  monkeypatch.setattr(sdd_options.ConfiguredSDDExplicitManager, "_after_apply", spy)
+  decisions, eu = best(SddOptions(gc_threshold=0.0, gc_every=1))
+  assert any(before > 0 for before, _ in dead)
+  assert all(after == 0 for _, after in dead)
+  monkeypatch.undo()
+  assert (decisions, eu) == best(None)
+  assert eu == pytest.approx(43.0)
@@ -0,0 +1,24 @@
+import experiments.sweep as sweep
+from experiments.framework import RunRecord
+
+def queue (tmp_path) :
+  db = str(tmp_path / "queue.db")
+  conn = sweep.connect(db)
+  conn.execute("""INSERT INTO jobs (sweep, suite, params, method, filepath, file, timeout, repetitions)
+    VALUES ('s', 'gridworld', '{}', 'dappl', 'testgen/grid/', 'g.dappl', 10, 2)""")
+  return (db, conn)
+
+def test_peak_of_runs_without_one (tmp_path, monkeypatch) :
+  (db, conn) = queue(tmp_path)
+  crash = RunRecord("dappl", "g.dappl", "crash", None, None, None, None, None, -11, "SIGSEGV")
+  monkeypatch.setattr(sweep, "run_records", lambda *args : [crash])
+  sweep.work(db, "w")
+  assert conn.execute("SELECT status, outcomes, peak_mb FROM jobs").fetchone() == ("done", '["crash"]', None)
+
+def test_failed_harness (tmp_path, monkeypatch) :
+  (db, conn) = queue(tmp_path)
+  def fail (*args) :
+    raise OSError("no such file")
+  monkeypatch.setattr(sweep, "run_records", fail)
+  sweep.work(db, "w")
+  assert conn.execute("SELECT status FROM jobs").fetchone() == ("failed",)